@@ -1,16 +1,38 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import sys as _sys
+
 from .batchHarness import *
 from .batchModel import *
+from .materials import *
 
-try:  # This is to help if we need to import this from FreeCAD, which might lack sympy.
-    from .physics_constants import *
-except ImportError:
-    pass
+# The units, constants and matrices are backed by sympy and scipy, which are slow to import. They
+# are only imported when first accessed, so that workers which only use Model or the harness start
+# quickly. Where modules lack __getattr__ (python < 3.7), qmt is replaced by a stand-in that does
+# the same, see installLazyModule.
+_physicsNames = ['units', 'constants', 'matrices', 'numericMatrices', 'sparseMatrices',
+                 'sparseKron', 'parseUnit', 'toFloat', 'siFactor', 'conversionFactor', 'convert']
 
-from .materials import *
-try:
-    from .physics_constants import *
-except:
-    print('Could not import the units module, skipping.')
+
+def _loadPhysics(name):
+    from . import physics_constants
+    return getattr(physics_constants, name)
+
+
+if _sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _physicsNames:
+            value = _loadPhysics(name)
+            globals()[name] = value
+            return value
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_physicsNames))
+
+__all__ = list(name for name in list(globals()) if not name.startswith('_')) + _physicsNames
+
+if _sys.version_info < (3, 7):
+    from .lazyModule import installLazyModule
+    installLazyModule(__name__, _physicsNames, _loadPhysics)
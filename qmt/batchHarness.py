@@ -7,14 +7,20 @@
 #
 
 from __future__ import absolute_import, division, print_function
-from six import iteritems
 import qmt as QMT
+from qmt.batchManifest import Manifest, fingerprintDict, fingerprintFile, fingerprintDir
+from qmt.geoCache import GeometryCache, geometryKey, unlinkSharedOutputs
+from qmt.exportWatcher import ExportWatcher
+from qmt.geoWorker import GeoWorker, buildGeometry
+from qmt.coreScheduler import CoreScheduler
+from qmt.timingTrace import Tracer, traceSpan
 import os
 import sys
-import glob
 import subprocess
 import itertools
-from copy import deepcopy
+import multiprocessing
+import multiprocessing.util
+import traceback
 import time
 
 
@@ -30,112 +36,414 @@ class Harness:
         self.jsonPath = os.path.abspath(jsonPath)
         self.model = QMT.Model(self.jsonPath)
         self.modelFilePaths = []
-        self.model.loadModel()
+        self.manifest = None
+        self.lazy = False
+        self._geoWorkers = {}
+        self._tracer = None
 
-    def setupRun(self, genModelFiles=True):
+    def close(self):
+        ''' Stop the warm geometry workers started by this harness.
+        '''
+        for worker in self._geoWorkers.values():
+            worker.close()
+        self._geoWorkers = {}
+
+    def setupRun(self, genModelFiles=True, resume=False, lazy=False):
         ''' Set up the folder structure of a run, broken out by the geomSweep
             specified in the json file.
+
+            Keyword arguments
+            ----------
+            genModelFiles : bool, default True
+                Write the model file of every instance.
+            resume : bool, default False
+                Keep the model files of instances whose setup is unchanged
+                since the last run, as recorded in the run manifest, so that
+                their completed job steps can be skipped by runJob.
+            lazy : bool, default False
+                Do not set up any instance yet. runJob then streams the
+                instances from iterInstances and materializes each one right
+                before running it.
         '''
         self.rootPath = self.model.modelDict['jobSettings']['rootPath']
         if not os.path.isdir(self.rootPath):
             os.mkdir(self.rootPath)
-        geoSweepKeys = self.model.modelDict['geomSweep'].keys()
-        instanceLists = []
-        for geoSweepKey in geoSweepKeys:
-            numInstances = len(self.model.modelDict['geomSweep'][geoSweepKey]['vals'].split(','))
-            valIDs = range(numInstances)
-            instanceLists += [valIDs]
-        prodInstanceKeys = list(itertools.product(*instanceLists))
-        for prodInstance in prodInstanceKeys:
-            folderPath = 'geo_' + '_'.join(map(str, list(prodInstance)))
-            if not os.path.isdir(self.rootPath + '/' + folderPath):
-                os.mkdir(self.rootPath + '/' + folderPath)
-            runPath = self.rootPath + '/' + folderPath
-            tempModel = QMT.Model(runPath + '/model.json')
-            self.modelFilePaths += [runPath + '/model.json']
-            tempModel.modelDict = deepcopy(self.model.modelDict)
-            tempModel.modelDict['geomSweep'] = {}  # Also reset this
-            for index, name in zip(prodInstance, self.model.modelDict['geomSweep'].keys()):
-                # Populate the geo parameter names:
-                paramName = name
-                paramType = self.model.modelDict['geomSweep'][name]['type']  # freeCAD or python
-                paramValIndex = index
-                paramValsStr = self.model.modelDict['geomSweep'][paramName]['vals']
-                paramValsList = paramValsStr.split(',')
-                paramVal = paramValsList[paramValIndex]
-                tempModel.modelDict['geometricParams'][paramName] = (paramVal, paramType)
-                # Populate the geo sweep (just one point, for bookkeeping purposes):
-                tempModel.genGeomSweep(paramName, [paramVal], type=paramType)
-            tempModel.modelDict['pathSettings']['dirPath'] = runPath
-            if genModelFiles:
-                tempModel.saveModel()
-
-    def runJob(self):
+        self.manifest = Manifest(self.rootPath)
+        self.lazy = lazy
+        if self.model.modelDict['jobSettings'].get('deltaModelFiles'):
+            # Snapshot of the root model that the instance model files refer to:
+            self.model.saveModel(customPath=self._baseModelPath(), inlineArrays=True)
+        if lazy:
+            return
+        for prodInstance in self.iterInstances():
+            self.modelFilePaths += [self.materializeInstance(prodInstance,
+                                                             genModelFile=genModelFiles,
+                                                             resume=resume)]
+
+    def _sweepAxes(self):
+        ''' Return the parsed geomSweep as a list of (name, type, vals) tuples.
+        The axes are parsed once and then cached.
+        '''
+        if getattr(self, '_sweepAxesCache', None) is None:
+            geomSweep = self.model.modelDict['geomSweep']
+            self._sweepAxesCache = [(name, geomSweep[name]['type'], geomSweep[name]['vals'].split(','))
+                                    for name in geomSweep.keys()]
+        return self._sweepAxesCache
+
+    def iterInstances(self):
+        ''' Lazily generate the instances of the geomSweep, as tuples with the
+        index of the value of each sweep axis.
+        '''
+        return itertools.product(*[range(len(vals)) for name, paramType, vals in self._sweepAxes()])
+
+    def instanceModelPath(self, prodInstance):
+        ''' Path of the model file of an instance.
+        '''
+        folderPath = 'geo_' + '_'.join(map(str, list(prodInstance)))
+        rootPath = self.model.modelDict['jobSettings']['rootPath']
+        return rootPath + '/' + folderPath + '/model.json'
+
+    def genInstanceModel(self, prodInstance):
+        ''' Generate the model of an instance of the geomSweep.
+
+            Only the parts of the modelDict that differ between instances are
+            copied. All other sub-dictionaries are shared with the root model,
+            so they must be copied before being modified.
+        '''
+        modelFilePath = self.instanceModelPath(prodInstance)
+        tempModel = QMT.Model(modelFilePath, load=False)
+        tempModel.modelDict = dict(self.model.modelDict)
+        tempModel.modelDict['geometricParams'] = dict(self.model.modelDict['geometricParams'])
+        tempModel.modelDict['pathSettings'] = dict(self.model.modelDict['pathSettings'])
+        tempModel.modelDict['geomSweep'] = {}  # Also reset this
+        for index, (paramName, paramType, paramValsList) in zip(prodInstance, self._sweepAxes()):
+            # Populate the geo parameter names (paramType is freeCAD or python):
+            paramVal = paramValsList[index]
+            tempModel.modelDict['geometricParams'][paramName] = (paramVal, paramType)
+            # Populate the geo sweep (just one point, for bookkeeping purposes):
+            tempModel.genGeomSweep(paramName, [paramVal], type=paramType)
+        tempModel.modelDict['pathSettings']['dirPath'] = os.path.dirname(modelFilePath)
+        if self.model.modelDict['jobSettings'].get('deltaModelFiles'):
+            tempModel.baseModelPath = self._baseModelPath()
+            tempModel.baseModelDict = self.model.modelDict
+        return tempModel
+
+    def _baseModelPath(self):
+        return self.model.modelDict['jobSettings']['rootPath'] + '/baseModel.json'
+
+    def materializeInstance(self, prodInstance, genModelFile=True, resume=False):
+        ''' Create the folder of an instance and write its model file.
+
+            Keyword arguments
+            ----------
+            genModelFile : bool, default True
+                Write the model file of the instance.
+            resume : bool, default False
+                Keep an existing model file if the run manifest records the
+                same instance setup.
+
+            Returns
+            -------
+            modelFilePath : str
+                Path of the model file of the instance.
+        '''
+        if self.manifest is None:
+            self.manifest = Manifest(self.model.modelDict['jobSettings']['rootPath'])
+        tempModel = self.genInstanceModel(prodInstance)
+        runPath = tempModel.modelDict['pathSettings']['dirPath']
+        if not os.path.isdir(runPath):
+            os.mkdir(runPath)
+        if genModelFile:
+            folderPath = os.path.basename(runPath)
+            setupHash = fingerprintDict(tempModel.modelDict)
+            if not (resume and os.path.isfile(tempModel.modelPath) and
+                    self.manifest.setupHash(folderPath) == setupHash):
+                tempModel.saveModel(inlineArrays=True)
+                self.manifest.recordSetup(folderPath, setupHash)
+            # Otherwise the model file may hold results of completed steps.
+        return tempModel.modelPath
+
+    def runJob(self, parallel=False, resume=False):
         ''' Run the batch job.
+
+            Keyword arguments
+            ----------
+            parallel : bool, default False
+                If True, the instances are spread over a pool of
+                jobSettings['numParallelJobs'] worker processes. The job
+                sequence of each instance still runs in order, and an
+                instance that fails is reported without stopping the others.
+                If False and jobSettings['coreBudget'] is set, the job runs
+                step-major instead, and the comsolRun steps of all instances
+                are packed into the core budget by runBatchCOMSOLRuns.
+            resume : bool, default False
+                If True, job steps that the run manifest records as completed
+                with the same inputs are skipped.
+
+            Returns
+            -------
+            failures : dict
+                Maps the model file path of every failed instance to the
+                traceback of its error. Only populated in parallel mode; in
+                serial mode errors are raised directly.
+        '''
+        # In lazy mode, instances are streamed and materialized by whoever runs them:
+        if self.lazy:
+            tasks = ((None, prodInstance, resume) for prodInstance in self.iterInstances())
+        else:
+            tasks = ((modelFilePath, None, resume) for modelFilePath in self.modelFilePaths)
+        failures = {}
+        jobSettings = self.model.modelDict['jobSettings']
+        if not parallel and jobSettings.get('coreBudget') and \
+                'comsolRun' in jobSettings['jobSequence']:
+            try:
+                self._runPacked(resume)
+            finally:
+                self.close()
+            return failures
+        if not parallel:
+            try:
+                for task in tasks:
+                    self._runTask(task)
+            finally:
+                self.close()
+            return failures
+        numWorkers = self.model.modelDict['jobSettings'].get('numParallelJobs', 1)
+        pool = multiprocessing.Pool(numWorkers, _initWorker, (type(self), self.jsonPath))
+        try:
+            for modelFilePath, error in pool.imap_unordered(_runInstanceWorker, tasks):
+                if error is not None:
+                    print('Instance {} failed:\n{}'.format(modelFilePath, error))
+                    failures[modelFilePath] = error
+        finally:
+            pool.close()
+            pool.join()
+        return failures
+
+    def _runPacked(self, resume):
+        ''' Run the job step-major, so that the COMSOL runs of all instances can
+        be packed into the core budget of the node.
+        '''
+        if self.lazy:
+            # Packing needs all instances at once:
+            self.modelFilePaths = [self.materializeInstance(prodInstance, resume=resume)
+                                   for prodInstance in self.iterInstances()]
+            self.lazy = False
+        jobSequence = self.model.modelDict['jobSettings']['jobSequence']
+        index = jobSequence.index('comsolRun')
+        for modelFilePath in self.modelFilePaths:
+            self.runInstance(modelFilePath, resume=resume, jobSteps=jobSequence[:index])
+        self.runBatchCOMSOLRuns(self.modelFilePaths, resume=resume)
+        for modelFilePath in self.modelFilePaths:
+            self.runInstance(modelFilePath, resume=resume, jobSteps=jobSequence[index + 1:])
+
+    def _runTask(self, task):
+        ''' Run a task of runJob, materializing the instance first if needed.
+        '''
+        modelFilePath, prodInstance, resume = task
+        if prodInstance is not None:
+            modelFilePath = self.materializeInstance(prodInstance, resume=resume)
+        self.runInstance(modelFilePath, resume=resume)
+
+    def runInstance(self, modelFilePath, resume=False, jobSteps=None):
+        ''' Run the job sequence for a single instance of the sweep.
+
+            Every step is recorded in the run manifest. The input fingerprint
+            of a step chains the instance setup with the outputs of the
+            previous step (and, for geoGen, the FreeCAD file), so a step is
+            only skipped on resume if nothing upstream of it has changed.
+            The timing of the steps is added to trace.json in the instance
+            directory, in the Chrome trace-event format.
+
+            Keyword arguments
+            ----------
+            resume : bool, default False
+                Skip steps that the manifest records as completed with the
+                same inputs.
+            jobSteps : list, default None
+                Only run these steps of the job sequence. The other steps
+                must have been run before, and their recorded outputs are
+                chained into the inputs of later steps. If None, all steps run.
         '''
-        for modelFilePath in self.modelFilePaths:  # For now, this is the serial part
+        if self.manifest is None:
+            self.manifest = Manifest(self.model.modelDict['jobSettings']['rootPath'])
+        instance = self._instanceName(modelFilePath)
+        prevHash = self.manifest.setupHash(instance)
+        self._tracer = Tracer()
+        try:
             for jobStep in self.model.modelDict['jobSettings']['jobSequence']:
-                if jobStep == 'geoGen':
-                    self.runBatchGeoGen(modelFilePath)
-                elif jobStep == 'comsolRun':
-                    start = time.time()
-                    self.runBatchCOMSOLRun(modelFilePath)
-                    end = time.time()
-                    print('Elapsed time is {0} s.'.format(end - start))
-                elif jobStep == 'postProc':
-                    self.runBatchPostProc(modelFilePath)
-                else:
-                    raise ValueError('Job step is not defined!')
-
-    def runBatchGeoGen(self, modelFilePath):
-        ''' Run batch geometry generation.
-        '''
-        # Import the FreeCAD functions we will need:
-        import FreeCAD
-        from qmt.freecad import modelBuilder, build2DGeo, buildCrossSection
+                if jobSteps is not None and jobStep not in jobSteps:
+                    record = self.manifest.stepRecord(instance, jobStep)
+                    prevHash = record['outputHash'] if record is not None else None
+                    continue
+                inputHash, doneHash = self._checkStep(instance, jobStep, prevHash, resume,
+                                                      modelFilePath)
+                if doneHash is not None:
+                    prevHash = doneHash
+                    continue
+                self.manifest.startStep(instance, jobStep, inputHash)
+                try:
+                    with self._tracer.step(jobStep, instance=instance):
+                        self._runStep(jobStep, modelFilePath)
+                except Exception:
+                    self.manifest.failStep(instance, jobStep, traceback.format_exc())
+                    raise
+                prevHash = self._finishStep(instance, jobStep, modelFilePath)
+        finally:
+            if self._tracer.events:
+                self._tracer.write(self._tracePath(modelFilePath))
+            self._tracer = None
+
+    def _instanceName(self, modelFilePath):
+        return os.path.basename(os.path.dirname(os.path.abspath(modelFilePath)))
+
+    def _tracePath(self, modelFilePath):
+        return os.path.join(os.path.dirname(modelFilePath), 'trace.json')
+
+    def _checkStep(self, instance, jobStep, prevHash, resume, modelFilePath):
+        ''' Compute the input hash of a step. Also returns the recorded output
+        hash if the step can be skipped on resume, and None otherwise.
+
+        A step is only skipped if the files of the instance still hold its
+        recorded outputs, or the outputs of later completed steps that were
+        run on them, so that deleted or modified outputs are never trusted.
+        '''
+        inputHash = self._inputHash(jobStep, prevHash)
+        record = self.manifest.stepRecord(instance, jobStep)
+        if resume and record is not None and record['status'] == 'done' and \
+                record['inputHash'] == inputHash:
+            if self._outputsIntact(instance, jobStep, record['outputHash'],
+                                   self._outputHash(modelFilePath)):
+                print('Skipping completed step {} of {}.'.format(jobStep, instance))
+                return inputHash, record['outputHash']
+            print('Rerunning step {} of {}, whose outputs have changed.'.format(jobStep, instance))
+        return inputHash, None
+
+    def _inputHash(self, jobStep, prevHash):
+        inputs = {'step': jobStep, 'previous': prevHash}
+        if jobStep == 'geoGen':
+            inputs['freeCADFile'] = self._freeCADFingerprint()
+        return fingerprintDict(inputs)
+
+    def _outputsIntact(self, instance, jobStep, outputHash, currentHash):
+        ''' Whether the current outputs of an instance, with fingerprint
+        currentHash, derive from the recorded outputs of a completed step.
+        '''
+        jobSequence = self.model.modelDict['jobSettings']['jobSequence']
+        while outputHash != currentHash:
+            # Later steps change the files, so follow the chain of completed
+            # steps that ran on these outputs:
+            index = jobSequence.index(jobStep) + 1
+            if index == len(jobSequence):
+                return False
+            jobStep = jobSequence[index]
+            record = self.manifest.stepRecord(instance, jobStep)
+            if record is None or record['status'] != 'done' or \
+                    record['inputHash'] != self._inputHash(jobStep, outputHash):
+                return False
+            outputHash = record['outputHash']
+        return True
+
+    def _outputHash(self, modelFilePath):
+        ''' Fingerprint of the model file and the other files of an instance.
+        '''
+        return fingerprintDict({
+            'model': fingerprintFile(modelFilePath),
+            'files': fingerprintDir(os.path.dirname(modelFilePath),
+                                    exclude=('model.json', 'trace.json'))})
 
+    def _finishStep(self, instance, jobStep, modelFilePath):
+        ''' Record a step as done, and return the fingerprint of its outputs.
+        '''
+        outputHash = self._outputHash(modelFilePath)
+        self.manifest.finishStep(instance, jobStep, outputHash)
+        return outputHash
+
+    def _runStep(self, jobStep, modelFilePath):
+        ''' Run a single job step on an instance.
+        '''
+        if jobStep == 'geoGen':
+            self.runBatchGeoGen(modelFilePath, tracer=self._tracer)
+        elif jobStep == 'comsolRun':
+            start = time.time()
+            self.runBatchCOMSOLRun(modelFilePath)
+            end = time.time()
+            print('Elapsed time is {0} s.'.format(end - start))
+        elif jobStep == 'postProc':
+            self.runBatchPostProc(modelFilePath)
+        else:
+            raise ValueError('Job step is not defined!')
+
+    def _freeCADFingerprint(self):
+        ''' Fingerprint of the FreeCAD file of the run, cached per file state.
+        '''
+        FCDocPath = self.model.modelDict['pathSettings'].get('freeCADPath')
+        if FCDocPath is None or not os.path.isfile(FCDocPath):
+            return None
+        stat = os.stat(FCDocPath)
+        key = (FCDocPath, stat.st_mtime, stat.st_size)
+        if getattr(self, '_freeCADKey', None) != key:
+            self._freeCADKey = key
+            self._freeCADHash = fingerprintFile(FCDocPath)
+        return self._freeCADHash
+
+    def runBatchGeoGen(self, modelFilePath, tracer=None):
+        ''' Run batch geometry generation. If a Tracer is given, the cache
+        lookup, document handling and part builds are recorded as spans.
+        '''
         # Load the model:
         myModel = QMT.Model(modelPath=modelFilePath)
-        myModel.loadModel()
-        dirPath = myModel.modelDict['pathSettings']['dirPath']
+        # Reuse the outputs of an identical build if a geometry cache is set up:
+        geoGenArgs = myModel.modelDict['jobSettings'].get('geoGenArgs', {})
+        cache = None
+        if geoGenArgs.get('cacheDir') is not None:
+            cache = GeometryCache(geoGenArgs['cacheDir'], maxBytes=geoGenArgs.get('cacheMaxBytes'))
+            with traceSpan(tracer, 'cacheFetch', cat='geoGen'):
+                cacheKey = geometryKey(myModel.modelDict)
+                hit = cache.fetch(cacheKey, myModel)
+            if hit:
+                print('Reusing cached geometry {}...'.format(cacheKey))
+                myModel.saveModel(inlineArrays=True)
+                return
+        # Don't write the new build through links left by an earlier cache hit:
+        unlinkSharedOutputs(myModel.modelDict['pathSettings']['dirPath'])
         FCDocPath = myModel.modelDict['pathSettings']['freeCADPath']
-        FreeCAD.openDocument(FCDocPath)
-        # Build the model
-        buildModel = modelBuilder(passModel=myModel)
-        for i in range(len(myModel.modelDict['buildOrder'])):
-            partName = myModel.modelDict['buildOrder'][str(i)]
-            totalParts = len(myModel.modelDict['buildOrder'])
-            print('('+str(i+1)+'/'+str(totalParts)+') building part '+partName+'...')
-            buildModel.buildPart(partName)
-        cadDirPath = dirPath + '/cadParts'
-        stlDirPath = dirPath+'/stlParts'
-        if not os.path.isdir(cadDirPath):
-            os.mkdir(cadDirPath)
-        if not os.path.isdir(stlDirPath):
-            os.mkdir(stlDirPath)
-        buildModel.exportBuiltParts(stepFileDir=dirPath + '/cadParts',stlFileDir=dirPath+'/stlParts')
-        buildModel.saveFreeCADState(dirPath+'/freeCADModel.FCStd')
-        
-        # Now that we have rendered the 3D objects, we want to draw any
-        # necessary 2D cross sections as 2D cuts:
-        for sliceName, sliceData in iteritems(myModel.modelDict['slices']):
-            if sliceData['sliceInfo'].get('crossSection'):
-                parts = buildCrossSection(sliceData['sliceInfo'], passModel=myModel)
-            else:
-                parts = build2DGeo(passModel=myModel)
-            sliceData['parts'] = parts
-
-        myModel.saveModel()
-
+        if geoGenArgs.get('warmWorker'):
+            # Build in a worker that keeps the FreeCAD document loaded:
+            if FCDocPath not in self._geoWorkers:
+                with traceSpan(tracer, 'startWorker', cat='geoGen'):
+                    self._geoWorkers[FCDocPath] = GeoWorker(FCDocPath)
+            self._geoWorkers[FCDocPath].build(modelFilePath, tracer=tracer)
+            myModel.loadModel(updateModel=False)
+        else:
+            # Import the FreeCAD functions we will need:
+            import FreeCAD
+            with traceSpan(tracer, 'openDocument', cat='geoGen'):
+                doc = FreeCAD.openDocument(FCDocPath)
+            try:
+                buildGeometry(myModel, tracer=tracer,
+                              numProcesses=geoGenArgs.get('parallelParts'))
+            finally:
+                # Close the document so this process can open a fresh copy for
+                # the next instance:
+                FreeCAD.closeDocument(doc.Name)
+            myModel.saveModel(inlineArrays=True)
+        if cache is not None:
+            with traceSpan(tracer, 'cacheStore', cat='geoGen'):
+                cache.store(cacheKey, myModel)
 
+    def _prepareCOMSOLRun(self, modelFilePath):
+        ''' Compile the COMSOL model of an instance and assemble its run.
 
-    def runBatchCOMSOLRun(self, modelFilePath):
-        ''' Run batch COMSOL run. This requires proprietary components to be 
-        installed.
+            Returns
+            -------
+            run : dict
+                The 'command' to launch, the number of 'cores' it uses, the
+                'logPath' and 'errPath' of its output files, and a 'watcher'
+                on its export directory.
         '''
         from qms import comsol
         myModel = QMT.Model(modelPath=modelFilePath)
-        myModel.loadModel()
         numCoresPerJob = myModel.modelDict['jobSettings']['numCoresPerJob']
         numParallelJobs = myModel.modelDict['jobSettings']['numParallelJobs']
         comsolExecPath = myModel.modelDict['pathSettings']['COMSOLExecPath']
@@ -166,39 +474,126 @@ class Harness:
         else:
             comsolCommand = mpiPath + ' -n ' + str(numParallelJobs) + ' \"' + comsolExecPath +\
             '\" -nosave -np ' +str(numCoresPerJob)+ ' -inputFile ' + comsolModelPath
-        comsolLogName = myModel.modelDict['pathSettings']['dirPath'] + '/comsolLog.txt'
-        comsolErrName = myModel.modelDict['pathSettings']['dirPath'] + '/comsolErr.txt'
-        # Log file for COMSOL run:
-        comsolLog = open(comsolLogName, 'w')
-        comsolErr = open(comsolErrName, 'w')
-
-        print('Running {}...'.format(comsolCommand))
-        comsolRun = subprocess.Popen(comsolCommand, stdout=comsolLog, stderr=comsolErr)
-        print('Starting COMSOL run...')
-        # Determine the number of voltages we are expecting. This is crude and
-        # should be made more reliable, since I'm assuming a full (dense) sweep:
-        numVoltages = myModel.modelDict['physicsSweep']['length']
-        resultFileBase = '{}/{}_export'.format(comsolSolsPath,
-                                               myModel.modelDict['comsolInfo']['fileName'])
-        while True:
-            if comsolRun.poll() != None:  # If the run is done, tag it as complete
-                print('COMSOL run finshed!')
-                break
+        return {'command': comsolCommand,
+                'cores': numParallelJobs * numCoresPerJob,
+                'logPath': myModel.modelDict['pathSettings']['dirPath'] + '/comsolLog.txt',
+                'errPath': myModel.modelDict['pathSettings']['dirPath'] + '/comsolErr.txt',
+                'watcher': ExportWatcher(comsolSolsPath, _expectedExports(myModel.modelDict))}
+
+    def runBatchCOMSOLRun(self, modelFilePath):
+        ''' Run batch COMSOL run. This requires proprietary components to be 
+        installed.
+        '''
+        run = self._prepareCOMSOLRun(modelFilePath)
+        watcher = run['watcher']
+        try:
+            # Log files for COMSOL run:
+            with open(run['logPath'], 'w') as comsolLog, open(run['errPath'], 'w') as comsolErr:
+                print('Running {}...'.format(run['command']))
+                comsolRun = subprocess.Popen(run['command'], stdout=comsolLog, stderr=comsolErr)
+                print('Starting COMSOL run...')
+                fracComplete = None
+                while comsolRun.poll() is None:
+                    watcher.wait(1.)
+                    if watcher.fracComplete() != fracComplete:
+                        fracComplete = watcher.fracComplete()
+                        print('... ' + str(fracComplete))
+                    if watcher.isComplete():  # we are done!
+                        print('COMSOL run finished, but has not exited yet!')
+                        print('Closing it in at most 10 seconds...')
+                        sys.stdout.flush()
+                        deadline = time.time() + 10.
+                        while comsolRun.poll() is None and time.time() < deadline:
+                            time.sleep(0.1)
+                        if comsolRun.poll() is None:
+                            comsolRun.terminate()
+                        break
+                else:  # If the run is done, tag it as complete
+                    print('COMSOL run finshed!')
+        finally:
+            watcher.close()
+
+    def runBatchCOMSOLRuns(self, modelFilePaths, resume=False):
+        ''' Run the comsolRun step of several instances concurrently, packed
+        into jobSettings['coreBudget'] cores.
+
+            Each run uses numParallelJobs * numCoresPerJob cores and writes its
+            own comsolLog.txt and comsolErr.txt. A run is recorded as failed in
+            the manifest if it exits with an error before its exports are
+            complete, and a RuntimeError listing the failed instances is raised
+            once all runs are over.
+
+            Keyword arguments
+            ----------
+            resume : bool, default False
+                Skip instances whose comsolRun is recorded as completed with
+                the same inputs.
+        '''
+        if self.manifest is None:
+            self.manifest = Manifest(self.model.modelDict['jobSettings']['rootPath'])
+        scheduler = CoreScheduler(self.model.modelDict['jobSettings']['coreBudget'])
+        failed = []
+        watchers = []
+        try:
+            for modelFilePath in modelFilePaths:
+                instance = self._instanceName(modelFilePath)
+                inputHash, doneHash = self._checkStep(instance, 'comsolRun',
+                                                      self._previousHash(instance, 'comsolRun'),
+                                                      resume, modelFilePath)
+                if doneHash is not None:
+                    continue
+                self.manifest.startStep(instance, 'comsolRun', inputHash)
+                try:
+                    run = self._prepareCOMSOLRun(modelFilePath)
+                except Exception:
+                    self.manifest.failStep(instance, 'comsolRun', traceback.format_exc())
+                    raise
+                watchers += [run['watcher']]
+                scheduler.submit(modelFilePath, run['command'], cores=run['cores'],
+                                 logPath=run['logPath'], errPath=run['errPath'],
+                                 isDone=_exportsDone(run['watcher']),
+                                 onFinish=self._finishCOMSOLRun(run['watcher'], failed,
+                                                                scheduler))
+            scheduler.run()
+        finally:
+            for watcher in watchers:
+                watcher.close()
+        if failed:
+            raise RuntimeError('COMSOL runs failed for ' + ', '.join(sorted(failed)))
+
+    def _finishCOMSOLRun(self, watcher, failed, scheduler):
+        ''' Build the callback that records a packed COMSOL run in the manifest
+        and in the trace of its instance.
+        '''
+        def onFinish(modelFilePath, returnCode):
+            # Pick up the last exports before judging the run:
+            watcher.drain()
+            watcher.close()
+            instance = self._instanceName(modelFilePath)
+            tracer = Tracer()
+            tracer.addSpan('comsolRun', scheduler.startTimes[modelFilePath], time.time(),
+                           cat='jobStep', instance=instance, returnCode=returnCode,
+                           jobStep='comsolRun')
+            tracer.write(self._tracePath(modelFilePath))
+            if returnCode != 0 and not watcher.isComplete():
+                self.manifest.failStep(instance, 'comsolRun',
+                                       'COMSOL exited with code {}'.format(returnCode))
+                failed.append(modelFilePath)
             else:
-                solsList = glob.glob(resultFileBase + '*.txt')
-                fracComplete = len(solsList) / float(numVoltages)
-                print('... ' + str(fracComplete))
-                time.sleep(5.)
-                #TODO Add check for integrals as well so we don't stop early!
-                if len(solsList) >= numVoltages:  # we are done!
-                    print('COMSOL run finished, but failed to exit!')
-                    print('Closing it in 10 seconds...')
-                    sys.stdout.flush()
-                    time.sleep(10.)
-                    comsolRun.terminate()
-                    break
-        comsolLog.close()
-        comsolErr.close()
+                self._finishStep(instance, 'comsolRun', modelFilePath)
+        return onFinish
+
+    def _previousHash(self, instance, jobStep):
+        ''' The recorded output hash of the step preceding jobStep, or the
+        setup hash of the instance if jobStep comes first.
+        '''
+        prevHash = self.manifest.setupHash(instance)
+        for step in self.model.modelDict['jobSettings']['jobSequence']:
+            if step == jobStep:
+                break
+            record = self.manifest.stepRecord(instance, step)
+            prevHash = record['outputHash'] if record is not None else None
+        return prevHash
 
     def runBatchPostProc(self, modelFilePath):
         ''' Run batch post-processing. This requires proprietary components
@@ -214,3 +609,62 @@ class Harness:
         pythonCmd = [pythonName, batchPostProcpath, '\"' + modelFilePath + '\"']
         print('Running {}...'.format(mpiCmd + pythonCmd))
         subprocess.check_call(mpiCmd + pythonCmd)
+
+
+def _expectedExports(modelDict):
+    ''' The export files that make up a complete COMSOL run of a model, as a
+    dict mapping glob patterns to the number of files expected for each.
+    '''
+    comsolInfo = modelDict['comsolInfo']
+    # Determine the number of voltages we are expecting; for dense sweeps
+    # the length is the size of the full grid:
+    numVoltages = modelDict['physicsSweep']['length']
+    expected = {'{}_export*.txt'.format(comsolInfo['fileName']): numVoltages}
+    # Also wait for the integral outputs, so we don't stop early:
+    integralExports = comsolInfo.get('integralExports')
+    if integralExports is None:
+        if comsolInfo['surfaceIntegrals'] or comsolInfo['volumeIntegrals']:
+            raise ValueError('The model requests surface or volume integrals, but their '
+                             'output files are unknown. Pass integralExports to '
+                             'genComsolInfo.')
+        integralExports = {}
+    expected.update(integralExports)
+    return expected
+
+
+def _exportsDone(watcher):
+    ''' Build the isDone callback of a packed COMSOL run.
+    '''
+    def isDone():
+        watcher.wait(0.)
+        return watcher.isComplete()
+    return isDone
+
+
+# The harness of a pool worker process, set up once per process by _initWorker:
+_workerHarness = None
+
+
+def _initWorker(harnessClass, jsonPath):
+    ''' Initialize a pool worker process with its own harness, of the class of
+    the harness running the job, and close it when the worker exits.
+    '''
+    global _workerHarness
+    _workerHarness = harnessClass(jsonPath)
+    # Pool workers leave through os._exit, which skips atexit hooks but runs
+    # the multiprocessing finalizers:
+    multiprocessing.util.Finalize(None, _workerHarness.close, exitpriority=10)
+
+
+def _runInstanceWorker(task):
+    ''' Run one instance in a pool worker. Errors are caught and returned so
+    that a failing instance does not take down the rest of the pool.
+    '''
+    modelFilePath, prodInstance, resume = task
+    if prodInstance is not None:
+        modelFilePath = _workerHarness.instanceModelPath(prodInstance)
+    try:
+        _workerHarness._runTask(task)
+    except Exception:
+        return modelFilePath, traceback.format_exc()
+    return modelFilePath, None
@@ -0,0 +1,166 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file keeps track of which job steps of a batch run have completed, so
+# that an interrupted run can be resumed without redoing finished work.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+__all__ = ['Manifest', 'fingerprintDict', 'fingerprintFile', 'fingerprintDir']
+
+
+def _fingerprintDefault(obj):
+    # numpy arrays, e.g. memory-mapped from the sidecar files of a model, are
+    # hashed by their contents instead of being serialized:
+    if hasattr(obj, 'tobytes') and hasattr(obj, 'dtype'):
+        sha = hashlib.sha1(obj.tobytes())
+        return {'__ndarray__': [obj.dtype.str, list(obj.shape), sha.hexdigest()]}
+    raise TypeError('Cannot fingerprint ' + repr(type(obj)))
+
+
+def fingerprintDict(myDict):
+    ''' Compute a canonical hash of a json-serializable dictionary, which may
+    also contain numpy arrays.
+    '''
+    text = json.dumps(myDict, sort_keys=True, separators=(',', ':'), default=_fingerprintDefault)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def fingerprintFile(filePath, blockSize=1 << 20):
+    ''' Compute the hash of the contents of a file. Returns None if the file
+    does not exist.
+    '''
+    if not os.path.isfile(filePath):
+        return None
+    sha = hashlib.sha1()
+    with open(filePath, 'rb') as myFile:
+        block = myFile.read(blockSize)
+        while block:
+            sha.update(block)
+            block = myFile.read(blockSize)
+    return sha.hexdigest()
+
+
+def fingerprintDir(dirPath, exclude=(), contentLimit=1 << 20):
+    ''' Compute a hash of the files in a directory tree. Files of at most
+    contentLimit bytes are hashed by their contents; larger ones, for which
+    that would be expensive, by their size and modification time.
+    '''
+    entries = []
+    for root, dirs, files in os.walk(dirPath):
+        for fileName in files:
+            filePath = os.path.join(root, fileName)
+            relPath = os.path.relpath(filePath, dirPath)
+            if relPath in exclude:
+                continue
+            stat = os.stat(filePath)
+            if stat.st_size <= contentLimit:
+                state = fingerprintFile(filePath)
+            else:
+                state = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+            entries += [(relPath.replace(os.sep, '/'), stat.st_size, state)]
+    return fingerprintDict({'files': sorted(entries)})
+
+
+class Manifest:
+    def __init__(self, rootPath, fileName='manifest.sqlite'):
+        ''' Record of the job steps completed in a batch run.
+
+            The manifest lives in a SQLite file at the root of the run, so that
+            several worker processes can update it concurrently. For every
+            instance it stores a hash of the instance setup, and for every
+            (instance, step) pair the status, timings, and fingerprints of the
+            inputs and outputs of the step.
+
+            Parameters
+            ----------
+            rootPath : str
+                Root directory of the run.
+
+            Keyword arguments
+            ----------
+            fileName : str, default 'manifest.sqlite'
+                Name of the manifest file inside rootPath.
+        '''
+        self.path = os.path.join(rootPath, fileName)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS instances '
+                             '(instance TEXT PRIMARY KEY, setupHash TEXT)')
+                conn.execute('CREATE TABLE IF NOT EXISTS steps '
+                             '(instance TEXT, step TEXT, status TEXT, inputHash TEXT, '
+                             'outputHash TEXT, startTime REAL, endTime REAL, error TEXT, '
+                             'PRIMARY KEY (instance, step))')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60.)
+
+    def _execute(self, query, args=()):
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(query, args).fetchall()
+        finally:
+            conn.close()
+
+    def setupHash(self, instance):
+        ''' Return the recorded setup hash of an instance, or None.
+        '''
+        rows = self._execute('SELECT setupHash FROM instances WHERE instance = ?', (instance,))
+        return rows[0][0] if rows else None
+
+    def recordSetup(self, instance, setupHash):
+        ''' Record the setup hash of an instance. Any step records of the
+        instance are dropped, since they refer to a different setup.
+        '''
+        conn = self._connect()
+        try:
+            with conn:  # one transaction, so a crash cannot leave stale step records
+                conn.execute('DELETE FROM steps WHERE instance = ?', (instance,))
+                conn.execute('INSERT OR REPLACE INTO instances (instance, setupHash) '
+                             'VALUES (?, ?)', (instance, setupHash))
+        finally:
+            conn.close()
+
+    def stepRecord(self, instance, step):
+        ''' Return the record of a job step as a dict, or None if the step
+        has never been started.
+        '''
+        rows = self._execute('SELECT status, inputHash, outputHash, startTime, endTime, error '
+                             'FROM steps WHERE instance = ? AND step = ?', (instance, step))
+        if not rows:
+            return None
+        keys = ['status', 'inputHash', 'outputHash', 'startTime', 'endTime', 'error']
+        return dict(zip(keys, rows[0]))
+
+    def startStep(self, instance, step, inputHash):
+        ''' Mark a job step as running.
+        '''
+        self._execute('INSERT OR REPLACE INTO steps (instance, step, status, inputHash, '
+                      'outputHash, startTime, endTime, error) '
+                      'VALUES (?, ?, ?, ?, NULL, ?, NULL, NULL)',
+                      (instance, step, 'running', inputHash, time.time()))
+
+    def finishStep(self, instance, step, outputHash):
+        ''' Mark a job step as done.
+        '''
+        self._execute('UPDATE steps SET status = ?, outputHash = ?, endTime = ? '
+                      'WHERE instance = ? AND step = ?',
+                      ('done', outputHash, time.time(), instance, step))
+
+    def failStep(self, instance, step, error):
+        ''' Mark a job step as failed.
+        '''
+        self._execute('UPDATE steps SET status = ?, endTime = ?, error = ? '
+                      'WHERE instance = ? AND step = ?',
+                      ('failed', time.time(), error, instance, step))
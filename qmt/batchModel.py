@@ -4,9 +4,194 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 import os
-import json
+import itertools
 from six import itervalues
 import qmt
+import hashlib
+from qmt.jsonIO import loadJSON, saveJSON, saveArray
+
+
+# Job steps whose tools read the model file of an instance as plain json, without
+# going through Model, and so cannot resolve delta model files:
+_externalSteps = frozenset(['comsolRun', 'postProc'])
+
+
+def _numericArray(obj, threshold):
+    '''Convert a list to a numeric numpy array if it holds at least threshold
+    numbers in a rectangular layout, and return None otherwise.
+    '''
+    if not obj:
+        return None
+    first = obj[0]
+    size = len(obj) * (len(first) if isinstance(first, (list, tuple)) else 1)
+    if size < threshold:
+        return None
+    try:
+        array = np.asarray(obj)
+    except ValueError:  # ragged
+        return None
+    if array.dtype.kind not in 'iuf':
+        return None
+    return array
+
+
+def _encodeArrays(obj, threshold, arrayDir):
+    '''Replace the numpy arrays in a json-like structure, and the numeric lists
+    with at least threshold entries (if threshold is not None), by references
+    to .npy files in arrayDir. The files are named by their contents, so
+    unchanged arrays are not rewritten.
+    '''
+    array = None
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind not in 'biufc':
+            return _encodeArrays(obj.tolist(), threshold, arrayDir)
+        array = obj
+    elif isinstance(obj, (list, tuple)) and threshold is not None:
+        array = _numericArray(obj, threshold)
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        sha = hashlib.sha1(str((array.dtype.str, array.shape)).encode('utf-8'))
+        sha.update(array.tobytes())
+        fileName = sha.hexdigest() + '.npy'
+        if not os.path.isdir(arrayDir):
+            try:
+                os.mkdir(arrayDir)
+            except OSError:  # created concurrently
+                pass
+        if not os.path.isfile(os.path.join(arrayDir, fileName)):
+            saveArray(array, os.path.join(arrayDir, fileName))
+        return {'__npy__': os.path.basename(arrayDir) + '/' + fileName}
+    if isinstance(obj, dict):
+        return dict((k, _encodeArrays(v, threshold, arrayDir)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [_encodeArrays(v, threshold, arrayDir) for v in obj]
+    return obj
+
+
+def _arrayReferences(obj, references=None):
+    '''Collect the names of the .npy files referenced by an _encodeArrays result.
+    '''
+    if references is None:
+        references = set()
+    if isinstance(obj, dict):
+        if len(obj) == 1 and '__npy__' in obj:
+            references.add(os.path.basename(obj['__npy__']))
+        else:
+            for val in obj.values():
+                _arrayReferences(val, references)
+    elif isinstance(obj, list):
+        for val in obj:
+            _arrayReferences(val, references)
+    return references
+
+
+def _removeStaleArrays(arrayDir, references):
+    '''Remove the sidecar files in arrayDir that are not in references, and the
+    directory itself if it ends up empty.
+    '''
+    if not os.path.isdir(arrayDir):
+        return
+    for fileName in os.listdir(arrayDir):
+        if fileName.endswith('.npy') and fileName not in references:
+            try:
+                os.remove(os.path.join(arrayDir, fileName))
+            except OSError:  # e.g. still memory-mapped on Windows
+                pass
+    if not references:
+        try:
+            os.rmdir(arrayDir)
+        except OSError:  # not empty
+            pass
+
+
+def _decodeArrays(obj, dirPath):
+    '''Replace the .npy references made by _encodeArrays by read-only memory
+    maps of the files, relative to dirPath. Only the header of each file is read
+    here; the data is paged in when it is accessed.
+    '''
+    if isinstance(obj, dict):
+        if len(obj) == 1 and '__npy__' in obj:
+            return np.load(os.path.join(dirPath, obj['__npy__']), mmap_mode='r')
+        for key, val in obj.items():
+            obj[key] = _decodeArrays(val, dirPath)
+    elif isinstance(obj, list):
+        for i, val in enumerate(obj):
+            obj[i] = _decodeArrays(val, dirPath)
+    return obj
+
+
+def _jsonCopy(obj):
+    '''Copy a json-like structure of dicts and lists, much faster than deepcopy.
+    '''
+    if isinstance(obj, dict):
+        return dict((k, _jsonCopy(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [_jsonCopy(v) for v in obj]
+    return obj
+
+
+def _jsonEqual(a, b):
+    '''Compare two json-like values, treating tuples as lists and dict keys as strings,
+    as they would be after a round trip through json.
+    '''
+    if a is b:
+        return True
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        try:
+            return np.array_equal(np.asarray(a), np.asarray(b))
+        except ValueError:
+            return False
+    if isinstance(a, dict) and isinstance(b, dict):
+        if len(a) != len(b):
+            return False
+        bByStr = dict((str(k), v) for k, v in b.items())
+        return all(str(k) in bByStr and _jsonEqual(v, bByStr[str(k)]) for k, v in a.items())
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_jsonEqual(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _dictDelta(base, new):
+    '''Compute the overrides that turn the dict base into the dict new.
+
+    Nested dicts are diffed recursively, any other changed value is stored in full.
+    Keys missing from new are listed under '__deleted__'.
+    '''
+    delta = {}
+    baseByStr = dict((str(k), v) for k, v in base.items())
+    newKeys = set()
+    for key, newVal in new.items():
+        key = str(key)
+        newKeys.add(key)
+        if key not in baseByStr:
+            delta[key] = newVal
+            continue
+        baseVal = baseByStr[key]
+        if isinstance(newVal, dict) and isinstance(baseVal, dict):
+            subDelta = _dictDelta(baseVal, newVal)
+            if subDelta:
+                delta[key] = subDelta
+        elif not _jsonEqual(newVal, baseVal):
+            delta[key] = newVal
+    deleted = sorted(key for key in baseByStr if key not in newKeys)
+    if deleted:
+        delta['__deleted__'] = deleted
+    return delta
+
+
+def _applyDelta(base, delta):
+    '''Apply overrides computed by _dictDelta to the dict base, in place.
+    '''
+    for key in delta.get('__deleted__', []):
+        base.pop(key, None)
+    for key, val in delta.items():
+        if key == '__deleted__':
+            continue
+        if isinstance(val, dict) and isinstance(base.get(key), dict):
+            _applyDelta(base[key], val)
+        else:
+            base[key] = val
+    return base
 
 
 class Model:
@@ -25,6 +210,11 @@ class Model:
             modelPath. If False, the model is initialized to an empty state.
         '''
         self.modelPath = modelPath
+        # If set, the model is saved as a set of overrides to this base model:
+        self.baseModelPath = None
+        self.baseModelDict = None
+        # If set, numeric lists of at least this many entries are saved to .npy files:
+        self.arrayThreshold = None
         if load and modelPath is not None:
             self.loadModel(False)
         else:
@@ -57,7 +247,19 @@ class Model:
         @param unit: string with the unit of the parameter in a format recognizable by COMSOL.
         @param symbol: Variable name for the quantity used in the COMSOL model.
         @param dense: Whether to do a dense/filled sweep (True) or a sparse one (False).
+                      In a sparse sweep, all sweepParts have the same number of values,
+                      which are stepped through together. In a dense sweep, every
+                      sweepPart is an independent axis, listed in
+                      physicsSweep['axisOrder'] with the last axis varying fastest,
+                      and the sweep covers the Cartesian product of the axes without
+                      storing it. Use physicsSweepPoint or iterPhysicsSweep to get
+                      the values of a point of either kind of sweep.
         """
+        physicsSweep = self.modelDict['physicsSweep']
+        sweepType = 'dense' if dense else 'sparse'
+        if physicsSweep['sweepParts'] and physicsSweep['type'] != sweepType:
+            raise ValueError('Cannot add a {} sweep to a {} physics sweep.'.format(
+                sweepType, physicsSweep['type']))
         sweep = {}
         sweep['part'] = partName
         sweep['quantity'] = quantity
@@ -67,12 +269,53 @@ class Model:
         sweep['values'] = list(values)
         sweep['unit'] = unit
         key = '{0}_{1}'.format(quantity, partName)  # This is how the parameters are build in comsol
-        self.modelDict['physicsSweep']['length'] = len(list(values))
-        self.modelDict['physicsSweep']['sweepParts'][key] = sweep
-        # For now, only sparse sweeps are supported
-        for part_name, part_info in self.modelDict['physicsSweep']['sweepParts'].items():
-            assert len(part_info['values']) == len(list(values)), "Lengths of the different sweeps must match, only sparse sweeps supported."
-        self.modelDict['physicsSweep']['type'] = 'dense' if dense else 'sparse'
+        physicsSweep['sweepParts'][key] = sweep
+        physicsSweep['type'] = sweepType
+        if dense:
+            axisOrder = physicsSweep.setdefault('axisOrder', [])
+            if key not in axisOrder:
+                axisOrder.append(key)
+            physicsSweep['length'] = int(np.prod([len(physicsSweep['sweepParts'][axis]['values'])
+                                                  for axis in axisOrder]))
+        else:
+            physicsSweep['length'] = len(sweep['values'])
+            for part_name, part_info in physicsSweep['sweepParts'].items():
+                assert len(part_info['values']) == len(sweep['values']), "Lengths of the different sweeps must match in a sparse sweep."
+
+    def physicsSweepPoint(self, index):
+        """ Get the values of all sweepParts at a point of the physics sweep.
+        @param index: flat index (int) of the point, between 0 and physicsSweep['length'].
+                      For dense sweeps, the index is unravelled over the axes without
+                      materializing the grid.
+        @return: dict mapping the sweepPart keys to their values at the point.
+        """
+        physicsSweep = self.modelDict['physicsSweep']
+        length = physicsSweep['length']
+        if not 0 <= index < length:
+            raise IndexError('Physics sweep index {} out of range for length {}.'.format(index, length))
+        sweepParts = physicsSweep['sweepParts']
+        if physicsSweep['type'] != 'dense':
+            return dict((key, sweep['values'][index]) for key, sweep in sweepParts.items())
+        point = {}
+        for axis in reversed(physicsSweep['axisOrder']):
+            values = sweepParts[axis]['values']
+            index, axisIndex = divmod(index, len(values))
+            point[axis] = values[axisIndex]
+        return point
+
+    def iterPhysicsSweep(self):
+        """ Iterate over the points of the physics sweep, in order of their flat index.
+        @return: generator of dicts mapping the sweepPart keys to their values.
+        """
+        physicsSweep = self.modelDict['physicsSweep']
+        if physicsSweep['type'] != 'dense':
+            for index in range(physicsSweep['length']):
+                yield self.physicsSweepPoint(index)
+            return
+        axisOrder = physicsSweep['axisOrder']
+        axes = [physicsSweep['sweepParts'][axis]['values'] for axis in axisOrder]
+        for values in itertools.product(*axes):
+            yield dict(zip(axisOrder, values))
 
     def genGeomSweep(self, param, vals, type='freeCAD'):
         """ Generate a parametric sweep and add it to modelDict. The units need to
@@ -115,18 +358,23 @@ class Model:
         self.modelDict['comsolInfo']['zeroLevel'] = [partName,property]
 
     def genComsolInfo(self, meshExport=None, fileName='comsolModel', exportDir='solutions',
-                      repairTolerance=None):
+                      repairTolerance=None, integralExports=None):
         '''
         Generate meta information required by COSMOL
         @param meshExport: string with name for the exported mesh. None means no mesh is exported
         @param repairTolerance: float with the repair tolerance for building the geometry in COMSOl
         @param fileName: string with the name of the resulting COMSOL file
         @param exportDir: string with directory to which results are exported
+        @param integralExports: dict mapping glob patterns of the integral output files in
+        exportDir to the number of files expected for each. The batch harness only considers
+        a run complete once these exist alongside the solution files. It is required if the
+        model has surface or volume integrals, and the harness refuses to run otherwise.
         '''
         self.modelDict['comsolInfo']['meshExport'] = meshExport
         self.modelDict['comsolInfo']['repairTolerance'] = repairTolerance
         self.modelDict['comsolInfo']['fileName'] = fileName
         self.modelDict['comsolInfo']['exportDir'] = exportDir
+        self.modelDict['comsolInfo']['integralExports'] = integralExports
 
 
     def addPart(self,partName,fcName,directive,domainType,material=None,\
@@ -249,6 +497,117 @@ class Model:
             self.modelDict['3DParts'][partName]['fileNames']  = {} 
         self.modelDict['3DParts'][partName]['fileNames'][fcName] = fileName
 
+    def partDependencies(self):
+        '''Derive the dependency graph of the 3D parts.
+
+            A part depends on its targetWire, its lithoBase parts, and the parts
+            in its subtractList. A depoZone or etchZone counts if it names a
+            part rather than a sketch. Since all lithography parts are built
+            from one shared setup, each lithography part also depends on the
+            bases of all lithography parts and on the lithography parts of
+            lower layers.
+
+            Returns a dict mapping every partName to the sorted list of names it
+            depends on. References to unknown parts are kept, so that
+            validatePartGraph can report them.
+        '''
+        parts = self.modelDict['3DParts']
+        lithoParts = [name for name, partDict in parts.items()
+                      if partDict['directive'] == 'lithography']
+        lithoBases = set()
+        for name in lithoParts:
+            lithoBases.update(parts[name].get('lithoBase') or [])
+        dependencies = {}
+        for name, partDict in parts.items():
+            deps = set(partDict.get('subtractList') or [])
+            if partDict.get('targetWire') is not None:
+                deps.add(partDict['targetWire'])
+            for zoneKey in ['depoZone', 'etchZone']:
+                if partDict.get(zoneKey) in parts:
+                    deps.add(partDict[zoneKey])
+            if partDict['directive'] == 'lithography':
+                deps.update(lithoBases)
+                deps.update(other for other in lithoParts
+                            if parts[other]['layerNum'] < partDict['layerNum'])
+            dependencies[name] = sorted(deps)
+        return dependencies
+
+    def validatePartGraph(self):
+        '''Check that the 3D parts only refer to existing parts, and that their
+        dependencies are acyclic. Raises a ValueError listing the problems.
+        '''
+        dependencies = self.partDependencies()
+        errors = []
+        for name in sorted(dependencies):
+            for dep in dependencies[name]:
+                if dep not in dependencies:
+                    errors += ['part {} refers to unknown part {}'.format(name, dep)]
+        if not errors:
+            try:
+                self.partLevels()
+            except ValueError as err:
+                errors += [str(err)]
+        if errors:
+            raise ValueError('Invalid 3D part dependencies: ' + '; '.join(errors))
+
+    def partLevels(self):
+        '''Sort the 3D parts into topological levels.
+
+            Level 0 holds the parts without dependencies, and every other part
+            is on the level after the highest of its dependencies, so the parts
+            of one level can be built independently of each other. Within a
+            level, parts are listed in buildOrder. Raises a ValueError if the
+            dependencies contain a cycle.
+        '''
+        dependencies = self.partDependencies()
+        order = self.buildOrderIndex()
+        levelOf = {}
+        remaining = dict((name, [dep for dep in deps if dep in dependencies])
+                         for name, deps in dependencies.items())
+        levels = []
+        while remaining:
+            level = [name for name, deps in remaining.items()
+                     if all(dep in levelOf for dep in deps)]
+            if not level:
+                raise ValueError('cyclic dependencies between parts ' +
+                                 ', '.join(sorted(remaining)))
+            for name in level:
+                levelOf[name] = len(levels)
+                del remaining[name]
+            levels += [sorted(level, key=lambda name: order.get(name, len(order)))]
+        return levels
+
+    def partComponents(self):
+        '''Split the 3D parts into groups that share no dependencies, directly
+        or indirectly. Each group is a list of partNames in a valid build order.
+        '''
+        dependencies = self.partDependencies()
+        group = dict((name, name) for name in dependencies)
+
+        def find(name):
+            while group[name] != name:
+                group[name] = group[group[name]]
+                name = group[name]
+            return name
+
+        for name, deps in dependencies.items():
+            for dep in deps:
+                if dep in group:
+                    group[find(dep)] = find(name)
+        components = {}
+        for level in self.partLevels():
+            for name in level:
+                components.setdefault(find(name), []).append(name)
+        order = self.buildOrderIndex()
+        return sorted(components.values(),
+                      key=lambda names: min(order.get(name, len(order)) for name in names))
+
+    def buildOrderIndex(self):
+        '''Map the names in buildOrder to their position.
+        '''
+        buildOrder = self.modelDict['buildOrder']
+        return dict((buildOrder[key], int(key)) for key in buildOrder)
+
     def genPart2D(self, partName, geometry, sliceName=None, material=None,
                   objType=None, domainType=None, boundaryConditions=None,
                   descriptors=None, bandOffset=None, surfaceChargeDensity=None,
@@ -267,15 +626,15 @@ class Model:
         if sliceName not in twoDParts:
             twoDParts[sliceName] = {'sliceInfo': {'sliceName': sliceName}, 'parts': {}}
         sliceParts = twoDParts[sliceName]['parts']
-        # Load in materials if we need them...
-        matLib = qmt.Materials()
         slicePart = {}
         # Set material:
         if material is None:
             slicePart['material'] = None
         elif material not in self.modelDict['materials']:
-            # The material needs to be generated (it's probably an alloy)
-            self.modelDict['materials'][material] = matLib[material].serializeDict()
+            # The material needs to be generated (it's probably an alloy). The shared
+            # database is only parsed once, and its lookups are memoized:
+            matLib = qmt.sharedMaterials()
+            self.modelDict['materials'][material] = dict(matLib[material].serializeDict())
             slicePart['material'] = material
         else:
             slicePart['material'] = material
@@ -461,24 +820,69 @@ class Model:
             self.modelDict['postProcess']['tasks'] = {}
         self.modelDict['postProcess']['tasks'][name] = task
 
-    def saveModel(self, customPath=None):
+    def saveModel(self, customPath=None, arrayThreshold=None, inlineArrays=False):
         '''Save the current model to disk.
+
+            The file is replaced atomically, so that concurrent readers never
+            see a partially written model.
+
+            If self.baseModelPath is set, only the differences to the base model
+            (self.baseModelDict, loaded from baseModelPath if None) are written,
+            together with a reference to the base model file. loadModel merges
+            the two again.
+
+            Numpy arrays in the modelDict are stored in .npy sidecar files in a
+            directory next to the model file (model_arrays for model.json) and
+            referenced from the json. If an arrayThreshold is set, numeric lists
+            with at least that many entries, such as long sweeps or fine slice
+            polygons, are stored the same way. loadModel memory-maps the sidecar
+            files, so they come back as read-only numpy arrays. Sidecar files
+            that the saved model no longer references are removed.
+
+            Tools other than Model, such as the COMSOL and post-processing
+            steps, cannot resolve sidecar references, so the harness writes the
+            model files of instances with inlineArrays.
             
             Keyword arguments
             ----------        
             customPath: str, default None
                 If set, this overrides the path in self.modelPath.
+            arrayThreshold: int, default None
+                Minimum number of entries of a numeric list to store it in a
+                sidecar file. If None, self.arrayThreshold is used, and if that
+                is None as well, only numpy arrays are stored in sidecars.
+            inlineArrays: bool, default False
+                If True, no sidecar files are used, and numpy arrays are written
+                into the json as lists.
         '''
         if customPath is None:
-            myFile = open(self.modelPath, 'w')
+            customPath = self.modelPath
+        if arrayThreshold is None:
+            arrayThreshold = self.arrayThreshold
+        if self.baseModelPath is None:
+            modelDict = self.modelDict
         else:
-            myFile = open(customPath, 'w')
-        json.dump(self.modelDict, myFile)
-        myFile.close()
+            if self.baseModelDict is None:
+                self.baseModelDict = Model(self.baseModelPath).modelDict
+            baseRelPath = os.path.relpath(self.baseModelPath,
+                                          os.path.dirname(os.path.abspath(customPath)))
+            modelDict = {'__baseModel': baseRelPath.replace(os.sep, '/'),
+                         '__overrides': _dictDelta(self.baseModelDict, self.modelDict)}
+        arrayDir = os.path.splitext(os.path.abspath(customPath))[0] + '_arrays'
+        if inlineArrays:
+            encodedDict = modelDict
+        else:
+            encodedDict = _encodeArrays(modelDict, arrayThreshold, arrayDir)
+        saveJSON(encodedDict, customPath)
+        _removeStaleArrays(arrayDir, _arrayReferences(encodedDict))
 
     def loadModel(self, updateModel=True):
         '''Load the model from disk.
 
+            The file is parsed on every call. Models are not cached per
+            process, since handing out a private copy of a cached modelDict
+            takes longer than parsing the file again.
+
             Keyword arguments
             ----------
             updateModel : bool, default True
@@ -489,9 +893,15 @@ class Model:
         '''
         fileExists = os.path.isfile(self.modelPath)
         if fileExists:
-            myFile = open(self.modelPath, 'r')
-            modelDict = json.load(myFile)
-            myFile.close()
+            modelDict = loadJSON(self.modelPath)
+            modelDict = _decodeArrays(modelDict, os.path.dirname(os.path.abspath(self.modelPath)))
+            if '__baseModel' in modelDict:
+                # Merge the overrides into a private copy of the base model:
+                baseModelPath = os.path.join(os.path.dirname(os.path.abspath(self.modelPath)),
+                                             modelDict['__baseModel'])
+                self.baseModelPath = os.path.normpath(baseModelPath)
+                self.baseModelDict = Model(self.baseModelPath).modelDict
+                modelDict = _applyDelta(_jsonCopy(self.baseModelDict), modelDict['__overrides'])
         else:
             modelDict = self.genEmptyModelDict()
         if updateModel:
@@ -503,7 +913,7 @@ class Model:
 
     def addJob(self, rootPath, jobSequence=None, numParallelJobs=1,numCoresPerJob=1,
                geoGenArgs={}, comsolRunMode='batch',
-               postProcArgs={}):
+               postProcArgs={}, deltaModelFiles=False, coreBudget=None):
         '''Add a job to the model.
 
             Parameters
@@ -530,12 +940,34 @@ class Model:
             numCoresPerJob : int, default 1
                 Number of cores to use per job.
             geoGenArgs : dict, default {}
-                Arguments for use by the geoGen nodes.        
+                Arguments for use by the geoGen nodes. Recognized keys are:
+                    cacheDir : directory of a geometry cache shared between
+                        instances and runs (default None, no caching).
+                    cacheMaxBytes : size bound of the geometry cache
+                        (default None, unbounded).
+                    warmWorker : build in a worker process that keeps the
+                        FreeCAD document loaded between instances (default
+                        False).
+                    parallelParts : number of processes in which groups of
+                        independent parts are built concurrently (default
+                        None, all parts are built in one process).
             comsolRunArgs : dict, default {}
                 Arguments for use by the run nodes.                
             postProcArgs : dict, default {}
                 Arguments for use by the postProc nodes.                
+            deltaModelFiles : bool, default False
+                If True, the model file of each instance only stores its
+                differences to a shared base model in rootPath. Only geoGen
+                can read such files, so this cannot be combined with the
+                comsolRun or postProc steps.
+            coreBudget : int, default None
+                Number of cores of the node that concurrent COMSOL runs may
+                share. If None, the COMSOL runs are done one at a time.
         '''
+        externalSteps = sorted(_externalSteps.intersection(jobSequence or []))
+        if deltaModelFiles and externalSteps:
+            raise ValueError('deltaModelFiles cannot be used with the job steps ' +
+                             ', '.join(externalSteps) + ', which read plain model files.')
         self.modelDict['jobSettings']['rootPath'] = rootPath
         if jobSequence is None:
             self.modelDict['jobSettings']['jobSequence'] = ['geoGen']
@@ -546,6 +978,8 @@ class Model:
         self.modelDict['jobSettings']['geoGenArgs'] = geoGenArgs
         self.modelDict['jobSettings']['comsolRunMode'] = comsolRunMode
         self.modelDict['jobSettings']['postProcArgs'] = postProcArgs
+        self.modelDict['jobSettings']['deltaModelFiles'] = deltaModelFiles
+        self.modelDict['jobSettings']['coreBudget'] = coreBudget
 
     def setPaths(self, COMSOLExecPath=None, COMSOLCompilePath=None,
                  mpiPath=None, pythonPath=None, jdkPath=None, freeCADPath=None):
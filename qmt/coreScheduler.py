@@ -0,0 +1,187 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file packs concurrent solver subprocesses into the cores of a node, so
+# that several small runs can share a machine instead of running one by one.
+#
+
+from __future__ import absolute_import, division, print_function
+import sys
+import time
+import subprocess
+
+__all__ = ['CoreScheduler']
+
+
+class _Job:
+    def __init__(self, name, command, cores, logPath, errPath, cwd, isDone, onFinish):
+        self.name = name
+        self.command = command
+        self.cores = cores
+        self.logPath = logPath
+        self.errPath = errPath
+        self.cwd = cwd
+        self.isDone = isDone
+        self.onFinish = onFinish
+        self.process = None
+        self.doneTime = None
+        self.terminateTime = None
+        self.skips = 0  # number of times later jobs were started ahead of this one
+        self.files = []
+
+
+class CoreScheduler:
+    def __init__(self, coreBudget, pollInterval=0.5, grace=10., maxSkips=3):
+        ''' Run subprocesses concurrently within a budget of cores.
+
+            Jobs are started in submission order as long as their cores fit
+            into the free part of the budget; a job that does not fit yet is
+            skipped in favour of later, smaller ones. Once a job has been
+            skipped maxSkips times, no later jobs are started until it fits, so
+            that a stream of small jobs cannot starve a large one. Whenever a
+            job exits, its cores are freed and the queue is scanned again. A
+            job that needs more cores than the whole budget runs alone.
+
+            Parameters
+            ----------
+            coreBudget : int
+                Number of cores the jobs may use at the same time.
+
+            Keyword arguments
+            ----------
+            pollInterval : float, default 0.5
+                Interval in seconds between checks of the running jobs.
+            grace : float, default 10.
+                Time in seconds a job gets to exit by itself once its isDone
+                callback returns True, before it is terminated. A job that is
+                still alive another grace period after being terminated is
+                killed.
+            maxSkips : int, default 3
+                Number of times later jobs may be started ahead of a job that
+                does not fit, before the free cores are reserved for it.
+        '''
+        self.coreBudget = coreBudget
+        self.pollInterval = pollInterval
+        self.grace = grace
+        self.maxSkips = maxSkips
+        self._queue = []
+        self._running = []
+        self.startTimes = {}  # job name -> time the job was started
+
+    def submit(self, name, command, cores=1, logPath=None, errPath=None, cwd=None,
+               isDone=None, onFinish=None):
+        ''' Queue a job.
+
+            Parameters
+            ----------
+            name : str
+                Name of the job, used as its key in the results of run.
+            command : list or str
+                Command passed to subprocess.Popen.
+
+            Keyword arguments
+            ----------
+            cores : int, default 1
+                Number of cores used by the job.
+            logPath : str, default None
+                File receiving the stdout of the job. If None, it is inherited.
+            errPath : str, default None
+                File receiving the stderr of the job. If None, it is inherited.
+            cwd : str, default None
+                Working directory of the job.
+            isDone : callable, default None
+                Called without arguments while the job runs. Once it returns
+                True the outputs of the job are complete, and the job is
+                terminated if it does not exit within the grace period.
+            onFinish : callable, default None
+                Called with the name and return code of the job once it has
+                exited.
+        '''
+        self._queue += [_Job(name, command, cores, logPath, errPath, cwd, isDone, onFinish)]
+
+    def _freeCores(self):
+        return self.coreBudget - sum(job.cores for job in self._running)
+
+    def _start(self, job):
+        stdout = stderr = None
+        if job.logPath is not None:
+            stdout = open(job.logPath, 'w')
+            job.files += [stdout]
+        if job.errPath is not None:
+            stderr = open(job.errPath, 'w')
+            job.files += [stderr]
+        print('Running {} on {} cores...'.format(job.name, job.cores))
+        sys.stdout.flush()
+        try:
+            self.startTimes[job.name] = time.time()
+            job.process = subprocess.Popen(job.command, stdout=stdout, stderr=stderr, cwd=job.cwd)
+        except Exception:
+            for myFile in job.files:
+                myFile.close()
+            raise
+        self._running += [job]
+
+    def _startFitting(self):
+        skipped = []
+        for job in list(self._queue):
+            if job.cores <= self._freeCores() or not self._running:
+                self._queue.remove(job)
+                self._start(job)
+                for skippedJob in skipped:
+                    skippedJob.skips += 1
+                skipped = []
+            elif job.skips >= self.maxSkips:
+                break  # reserve the cores that free up for this job
+            else:
+                skipped += [job]
+
+    def _stop(self, job):
+        # Escalate to kill if the job ignores terminate:
+        if job.terminateTime is None:
+            job.process.terminate()
+            job.terminateTime = time.time()
+        elif time.time() - job.terminateTime > self.grace:
+            print('{} did not exit after being terminated, killing it!'.format(job.name))
+            job.process.kill()
+
+    def run(self):
+        ''' Run all queued jobs and wait for them to exit.
+
+            Returns
+            -------
+            returnCodes : dict
+                Maps the name of every job to its return code.
+        '''
+        returnCodes = {}
+        try:
+            self._startFitting()
+            while self._running:
+                for job in list(self._running):
+                    returnCode = job.process.poll()
+                    if returnCode is None:
+                        if job.doneTime is None and job.isDone is not None and job.isDone():
+                            print('{} finished, but has not exited yet!'.format(job.name))
+                            job.doneTime = time.time()
+                        if job.doneTime is not None and time.time() - job.doneTime > self.grace:
+                            self._stop(job)
+                        continue
+                    self._running.remove(job)
+                    for myFile in job.files:
+                        myFile.close()
+                    returnCodes[job.name] = returnCode
+                    if job.onFinish is not None:
+                        job.onFinish(job.name, returnCode)
+                self._startFitting()
+                if self._running:
+                    time.sleep(self.pollInterval)
+        finally:
+            # Do not leave orphaned jobs behind if we are interrupted:
+            for job in self._running:
+                while job.process.poll() is None:
+                    self._stop(job)
+                    time.sleep(self.pollInterval)
+                for myFile in job.files:
+                    myFile.close()
+            self._running = []
+        return returnCodes
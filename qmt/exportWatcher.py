@@ -0,0 +1,236 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file watches an export directory for result files of an external solver
+# run, so that the harness can react as soon as all expected outputs exist.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import fnmatch
+from six import iteritems
+
+__all__ = ['ExportWatcher']
+
+# inotify constants from <sys/inotify.h>:
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_eventHeader = struct.Struct('iIII')
+
+
+def _loadInotify():
+    ''' Return the libc handle if inotify is available, otherwise None.
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, ImportError):
+        return None
+    return libc
+
+
+class ExportWatcher:
+    def __init__(self, dirPath, expected, pollInterval=1., usePolling=None):
+        ''' Watch a directory for the result files of a run.
+
+            On Linux, new files are reported by inotify once they have been
+            closed after writing (or moved into place). Elsewhere, or if
+            inotify is unavailable, the directory is listed every
+            pollInterval. The modification time of the directory is not
+            trusted to detect new files, since it is too coarse on some
+            filesystems. A polled file counts once its size is unchanged
+            between two polls. The same poll also runs every pollInterval next
+            to inotify, since writes from other nodes of a shared or network
+            filesystem produce no inotify events. Either way, only new names
+            are matched against the patterns, so files are tracked
+            incrementally.
+
+            Parameters
+            ----------
+            dirPath : str
+                Directory to watch. It must exist.
+            expected : dict
+                Maps glob patterns of file names to the number of matching
+                files that make up a complete set of outputs.
+
+            Keyword arguments
+            ----------
+            pollInterval : float, default 1.
+                Interval in seconds between polls of the directory.
+            usePolling : bool, default None
+                Force (True) or forbid (False) the polling fallback. If None,
+                inotify is used where available.
+        '''
+        self.dirPath = dirPath
+        self.expected = dict(expected)
+        self.pollInterval = pollInterval
+        self.found = dict((pattern, set()) for pattern in self.expected)
+        self._fd = None
+        libc = None if usePolling else _loadInotify()
+        if libc is not None:
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                path = os.path.abspath(dirPath).encode(sys.getfilesystemencoding())
+                if libc.inotify_add_watch(fd, path, _IN_CLOSE_WRITE | _IN_MOVED_TO) >= 0:
+                    self._fd = fd
+                else:
+                    os.close(fd)
+        if usePolling is False and self._fd is None:
+            raise RuntimeError('inotify is not available for ' + dirPath)
+        self._lastPoll = time.time()
+        self._seen = set()  # file names that have settled
+        self._pending = {}  # file name -> size seen at the last poll
+        # Pick up files that were written before we started watching:
+        for fileName in os.listdir(dirPath):
+            self._pending[fileName] = None
+        self._checkPending()
+
+    def close(self):
+        ''' Stop watching the directory.
+        '''
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _register(self, fileName):
+        newMatch = False
+        for pattern, names in iteritems(self.found):
+            if fileName not in names and fnmatch.fnmatch(fileName, pattern):
+                names.add(fileName)
+                newMatch = True
+        return newMatch
+
+    def _checkPending(self, settle=None):
+        ''' Register the pending files whose size has settled. Unless settle
+            is True, inotify mode trusts new files without a second poll.
+        '''
+        if settle is None:
+            settle = self._fd is None
+        newFiles = []
+        for fileName, lastSize in list(self._pending.items()):
+            try:
+                size = os.path.getsize(os.path.join(self.dirPath, fileName))
+            except OSError:  # removed again
+                del self._pending[fileName]
+                continue
+            if lastSize is None and settle:
+                self._pending[fileName] = size
+            elif lastSize is None or size == lastSize:
+                del self._pending[fileName]
+                self._seen.add(fileName)
+                if self._register(fileName):
+                    newFiles += [fileName]
+            else:
+                self._pending[fileName] = size
+        return newFiles
+
+    def _poll(self):
+        self._lastPoll = time.time()
+        for fileName in os.listdir(self.dirPath):
+            if fileName not in self._pending and fileName not in self._seen:
+                self._pending[fileName] = None
+        # Files found by a listing may still be written to by another node:
+        return self._checkPending(settle=True)
+
+    def _readEvents(self):
+        newFiles = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return newFiles
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _eventHeader.unpack_from(data, offset)
+                offset += _eventHeader.size
+                fileName = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    # Events were lost, so fall back to a full listing:
+                    for name in os.listdir(self.dirPath):
+                        if self._register(name):
+                            newFiles += [name]
+                elif fileName:
+                    name = fileName.decode(sys.getfilesystemencoding())
+                    self._seen.add(name)
+                    self._pending.pop(name, None)
+                    if self._register(name):
+                        newFiles += [name]
+
+    def wait(self, timeout):
+        ''' Wait up to timeout seconds for new output files.
+
+            Returns the list of newly registered file names, which is empty if
+            nothing new appeared within the timeout.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            remaining = deadline - now
+            if self._fd is not None:
+                nextPoll = self._lastPoll + self.pollInterval
+                ready = select.select([self._fd], [], [],
+                                      max(min(remaining, nextPoll - now), 0.))[0]
+                newFiles = self._readEvents() if ready else []
+                if time.time() >= nextPoll:
+                    newFiles += self._poll()
+            else:
+                newFiles = self._poll()
+            if newFiles or remaining <= 0.:
+                return newFiles
+            if self._fd is None:
+                time.sleep(min(self.pollInterval, max(deadline - time.time(), 0.)))
+
+    def drain(self):
+        ''' Register every output file in the directory, including the ones
+        whose events have not been read yet. Call it once the writer has exited,
+        when no file is still being written.
+        '''
+        newFiles = self._readEvents() if self._fd is not None else []
+        for fileName in os.listdir(self.dirPath):
+            self._seen.add(fileName)
+            self._pending.pop(fileName, None)
+            if self._register(fileName):
+                newFiles += [fileName]
+        return newFiles
+
+    def count(self, pattern):
+        ''' Number of files found so far that match a pattern.
+        '''
+        return len(self.found[pattern])
+
+    def fracComplete(self):
+        ''' Fraction of the expected output files found so far.
+        '''
+        total = sum(self.expected.values())
+        if total == 0:
+            return 1.
+        return sum(min(len(self.found[pattern]), num)
+                   for pattern, num in iteritems(self.expected)) / float(total)
+
+    def isComplete(self):
+        ''' Whether all expected output files have been found.
+        '''
+        return all(len(self.found[pattern]) >= num for pattern, num in iteritems(self.expected))
@@ -26,7 +26,6 @@ def setupModelFile(fileName):
     spreadSheet.setAlias('B1', 'modelFilePath')
     spreadSheet.setColumnWidth('A', 200)
     myModelFile = QMT.Model(modelPath=fileName)
-    myModelFile.loadModel()
     myModelFile.saveModel()
     doc.recompute()
 
@@ -36,7 +35,6 @@ def getModel():
     '''
     modelPath = FreeCAD.ActiveDocument.modelFilePath.modelFilePath
     myModel = QMT.Model(modelPath=modelPath)
-    myModel.loadModel()
     return myModel
 
 
@@ -12,6 +12,7 @@ import numpy as np
 # import qmt.freecad
 from six import iteritems
 
+from qmt.timingTrace import traceSpan
 from qmt.freecad import extrude, copy, delete, genUnion, getBB, \
     makeBB, splitSketch, makeHexFace, extendSketch, exportCAD, exportMeshed, updateParams,\
     deepRemove, findSegments, extrudeBetween, centerObjects, \
@@ -155,14 +156,16 @@ def makeSAG(sketch, zBot, zMid, zTop, tIn, tOut, offset=0.):
 
 
 class modelBuilder:
-    def __init__(self, passModel=None, debugMode=False):
-        ''' Builds a model defined by the JSON input file.
+    def __init__(self, passModel=None, debugMode=False, tracer=None):
+        ''' Builds a model defined by the JSON input file. If a Tracer from qmt.timingTrace
+        is given, part builds and exports are recorded as timing spans.
         '''
         if passModel is None:
             self.model = getModel()
         else:
             self.model = passModel
         self.debugMode = debugMode
+        self.tracer = tracer
         self.doc = FreeCAD.ActiveDocument
         self._buildPartsDict = {}
         self.lithoSetup = False  # Has the litho setup routine been run?
@@ -173,18 +176,44 @@ class modelBuilder:
     def buildPart(self, partName):
         partDict = self.model.modelDict['3DParts'][partName]
         directive = partDict['directive']
-        if directive == 'extrude':
-            objs = self._build_extrude(partName)
-        elif directive == 'wire':
-            objs = self._build_wire(partName)
-        elif directive == 'wireShell':
-            objs = self._build_wire_shell(partName)
-        elif directive == 'SAG':
-            objs = self._build_SAG(partName)
-        elif directive == 'lithography':
-            objs = self._build_litho(partName)
-        else:
-            raise ValueError('Directive ' + directive + ' is not a recognized directive type.')
+        with traceSpan(self.tracer, partName, cat='buildPart', directive=directive):
+            if directive == 'extrude':
+                objs = self._build_extrude(partName)
+            elif directive == 'wire':
+                objs = self._build_wire(partName)
+            elif directive == 'wireShell':
+                objs = self._build_wire_shell(partName)
+            elif directive == 'SAG':
+                objs = self._build_SAG(partName)
+            elif directive == 'lithography':
+                objs = self._build_litho(partName)
+            else:
+                raise ValueError('Directive ' + directive + ' is not a recognized directive type.')
+        self._buildPartsDict[partName] = objs
+        for obj in objs:
+            self.model.registerCadPart(partName, obj.Name, None)
+
+    def exportPartShape(self, partName, brepPath):
+        ''' Write the shapes of the objects of a built part to a BREP file, as
+        one compound, so that it can be imported by another FreeCAD process.
+        '''
+        import Part
+        objs = self._buildPartsDict[partName]
+        Part.makeCompound([obj.Shape for obj in objs]).exportBrep(brepPath)
+
+    def importPart(self, partName, brepPath):
+        ''' Add a part that was built by another process from its BREP file,
+        as if it had been built with buildPart: every object of the build
+        becomes one Part::Feature labelled partName.
+        '''
+        import Part
+        objs = []
+        for shape in Part.read(brepPath).childShapes():
+            obj = self.doc.addObject('Part::Feature', partName)
+            obj.Shape = shape
+            obj.Label = partName
+            objs += [obj]
+        self.doc.recompute()
         self._buildPartsDict[partName] = objs
         for obj in objs:
             self.model.registerCadPart(partName, obj.Name, None)
@@ -198,29 +227,35 @@ class modelBuilder:
             totalFileNamesList = []
             totalPartNamesList = []
             objsList = self._buildPartsDict[partName]
-            mergedObj = genUnion(objsList, consumeInputs=True)
+            with traceSpan(self.tracer, partName, cat='merge'):
+                mergedObj = genUnion(objsList, consumeInputs=True)
             mergedObj.Label = partName
             totalObjsDict[partName] = mergedObj
         # Now that we have merged the objects, we want to center them  in the x-y 
         # plane so the distances aren't ridiculous:
-        centerObjects(totalObjsDict.values())
+        with traceSpan(self.tracer, 'centerObjects', cat='export'):
+            centerObjects(totalObjsDict.values())
         # Finally, we go through the dictionary and export:
         for partName in totalObjsDict.keys():
             obj = totalObjsDict[partName]
             objFCName = obj.Name
             if stepFileDir is not None:
                 filePath = stepFileDir + '/' + partName + '.step'
-                exportCAD(obj, filePath)
+                with traceSpan(self.tracer, partName, cat='exportCAD'):
+                    exportCAD(obj, filePath)
                 self.model.registerCadPart(partName, objFCName, filePath, reset=True)
             if stlFileDir is not None:
                 filePath = stlFileDir + '/' + partName + '.stl'
-                exportMeshed(obj, filePath)
+                with traceSpan(self.tracer, partName, cat='exportMeshed'):
+                    exportMeshed(obj, filePath)
 
     def saveFreeCADState(self, fileName):
-        ''' Save a copy of the freeCAD model and do garbage collection.
+        ''' Save a copy of the freeCAD model and do garbage collection. The
+        document itself keeps its file name, so a warm geometry worker can keep
+        serving it.
         '''
         self._collect_garbarge()
-        FreeCAD.ActiveDocument.saveAs(fileName)
+        FreeCAD.ActiveDocument.saveCopy(fileName)
 
     def _build_extrude(self, partName):
         ''' Build an extrude part.
@@ -9,6 +9,7 @@ import FreeCAD
 import Draft
 import Part
 import Sketcher
+import math
 import numpy as np
 from copy import deepcopy
 
@@ -72,7 +73,66 @@ def findSegments(mySketch):
     return lineSegments
 
 
-def nextSegment(lineSegments, segIndex, tol=1e-8, fixOrder=True):
+class EndpointIndex:
+    '''Spatial hash of the end points of line segments, to find the segments that touch a point
+    without comparing it against all segments.
+
+        lineSegments: ndarray with [lineSegmentIndex,start/end point,coordinate]
+        tol: repair tolerance for matching, as in nextSegment
+    '''
+
+    def __init__(self, lineSegments, tol=1e-8):
+        self.lineSegments = lineSegments
+        self.tol = tol
+        # Points within tol of each other differ by at most one cell in every coordinate:
+        self.cellSize = 2. * tol
+        self.cells = {}
+        for segIndex in range(lineSegments.shape[0]):
+            self._add(segIndex)
+
+    def _cell(self, point):
+        if self.cellSize > 0.:
+            return tuple(int(math.floor(x / self.cellSize)) for x in point)
+        return tuple(point)
+
+    def _neighbourCells(self, point):
+        cell = self._cell(point)
+        if self.cellSize <= 0.:
+            return [cell]
+        cells = [()]
+        for x in cell:
+            cells = [c + (x + dx,) for c in cells for dx in (-1, 0, 1)]
+        return cells
+
+    def _add(self, segIndex):
+        for end in (0, 1):
+            cell = self._cell(self.lineSegments[segIndex, end, :])
+            self.cells.setdefault(cell, []).append((segIndex, end))
+
+    def _remove(self, segIndex):
+        for end in (0, 1):
+            cell = self._cell(self.lineSegments[segIndex, end, :])
+            self.cells[cell].remove((segIndex, end))
+
+    def near(self, point):
+        '''The (lineSegmentIndex, start/end) pairs of the end points within tol of point.
+        '''
+        matches = []
+        for cell in self._neighbourCells(point):
+            for segIndex, end in self.cells.get(cell, []):
+                if np.sum(np.abs(point - self.lineSegments[segIndex, end, :])) <= self.tol:
+                    matches += [(segIndex, end)]
+        return sorted(matches)
+
+    def flip(self, segIndex):
+        '''Swap the start and end point of a segment, in the segments and the index.
+        '''
+        self._remove(segIndex)
+        self.lineSegments[segIndex] = self.lineSegments[segIndex, ::-1, :].copy()
+        self._add(segIndex)
+
+
+def nextSegment(lineSegments, segIndex, tol=1e-8, fixOrder=True, index=None):
     '''Function to compute the next line segment in a collection of tuples
     defining several cycles. 
 
@@ -80,13 +140,21 @@ def nextSegment(lineSegments, segIndex, tol=1e-8, fixOrder=True):
         segIndex: the index to consider
         tol: repair tolerance for matching
         fixOrder: whether the order lineSegments should be repaired on the fly
+        index: EndpointIndex of lineSegments to use instead of comparing against all segments,
+            which is much faster when called for many segments
     '''
-    diffList0 = np.sum(np.abs(lineSegments[segIndex, 1, :] - lineSegments[:, 0, :]), axis=1)
-    diffList1 = np.sum(np.abs(lineSegments[segIndex, 1, :] - lineSegments[:, 1, :]), axis=1)
-    diffList0[segIndex] = 1000.
-    diffList1[segIndex] = 1000.
-    nextList0 = np.where(diffList0 <= tol)[0]
-    nextList1 = np.where(diffList1 <= tol)[0]
+    if index is not None:
+        matches = [match for match in index.near(lineSegments[segIndex, 1, :])
+                   if match[0] != segIndex]
+        nextList0 = [i for i, end in matches if end == 0]
+        nextList1 = [i for i, end in matches if end == 1]
+    else:
+        diffList0 = np.sum(np.abs(lineSegments[segIndex, 1, :] - lineSegments[:, 0, :]), axis=1)
+        diffList1 = np.sum(np.abs(lineSegments[segIndex, 1, :] - lineSegments[:, 1, :]), axis=1)
+        diffList0[segIndex] = 1000.
+        diffList1[segIndex] = 1000.
+        nextList0 = np.where(diffList0 <= tol)[0]
+        nextList1 = np.where(diffList1 <= tol)[0]
     if len(nextList0) + len(nextList1) > 1:
         raise ValueError('Multiple possible paths found while parsing cycles in sketch.')
     elif len(nextList0) + len(nextList1) < 1:
@@ -95,26 +163,34 @@ def nextSegment(lineSegments, segIndex, tol=1e-8, fixOrder=True):
         return nextList0[0]
     else:
         if fixOrder:
-            # the points were out of order, so they need to be switched            
-            nextPoint0 = deepcopy(lineSegments[nextList1[0], 0, :])
-            nextPoint1 = deepcopy(lineSegments[nextList1[0], 1, :])
-            lineSegments[nextList1[0], 0, :] = nextPoint1
-            lineSegments[nextList1[0], 1, :] = nextPoint0
+            # the points were out of order, so they need to be switched
+            if index is not None:
+                index.flip(nextList1[0])
+            else:
+                nextPoint0 = deepcopy(lineSegments[nextList1[0], 0, :])
+                nextPoint1 = deepcopy(lineSegments[nextList1[0], 1, :])
+                lineSegments[nextList1[0], 0, :] = nextPoint1
+                lineSegments[nextList1[0], 1, :] = nextPoint0
         return nextList1[0]
 
 
-def findCycle(lineSegments, startingIndex, availSegIDs):
+def findCycle(lineSegments, startingIndex, availSegIDs, index=None):
     '''Function to find a cycle in a collection of line segments given a starting
-    line segment.
+    line segment. At most len(availSegIDs) segments are followed. If no EndpointIndex
+    of lineSegments is given, one is built.
     '''
+    if index is None:
+        index = EndpointIndex(lineSegments)
     currentIndex = startingIndex
     segList = []
-    for i in availSegIDs:
-        currentIndex = nextSegment(lineSegments, currentIndex)
-        if currentIndex in segList:
+    visited = set()
+    for i in range(len(availSegIDs)):
+        currentIndex = nextSegment(lineSegments, currentIndex, index=index)
+        if currentIndex in visited:
             break
         else:
             segList += [currentIndex]
+            visited.add(currentIndex)
     return segList
 
 
@@ -162,15 +238,21 @@ def addPolyLineSketch(name, fcDoc, segmentOrder, lineSegments):
 def findEdgeCycles(sketch):
     """Find the list of edges in a sketch and separate them into cycles."""
     lineSegments = findSegments(sketch)
-    # Next, detect cycles:
-    availSegIDs = range(lineSegments.shape[0])
+    # Next, detect cycles, starting each one from the first segment not in a cycle yet:
+    index = EndpointIndex(lineSegments)
+    used = np.zeros(lineSegments.shape[0], dtype=bool)
+    numAvail = lineSegments.shape[0]
+    startingIndex = 0
     cycles = []
-    for i in range(len(availSegIDs)):
-        if len(availSegIDs) > 0:
-            startingIndex = availSegIDs[0]
-            newCycle = findCycle(lineSegments, startingIndex, availSegIDs)
-            cycles += [newCycle]
-            availSegIDs = [item for item in availSegIDs if item not in newCycle]
+    for i in range(lineSegments.shape[0]):
+        if numAvail == 0:
+            break
+        while used[startingIndex]:
+            startingIndex += 1
+        newCycle = findCycle(lineSegments, startingIndex, range(numAvail), index=index)
+        cycles += [newCycle]
+        numAvail -= np.count_nonzero(~used[newCycle])
+        used[newCycle] = True
     return lineSegments, cycles
 
 
@@ -0,0 +1,264 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file implements a content-addressed cache for the outputs of the geoGen
+# job step, so that sweep instances and runs with identical geometry inputs
+# can share a single FreeCAD build.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import re
+import json
+import shutil
+import tempfile
+from six import iteritems, string_types
+from qmt.batchManifest import fingerprintDict, fingerprintFile
+
+__all__ = ['GeometryCache', 'geometryKey', 'unlinkSharedOutputs']
+
+# Outputs of the geoGen step, relative to the instance directory:
+_cachedDirs = ['cadParts', 'stlParts']
+_cachedFiles = ['freeCADModel.FCStd']
+# Names in the expressions of geometric parameters:
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _referencedNames(obj):
+    ''' Collect all identifiers appearing in the strings of a nested json-like
+    object, e.g. the parameter names in 'width/2 + offset'.
+    '''
+    if isinstance(obj, string_types):
+        return set(_identifier.findall(obj))
+    names = set()
+    if isinstance(obj, dict):
+        for value in obj.values():
+            names |= _referencedNames(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            names |= _referencedNames(value)
+    return names
+
+
+def geometryKey(modelDict):
+    ''' Compute the cache key for the geometry of a model.
+
+        The key is a canonical hash of the FreeCAD file, the resolved geometric
+        parameters, the 3D parts (without the file names registered by a build),
+        the build order and the slice definitions. Geometric parameters of type
+        'python' only enter the key if they appear in an expression of the 3D
+        parts, the slices or the FreeCAD info, or in the value of another
+        parameter that does.
+    '''
+    parts = {}
+    for partName, partDict in iteritems(modelDict['3DParts']):
+        parts[partName] = dict((k, v) for k, v in iteritems(partDict) if k != 'fileNames')
+    sliceInfos = dict((sliceName, sliceData['sliceInfo'])
+                      for sliceName, sliceData in iteritems(modelDict['slices']))
+    geometricParams = modelDict['geometricParams']
+    referenced = _referencedNames([parts, sliceInfos, modelDict.get('freeCADInfo')])
+    params = {}
+    pending = set(paramName for paramName, (paramVal, paramType) in iteritems(geometricParams)
+                  if paramType != 'python') | referenced
+    while pending:
+        paramName = pending.pop()
+        if paramName in params or paramName not in geometricParams:
+            continue
+        paramVal, paramType = geometricParams[paramName]
+        params[paramName] = [paramVal, paramType]
+        pending |= _referencedNames(paramVal)
+    FCDocPath = modelDict['pathSettings'].get('freeCADPath')
+    return fingerprintDict({
+        'freeCADFile': fingerprintFile(FCDocPath) if FCDocPath else None,
+        'geometricParams': params,
+        '3DParts': parts,
+        'buildOrder': modelDict['buildOrder'],
+        'slices': sliceInfos,
+        'freeCADInfo': modelDict.get('freeCADInfo')})
+
+
+def _relocate(obj, oldPrefix, newPrefix):
+    ''' Replace a path prefix in all strings of a nested json-like object.
+    '''
+    if isinstance(obj, string_types):
+        if obj.startswith(oldPrefix):
+            return newPrefix + obj[len(oldPrefix):]
+        return obj
+    if isinstance(obj, dict):
+        return dict((k, _relocate(v, oldPrefix, newPrefix)) for k, v in iteritems(obj))
+    if isinstance(obj, (list, tuple)):
+        return [_relocate(v, oldPrefix, newPrefix) for v in obj]
+    return obj
+
+
+def _linkOrCopy(src, dst):
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
+
+
+def unlinkSharedOutputs(dirPath):
+    ''' Remove the geoGen outputs in an instance directory that are hard links
+    into a cache entry.
+
+        FreeCAD writes its exports in place, so a rebuild into linked files
+        would overwrite the cached copies. Call this before a fresh build.
+    '''
+    filePaths = [os.path.join(dirPath, fileName) for fileName in _cachedFiles]
+    for subDir in _cachedDirs:
+        subDirPath = os.path.join(dirPath, subDir)
+        if os.path.isdir(subDirPath):
+            filePaths += [os.path.join(subDirPath, fileName) for fileName in os.listdir(subDirPath)]
+    for filePath in filePaths:
+        try:
+            if os.stat(filePath).st_nlink > 1:
+                os.remove(filePath)
+        except OSError:  # missing file
+            pass
+
+
+def _dirSize(dirPath):
+    size = 0
+    for root, dirs, files in os.walk(dirPath):
+        for fileName in files:
+            size += os.path.getsize(os.path.join(root, fileName))
+    return size
+
+
+class GeometryCache:
+    def __init__(self, cacheDir, maxBytes=None):
+        ''' Content-addressed cache of geoGen outputs.
+
+            Each entry is a directory named by its geometryKey, holding the
+            cadParts and stlParts directories, the saved FreeCAD state and a
+            meta.json file with the part file names and slice parts. Entries
+            are linked (or copied, across file systems) into the instance
+            directory on a hit. The modification time of meta.json marks the
+            last use of an entry, and the least recently used entries are
+            evicted once the cache grows beyond maxBytes.
+
+            Parameters
+            ----------
+            cacheDir : str
+                Directory holding the cache. It may be shared between runs and
+                between concurrent workers.
+
+            Keyword arguments
+            ----------
+            maxBytes : int, default None
+                Size bound of the cache. If None, nothing is evicted.
+        '''
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.maxBytes = maxBytes
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:  # created concurrently
+                pass
+
+    def fetch(self, key, model):
+        ''' Populate the instance directory of a model from the cache.
+
+            Returns True on a hit, in which case the file names of the 3D parts
+            and the slice parts in model.modelDict have been restored. Returns
+            False on a miss.
+        '''
+        entryPath = os.path.join(self.cacheDir, key)
+        metaPath = os.path.join(entryPath, 'meta.json')
+        dirPath = model.modelDict['pathSettings']['dirPath']
+        try:
+            with open(metaPath, 'r') as myFile:
+                meta = json.load(myFile)
+            os.utime(metaPath, None)
+            for subDir in _cachedDirs:
+                dstDir = os.path.join(dirPath, subDir)
+                if not os.path.isdir(dstDir):
+                    os.mkdir(dstDir)
+                for fileName in os.listdir(os.path.join(entryPath, subDir)):
+                    dst = os.path.join(dstDir, fileName)
+                    if os.path.exists(dst):
+                        os.remove(dst)
+                    _linkOrCopy(os.path.join(entryPath, subDir, fileName), dst)
+            for fileName in _cachedFiles:
+                src = os.path.join(entryPath, fileName)
+                if os.path.isfile(src):
+                    dst = os.path.join(dirPath, fileName)
+                    if os.path.exists(dst):
+                        os.remove(dst)
+                    _linkOrCopy(src, dst)
+        except (IOError, OSError, ValueError):
+            # missing entry, or one that was evicted while we were reading it
+            return False
+        meta = _relocate(meta, meta['dirPath'] + '/', dirPath + '/')
+        for partName, fileNames in iteritems(meta['fileNames']):
+            model.modelDict['3DParts'][partName]['fileNames'] = fileNames
+        for sliceName, parts in iteritems(meta['slices']):
+            model.modelDict['slices'][sliceName]['parts'] = parts
+        return True
+
+    def store(self, key, model):
+        ''' Store the geoGen outputs of a freshly built model in the cache.
+        '''
+        entryPath = os.path.join(self.cacheDir, key)
+        if os.path.isdir(entryPath):
+            return
+        dirPath = model.modelDict['pathSettings']['dirPath']
+        meta = {'dirPath': dirPath,
+                'fileNames': dict((partName, partDict['fileNames']) for partName, partDict
+                                  in iteritems(model.modelDict['3DParts'])),
+                'slices': dict((sliceName, sliceData.get('parts', {})) for sliceName, sliceData
+                               in iteritems(model.modelDict['slices']))}
+        # Assemble the entry in a scratch directory and move it into place, so
+        # that readers never see a partial entry:
+        tmpPath = tempfile.mkdtemp(prefix='.tmp_', dir=self.cacheDir)
+        try:
+            for subDir in _cachedDirs:
+                os.mkdir(os.path.join(tmpPath, subDir))
+                srcDir = os.path.join(dirPath, subDir)
+                if os.path.isdir(srcDir):
+                    for fileName in os.listdir(srcDir):
+                        shutil.copy2(os.path.join(srcDir, fileName),
+                                     os.path.join(tmpPath, subDir, fileName))
+            for fileName in _cachedFiles:
+                if os.path.isfile(os.path.join(dirPath, fileName)):
+                    shutil.copy2(os.path.join(dirPath, fileName), os.path.join(tmpPath, fileName))
+            with open(os.path.join(tmpPath, 'meta.json'), 'w') as myFile:
+                json.dump(meta, myFile)
+            os.rename(tmpPath, entryPath)
+        except OSError:
+            # another worker stored the same entry first
+            pass
+        finally:
+            if os.path.isdir(tmpPath):
+                shutil.rmtree(tmpPath, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        ''' Remove the least recently used entries until the cache fits into
+        maxBytes. The entry named keep is never removed.
+        '''
+        if self.maxBytes is None:
+            return
+        entries = []
+        totalSize = 0
+        for key in os.listdir(self.cacheDir):
+            entryPath = os.path.join(self.cacheDir, key)
+            metaPath = os.path.join(entryPath, 'meta.json')
+            if key.startswith('.') or not os.path.isfile(metaPath):
+                continue
+            try:
+                lastUsed = os.path.getmtime(metaPath)
+                size = _dirSize(entryPath)
+            except OSError:  # evicted concurrently
+                continue
+            entries += [(lastUsed, key, size)]
+            totalSize += size
+        for lastUsed, key, size in sorted(entries):
+            if totalSize <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cacheDir, key), ignore_errors=True)
+            totalSize -= size
@@ -0,0 +1,277 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file implements geometry generation for batch runs, either in the
+# current process or in a long-lived worker process that keeps the FreeCAD
+# document loaded between sweep instances.
+#
+# The worker is started with
+#     python -m qmt.geoWorker <path to FCStd file>
+# and reads one json request per line from stdin, answering with one json
+# line per request on stdout.
+#
+# Independent groups of parts can also be built in separate processes, started
+# with
+#     python -m qmt.geoWorker --parts <model file> <output dir> <partName> ...
+# which write the shape of each part to <output dir>/<partName>.brep.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import json
+import subprocess
+import traceback
+from six import iteritems
+import qmt as QMT
+from qmt.timingTrace import Tracer, traceSpan
+from qmt.coreScheduler import CoreScheduler
+
+__all__ = ['buildGeometry', 'GeoWorker']
+
+
+def buildGeometry(myModel, tracer=None, numProcesses=None):
+    ''' Build, export and slice the geometry of a model in the active FreeCAD
+    document. If a Tracer is given, the stages are recorded as timing spans.
+
+    If numProcesses is larger than 1, the groups of parts that do not depend on
+    each other (see Model.partComponents) are binned into at most numProcesses
+    batches, which are built concurrently in separate FreeCAD processes. Their
+    shapes are imported into the active document, one object per object of
+    the build, before the parts are exported. The model must then be saved at
+    myModel.modelPath.
+    '''
+    from qmt.freecad import modelBuilder, build2DGeo, buildCrossSection
+
+    dirPath = myModel.modelDict['pathSettings']['dirPath']
+    # Build the model
+    buildModel = modelBuilder(passModel=myModel, tracer=tracer)
+    components = None
+    if numProcesses is not None and numProcesses > 1:
+        myModel.validatePartGraph()
+        components = myModel.partComponents()
+    if components is not None and len(components) > 1:
+        _buildComponents(myModel, buildModel, components, numProcesses, tracer)
+    else:
+        for i in range(len(myModel.modelDict['buildOrder'])):
+            partName = myModel.modelDict['buildOrder'][str(i)]
+            totalParts = len(myModel.modelDict['buildOrder'])
+            print('('+str(i+1)+'/'+str(totalParts)+') building part '+partName+'...')
+            buildModel.buildPart(partName)
+    cadDirPath = dirPath + '/cadParts'
+    stlDirPath = dirPath+'/stlParts'
+    if not os.path.isdir(cadDirPath):
+        os.mkdir(cadDirPath)
+    if not os.path.isdir(stlDirPath):
+        os.mkdir(stlDirPath)
+    with traceSpan(tracer, 'exportBuiltParts', cat='export'):
+        buildModel.exportBuiltParts(stepFileDir=dirPath + '/cadParts',stlFileDir=dirPath+'/stlParts')
+    with traceSpan(tracer, 'saveFreeCADState', cat='export'):
+        buildModel.saveFreeCADState(dirPath+'/freeCADModel.FCStd')
+
+    # Now that we have rendered the 3D objects, we want to draw any
+    # necessary 2D cross sections as 2D cuts:
+    for sliceName, sliceData in iteritems(myModel.modelDict['slices']):
+        with traceSpan(tracer, sliceName, cat='slice'):
+            if sliceData['sliceInfo'].get('crossSection'):
+                parts = buildCrossSection(sliceData['sliceInfo'], passModel=myModel)
+            else:
+                parts = build2DGeo(passModel=myModel)
+        sliceData['parts'] = parts
+
+
+def _batchComponents(components, numBatches):
+    ''' Bin groups of independent parts into at most numBatches batches with
+    similar numbers of parts, largest groups first. Every batch lists the
+    parts of its groups one group after the other, so each group keeps its
+    build order.
+    '''
+    batches = [[] for i in range(min(numBatches, len(components)))]
+    for partNames in sorted(components, key=len, reverse=True):
+        min(batches, key=len).extend(partNames)
+    return batches
+
+
+def _buildComponents(myModel, buildModel, components, numProcesses, tracer):
+    ''' Build groups of independent parts in at most numProcesses separate
+    processes, and import the resulting shapes with buildModel.
+    '''
+    partDir = myModel.modelDict['pathSettings']['dirPath'] + '/partBuilds'
+    if not os.path.isdir(partDir):
+        os.mkdir(partDir)
+    # One process per batch, so that every FreeCAD startup and document load
+    # is shared by as many parts as possible:
+    batches = _batchComponents(components, numProcesses)
+    scheduler = CoreScheduler(numProcesses)
+    for partNames in batches:
+        logName = partDir + '/' + partNames[0]
+        scheduler.submit(partNames[0], [sys.executable, '-m', 'qmt.geoWorker', '--parts',
+                                        myModel.modelPath, partDir] + partNames,
+                         logPath=logName + '.log', errPath=logName + '.err')
+    print('Building {} independent groups of parts in {} processes...'.format(
+        len(components), len(batches)))
+    with traceSpan(tracer, 'buildComponents', cat='geoGen', numComponents=len(components),
+                   numProcesses=len(batches)):
+        returnCodes = scheduler.run()
+    failed = sorted(name for name, returnCode in iteritems(returnCodes) if returnCode != 0)
+    if failed:
+        raise RuntimeError('Building the parts failed, see the logs of ' +
+                           ', '.join(partDir + '/' + name + '.err' for name in failed))
+    for partNames in batches:
+        tracePath = partDir + '/' + partNames[0] + '.trace.json'
+        if tracer is not None and os.path.isfile(tracePath):
+            with open(tracePath, 'r') as myFile:
+                tracer.extend(json.load(myFile)['traceEvents'])
+    # Import in buildOrder, so the parts are registered and exported in the
+    # same order as in a serial build:
+    order = myModel.buildOrderIndex()
+    for partName in sorted(sum(components, []), key=lambda name: order.get(name, len(order))):
+        buildModel.importPart(partName, partDir + '/' + partName + '.brep')
+
+
+def _buildParts(modelFilePath, partDir, partNames):
+    ''' Build some parts of a model in a fresh FreeCAD document and write
+    their shapes to partDir.
+    '''
+    import FreeCAD
+    from qmt.freecad import modelBuilder
+
+    myModel = QMT.Model(modelPath=modelFilePath)
+    FreeCAD.openDocument(myModel.modelDict['pathSettings']['freeCADPath'])
+    tracer = Tracer()
+    buildModel = modelBuilder(passModel=myModel, tracer=tracer)
+    for partName in partNames:
+        print('building part ' + partName + '...')
+        buildModel.buildPart(partName)
+    for partName in partNames:
+        with traceSpan(tracer, partName, cat='exportBrep'):
+            buildModel.exportPartShape(partName, partDir + '/' + partName + '.brep')
+    tracer.write(partDir + '/' + partNames[0] + '.trace.json', merge=False)
+
+
+class GeoWorker:
+    def __init__(self, FCDocPath):
+        ''' Client for a long-lived geometry worker process.
+
+            The worker opens the FreeCAD document once. For every instance it
+            applies the geometric parameters, builds, exports and slices the
+            model, and then rolls the document back to its pristine state. This
+            saves the FreeCAD startup and document load for all but the first
+            instance. If the rollback cannot be verified, the worker reloads the
+            document instead; self.reloads counts these reloads.
+
+            Parameters
+            ----------
+            FCDocPath : str
+                Path to the FreeCAD file to keep loaded.
+        '''
+        self.FCDocPath = FCDocPath
+        self._process = subprocess.Popen([sys.executable, '-m', 'qmt.geoWorker', FCDocPath],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         universal_newlines=True)
+        self.reloads = 0
+
+    def build(self, modelFilePath, tracer=None):
+        ''' Build the geometry of the model at modelFilePath in the worker. The
+        model file is updated by the worker, as in Harness.runBatchGeoGen. The
+        timing spans of the worker are added to tracer, if given.
+        '''
+        if self._process.poll() is not None:
+            raise RuntimeError('The geometry worker for ' + self.FCDocPath + ' is not running.')
+        try:
+            self._process.stdin.write(json.dumps({'modelFilePath': modelFilePath}) + '\n')
+            self._process.stdin.flush()
+            line = self._process.stdout.readline()
+        except (IOError, OSError):  # broken pipe
+            line = ''
+        if not line:
+            raise RuntimeError('The geometry worker for ' + self.FCDocPath + ' died.')
+        reply = json.loads(line)
+        self.reloads = reply['reloads']
+        if tracer is not None:
+            tracer.extend(reply['traceEvents'])
+        if reply['status'] != 'done':
+            raise RuntimeError('Geometry generation failed in the worker:\n' + reply['error'])
+
+    def close(self):
+        ''' Stop the worker process.
+        '''
+        try:
+            self._process.stdin.close()
+        except (IOError, OSError):  # the worker is gone already
+            pass
+        self._process.wait()
+
+
+def _docSignature(doc):
+    ''' Cheap signature of the state of a FreeCAD document that does not depend
+    on recomputed geometry: the objects with their labels and expressions, the
+    constraints of sketches and the contents of spreadsheets. These are what a
+    build changes when it applies the geometric parameters or adds parts.
+    '''
+    signature = []
+    for obj in doc.Objects:
+        entry = [obj.Name, obj.TypeId, obj.Label]
+        entry += [tuple(expression) for expression in getattr(obj, 'ExpressionEngine', [])]
+        if obj.TypeId == 'Sketcher::SketchObject':
+            entry += [(constraint.Name, constraint.Type, constraint.Value)
+                      for constraint in obj.Constraints]
+        if obj.TypeId == 'Spreadsheet::Sheet':
+            entry += [(cell, obj.getContents(cell)) for cell in sorted(obj.getUsedCells())]
+        signature += [tuple(entry)]
+    return sorted(signature)
+
+
+def _serve(FCDocPath):
+    ''' Serve geometry requests on stdin/stdout until stdin is closed.
+    '''
+    # Keep the protocol channel private, and send all other output (including
+    # that of FreeCAD itself) to stderr:
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    import FreeCAD
+
+    def openPristine():
+        doc = FreeCAD.openDocument(FCDocPath)
+        doc.UndoMode = 1
+        return doc, _docSignature(doc)
+
+    doc, pristine = openPristine()
+    reloads = 0
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        FreeCAD.setActiveDocument(doc.Name)
+        doc.openTransaction('geoGen')
+        tracer = Tracer()
+        try:
+            myModel = QMT.Model(modelPath=request['modelFilePath'])
+            geoGenArgs = myModel.modelDict['jobSettings'].get('geoGenArgs', {})
+            buildGeometry(myModel, tracer=tracer, numProcesses=geoGenArgs.get('parallelParts'))
+            myModel.saveModel(inlineArrays=True)
+            reply = {'status': 'done'}
+        except Exception:
+            reply = {'status': 'error', 'error': traceback.format_exc()}
+        reply['traceEvents'] = tracer.events
+        # Roll back to the pristine document, and reload it if that fails or
+        # cannot be verified:
+        try:
+            doc.abortTransaction()
+            rolledBack = _docSignature(doc) == pristine
+        except Exception:
+            rolledBack = False
+        if not rolledBack:
+            FreeCAD.closeDocument(doc.Name)
+            doc, pristine = openPristine()
+            reloads += 1
+        reply['reloads'] = reloads
+        sys.stdout.flush()
+        replies.write(json.dumps(reply) + '\n')
+        replies.flush()
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--parts':
+        _buildParts(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        _serve(sys.argv[1])
@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file reads and writes the json files of qmt. If orjson is installed it is
+# used as a faster backend, with the standard library as fallback, and files
+# are always written atomically.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import json
+import errno
+import binascii
+from six import string_types, integer_types
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['loadJSON', 'saveJSON', 'saveArray', 'setJSONBackend', 'getJSONBackend']
+
+_backend = 'orjson' if orjson is not None else 'json'
+
+# Types that cannot hold NaN or Infinity, see _hasNonFinite:
+_plainTypes = frozenset(string_types + integer_types + (bool, type(None)))
+
+
+def setJSONBackend(backend):
+    ''' Select the json backend, either 'orjson' or 'json' (the standard library).
+    '''
+    global _backend
+    if backend not in ['orjson', 'json']:
+        raise ValueError('Unknown json backend ' + str(backend) + '.')
+    if backend == 'orjson' and orjson is None:
+        raise ImportError('orjson is not installed.')
+    _backend = backend
+
+
+def getJSONBackend():
+    ''' Name of the json backend in use.
+    '''
+    return _backend
+
+
+def _jsonDefault(obj):
+    # numpy scalars and arrays, which the standard library rejects:
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _hasNonFinite(obj):
+    ''' Whether obj contains NaN or Infinity, which orjson would write as null.
+    '''
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        cls = type(obj)
+        if cls is float:
+            if obj - obj != 0.:  # NaN or +/-Infinity
+                return True
+        elif cls is dict:
+            stack.extend(obj.values())
+        elif cls is list or cls is tuple:
+            stack.extend(obj)
+        elif cls in _plainTypes:
+            continue
+        elif hasattr(obj, 'dtype'):  # numpy arrays and scalars
+            if obj.dtype.kind in 'fc':
+                import numpy as np
+                if not np.isfinite(obj).all():
+                    return True
+            elif obj.dtype.kind == 'O':
+                stack.append(obj.tolist())
+        elif isinstance(obj, float) and obj - obj != 0.:
+            return True
+    return False
+
+
+def _dumps(obj):
+    ''' Serialize obj to json bytes.
+    '''
+    if _backend == 'orjson':
+        try:
+            data = orjson.dumps(obj, default=_jsonDefault,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            data = None  # e.g. integers beyond 64 bits, which only the standard library handles
+        # orjson writes NaN and Infinity as null, so they can only be present
+        # if the output has nulls:
+        if data is not None and (b'null' not in data or not _hasNonFinite(obj)):
+            return data
+    return json.dumps(obj, default=_jsonDefault).encode('utf-8')
+
+
+def _loads(data):
+    ''' Parse json bytes.
+    '''
+    if _backend == 'orjson':
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass  # e.g. NaN or Infinity, which only the standard library accepts
+    return json.loads(data.decode('utf-8'))
+
+
+def loadJSON(filePath):
+    ''' Load a json file.
+    '''
+    with open(filePath, 'rb') as myFile:
+        return _loads(myFile.read())
+
+
+def _createTemporary(filePath):
+    ''' Create a new file under a random name next to filePath and open it for
+    writing. Unlike tempfile.mkstemp, which always uses mode 0600, the file
+    gets the permissions that the umask gives to any new file.
+    '''
+    dirPath, fileName = os.path.split(os.path.abspath(filePath))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmpPath = os.path.join(dirPath, '.{}.{}.tmp'.format(
+            fileName, binascii.hexlify(os.urandom(6)).decode('ascii')))
+        try:
+            return os.open(tmpPath, flags, 0o666), tmpPath
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+
+def _atomicWrite(filePath, write):
+    ''' Call write with a binary file object opened under a temporary name in
+    the directory of filePath, sync it to disk, and then rename the file into
+    place.
+    '''
+    fd, tmpPath = _createTemporary(filePath)
+    try:
+        with os.fdopen(fd, 'wb') as myFile:
+            write(myFile)
+            # Flush the data to disk first, or the rename may survive a crash without it:
+            myFile.flush()
+            os.fsync(myFile.fileno())
+        if sys.version_info >= (3, 3):
+            os.replace(tmpPath, filePath)
+        else:
+            if os.name == 'nt' and os.path.exists(filePath):
+                os.remove(filePath)
+            os.rename(tmpPath, filePath)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+def saveJSON(obj, filePath):
+    ''' Save obj to a json file.
+
+        The file is written under a temporary name in the same directory and
+        then renamed into place, so readers see either the old or the new
+        contents, never a partial file.
+    '''
+    data = _dumps(obj)
+    _atomicWrite(filePath, lambda myFile: myFile.write(data))
+
+
+def saveArray(array, filePath):
+    ''' Save a numpy array to a .npy file, atomically like saveJSON.
+    '''
+    import numpy as np
+    _atomicWrite(filePath, lambda myFile: np.save(myFile, array, allow_pickle=False))
@@ -0,0 +1,48 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file provides lazily loaded module attributes for python versions
+# without module-level __getattr__ (PEP 562, python 3.7+).
+#
+
+from __future__ import absolute_import, division, print_function
+import sys
+import types
+
+__all__ = ['installLazyModule']
+
+
+class _LazyModule(types.ModuleType):
+    ''' Stand-in for a module in sys.modules, whose lazy attributes are loaded
+    on first access.
+    '''
+
+    def __init__(self, module, lazyNames, load):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # Keep the module alive: python 2 clears the globals of modules that
+        # are garbage collected, and the functions of the module still use them.
+        self.__dict__['_LazyModule__module'] = module
+        self.__dict__['_LazyModule__lazyNames'] = frozenset(lazyNames)
+        self.__dict__['_LazyModule__load'] = load
+
+    def __getattr__(self, name):
+        if name in self.__lazyNames:
+            value = self.__load(name)
+            setattr(self, name, value)
+            return value
+        raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | self.__lazyNames)
+
+
+def installLazyModule(moduleName, lazyNames, load):
+    ''' Replace the module moduleName in sys.modules by a stand-in that calls
+    load(name) for the attributes in lazyNames when they are first accessed.
+
+    Call this at the end of the module, on python versions without module-level
+    __getattr__. Only star imports of names in the module's __all__ load them.
+    '''
+    sys.modules[moduleName] = _LazyModule(sys.modules[moduleName], lazyNames, load)
@@ -11,21 +11,156 @@ import json
 import re
 import os
 import sys
+import errno
+import marshal
+import hashlib
+import tempfile
 import collections
 from six import iteritems
 from ast import literal_eval
 import numpy as np
+from qmt.numericUnits import conversionFactor
+from qmt.quantityArray import QuantityArray
+
+__all__ = ['Material', 'Materials', 'BandAlignment', 'sharedMaterials', 'conduction_band_offset',
+           'valence_band_offset']
+
+# Parsed materials files, keyed by absolute path, as (signature, matDict, bowingParameters) with
+# the (mtime, size) of the file they were parsed from:
+_dbCache = {}
+# Shared Materials instances, see sharedMaterials:
+_sharedMaterials = {}
+# Conversion factors from meV to other energy units, see _energyFactor:
+_energyFactors = {}
+# Anderson's rule fallback messages of conduction_band_offset and valence_band_offset that have
+# already been printed, so that each is only printed once per process:
+_printedFallbacks = set()
+# Properties of a Material that have the dimension of an energy:
+_energyKeys = frozenset(['workFunction', 'electronAffinity', 'directBandGap', 'valenceBandOffset',
+                         'chargeNeutralityLevel', 'interbandMatrixElement', 'spinOrbitSplitting'])
+
+
+def _fileSignature(filePath):
+    stat = os.stat(filePath)
+    return (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size)
+
+
+def _compiledPath(contents):
+    '''Path of the compiled form of the contents of a materials file, or None if no compiled
+    forms are kept. They are only kept if the environment variable QMT_MATERIALS_CACHE names a
+    directory for them. The name includes the Python version, since the marshal format depends
+    on it.
+    '''
+    cacheDir = os.environ.get('QMT_MATERIALS_CACHE')
+    if not cacheDir:
+        return None
+    fileName = '{}.py{}{}.marshal'.format(hashlib.sha1(contents).hexdigest(),
+                                          *sys.version_info[:2])
+    return os.path.join(cacheDir, fileName)
+
+
+def _compile(compiledPath, entry):
+    '''Write the compiled form of a parsed materials file. Failures are ignored, the json is
+    simply parsed again next time.
+    '''
+    try:
+        dirPath = os.path.dirname(compiledPath)
+        try:
+            os.makedirs(dirPath, 0o700)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        fd, tmpPath = tempfile.mkstemp(dir=dirPath, suffix='.tmp')
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as myFile:
+            myFile.write(marshal.dumps(entry))
+        os.rename(tmpPath, compiledPath)
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+def _readDB(matPath, signature):
+    '''Parse a materials file into its material dict and bowing parameters.
 
-try:
+    If QMT_MATERIALS_CACHE is set, the result is also compiled into a marshal file keyed by the
+    hash of the file contents, which later processes load several times faster than they parse
+    the json, mostly because the bowing parameter keys need no literal_eval. This only pays off
+    for large databases.
+    '''
+    with open(matPath, 'rb') as myFile:
+        contents = myFile.read()
+    compiledPath = _compiledPath(contents)
+    if compiledPath is not None:
+        try:
+            with open(compiledPath, 'rb') as myFile:
+                matDict, bowingParameters = marshal.loads(myFile.read())
+            return signature, matDict, bowingParameters
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            pass
+    matDict = json.loads(contents.decode('utf-8'))
+    bowingParameters = dict((literal_eval(k), v) for k, v
+                            in iteritems(matDict.pop('__bowing_parameters', {})))
+    if compiledPath is not None:
+        _compile(compiledPath, (matDict, bowingParameters))
+    return signature, matDict, bowingParameters
+
+
+def _physicsConstants():
+    '''The sympy-backed units module, which is only imported when needed since sympy is slow to
+    import (and may be missing, e.g. in FreeCAD).
+    '''
     import qmt.physics_constants as pc
+    return pc
+
+
+def _energyFactor(eunit):
+    '''Float factor converting energies in meV to the unit eunit, computed once per unit.
+    '''
+    try:
+        return _energyFactors[eunit]
+    except KeyError:
+        try:
+            factor = conversionFactor('meV', eunit)
+        except KeyError:  # e.g. a sympy quantity
+            pc = _physicsConstants()
+            factor = pc.toFloat(pc.units.meV / pc.parseUnit(eunit))
+        _energyFactors[eunit] = factor
+        return factor
 
-    units = pc.units
-    parseUnit = pc.parseUnit
-    toFloat = pc.toFloat
-except ImportError:  # to avoid problems if we are using FreeCAD
-    pass
 
-__all__ = ['Material', 'Materials', 'conduction_band_offset', 'valence_band_offset']
+def _defaultMatPath():
+    return os.path.join(os.path.dirname(__file__), 'materials.json')
+
+
+def sharedMaterials(matPath=None):
+    '''
+    Return the process-wide Materials instance for a materials file.
+
+    The file is parsed once and only reloaded when its modification time or size changes, and
+    the instance memoizes find, so repeated lookups (including alloys) are cheap. The instance is
+    shared by all callers and should be treated as read-only; construct a Materials object to get
+    a private, modifiable database.
+
+    Arguments
+    ---------
+    matPath: str, default None
+    Path to the materials json file. Defaults to the materials.json shipped with this module.
+    '''
+    if matPath is None:
+        matPath = _defaultMatPath()
+    matPath = os.path.abspath(matPath)
+    try:
+        signature = _fileSignature(matPath)
+    except OSError:
+        signature = None
+    entry = _sharedMaterials.get(matPath)
+    if entry is None or entry[0] != signature:
+        entry = (signature, Materials(matPath))
+        _sharedMaterials[matPath] = entry
+    return entry[1]
 
 
 class Material(collections.Mapping):
@@ -46,25 +181,25 @@ class Material(collections.Mapping):
     eunit: str, default None
     Unit of energy. If specified, all queries for band parameters that have the dimension of an
     energy return floats with respect to this energy unit. With the default (None), such queries
-    return sympy quantities that have the dimension of an energy.
+    return sympy quantities that have the dimension of an energy. Properties may also be numpy
+    arrays, e.g. from Materials.binaryAlloyProperties, in which case queries return arrays.
     '''
 
     def __init__(self, name, properties, eunit=None):
         self.name = name
         self.properties = dict(properties)
         if eunit is None:
-            self.energyUnit = units.meV
+            self.energyUnit = _physicsConstants().units.meV
         else:
-            self.energyUnit = toFloat(units.meV / parseUnit(eunit))
+            self.energyUnit = _energyFactor(eunit)
 
     def __getitem__(self, key):
         try:
             value = self.properties[key]
         except KeyError:
             raise KeyError("KeyError: material '{}' has no '{}'".format(self.name, key))
-        if key in ('workFunction', 'electronAffinity', 'directBandGap', 'valenceBandOffset',
-                   'chargeNeutralityLevel', 'interbandMatrixElement', 'spinOrbitSplitting'):
-            value *= self.energyUnit
+        if key in _energyKeys:
+            value = value * self.energyUnit  # not in place, properties may be arrays
         return value
 
     def __iter__(self):
@@ -76,6 +211,26 @@ class Material(collections.Mapping):
     def __repr__(self):
         return 'Material({}, {}, {})'.format(self.name, self.properties, self.energyUnit)
 
+    def quantity(self, key):
+        '''
+        Return a property as a QuantityArray, e.g. to combine band edges with potential fields.
+
+        Energies are tagged with meV (the unit of the database), the electron mass with the bare
+        electron mass and the surface charge density with cm^-2 eV^-1. Other properties are
+        dimensionless. The result does not depend on eunit.
+        '''
+        try:
+            value = self.properties[key]
+        except KeyError:
+            raise KeyError("KeyError: material '{}' has no '{}'".format(self.name, key))
+        if key in _energyKeys:
+            return QuantityArray(value, 'meV')
+        if key == 'electronMass':
+            return QuantityArray(value, 'm_e')
+        if key == 'surfaceChargeDensity':
+            return QuantityArray(value) / QuantityArray(1., 'cm') ** 2 / QuantityArray(1., 'eV')
+        return QuantityArray(value)
+
     def serializeDict(self):
         '''Return a dict with the material properties that can be dumped to json.
         '''
@@ -150,19 +305,29 @@ class Materials:
 
         matDict : dict, default None
         Dictionary of materials to fill the database.
+
+        eunit : str, default None
+        Default unit of energy of find. If specified, materials and band positions are plain
+        floats (or numpy arrays) in this unit, without any sympy arithmetic, which is much faster
+        in loops. The numbers are the same as with find(name, eunit=eunit).
     '''
 
-    def __init__(self, matPath=None, matDict=None):
+    def __init__(self, matPath=None, matDict=None, eunit=None):
         self.matDict = {}
+        self.eunit = eunit
         self.bowingParameters = {}
+        self._found = {}  # memo of find, keyed by (name, eunit)
+        self._alignments = {}  # memo of bandAlignment, keyed by eunit
         if matPath is None and matDict is None:
-            matPath = os.path.join(os.path.dirname(__file__), 'materials.json')
+            matPath = _defaultMatPath()
         self.matPath = matPath
         if matPath is not None:
             self.load()
         if matDict is not None:
             self.bowingParameters.update(matDict.pop('__bowing_parameters', {}))
             self.matDict = matDict
+            self._found = {}
+            self._alignments = {}
 
     def genMat(self, name, matType, **kwargs):
         '''Generate a material and add it to the matDict.
@@ -170,10 +335,14 @@ class Materials:
         if matType in ('metal', 'dielectric'):
             kwargs['electronMass'] = kwargs.get('electronMass', 1.)
         self.matDict[name] = self._makeMaterial(matType, **kwargs)
+        self._found = {}
+        self._alignments = {}
 
     def setBowingParameters(self, nameA, nameB, matType, **kwargs):
         '''Generate a bowing parameter set and add it to the bowingParameters dict.'''
         self.bowingParameters[(nameA, nameB)] = self._makeMaterial(matType, **kwargs)
+        self._found = {}
+        self._alignments = {}
 
     def _makeMaterial(self, matType, **kwargs):
         material = {}
@@ -220,14 +389,29 @@ class Materials:
         If the material is not found directly, an attempt is made to construct it by mixing two
         known materials. If that also fails, a KeyError is raised.
 
+        Results are memoized per (name, eunit) until the database is changed through genMat,
+        setBowingParameters or deserializeDict. Changes made to matDict directly are not noticed.
+        Every call returns a new Material with its own copy of the properties.
+
         Arguments
         ---------
         name: str
         Name of the desired material.
 
         eunit: str
-        Unit of energy. This is passed on to the Material constructor.
+        Unit of energy. This is passed on to the Material constructor. Defaults to the eunit of
+        this Materials instance.
         '''
+        if eunit is None:
+            eunit = self.eunit
+        key = (name, eunit)
+        if key not in self._found:
+            self._found[key] = self._find(name, eunit)
+        # A fresh Material, so that callers cannot modify the memo (or the shared database):
+        found = self._found[key]
+        return Material(found.name, found.properties, eunit=eunit)
+
+    def _find(self, name, eunit):
         if name in self.matDict:
             properties = self.matDict[name]
         else:
@@ -273,11 +457,42 @@ class Materials:
         with the bowing parameter O_{AB}.
         '''
         assert x >= 0 and x <= 1
+        alloy = self.binaryAlloyProperties(nameA, nameB, x)
+        for key, val in iteritems(alloy):
+            if key != 'type':
+                alloy[key] = float(val)
+        return alloy
+
+    def binaryAlloyProperties(self, nameA, nameB, x):
+        '''
+        Interpolate the properties of binary alloys A_{1-x} B_x for many compositions at once.
+
+        This applies the same bowing parameters and linear fallback as the alloys constructed by
+        find, see _makeBinaryAlloy, in one vectorized pass over the compositions.
+
+        Arguments
+        ---------
+        nameA, nameB: str
+        Names of the end-point materials in the database.
+
+        x: float or array_like
+        Fractions of material B, between 0 and 1.
+
+        Returns
+        -------
+        A dict mapping every property shared by the end points to an array with the shape of x
+        (in the units of the database, i.e. meV for energies), and 'type' to the material type.
+        '''
+        x = np.asarray(x, dtype=float)
+        if np.any(x < 0) or np.any(x > 1):
+            raise ValueError('Alloy compositions must lie between 0 and 1.')
         if (nameB, nameA) in self.bowingParameters:
             nameA, nameB = nameB, nameA
             x = 1. - x
         matA, matB = self.find(nameA, eunit='meV'), self.find(nameB, eunit='meV')
         bow = self.bowingParameters.get((nameA, nameB), {})
+        # The interpolation weights are shared by all properties:
+        wA, wB, wBow = 1 - x, x, x * (1 - x)
         alloy = {}
         for key, valA in iteritems(matA):
             if key not in matB:
@@ -285,13 +500,90 @@ class Materials:
             valB = matB[key]
             if key == 'type':
                 assert valA == valB
-                val = valA
+                alloy[key] = valA
             else:
-                bowVal = bow.get(key, 0)
-                val = (1 - x) * valA + x * valB - x * (1 - x) * bowVal
-            alloy[key] = val
+                alloy[key] = wA * valA + wB * valB - wBow * bow.get(key, 0)
         return alloy
 
+    def gradedPropertyFields(self, nameA, nameB, x, properties=None, eunit=None,
+                             chunkSize=2**20, outDir=None):
+        '''
+        Compute property fields of a graded binary alloy A_{1-x} B_x from a composition field.
+
+        The composition field is processed in chunks of chunkSize points, so that no temporary
+        array is larger than a chunk, even if x is not contiguous (e.g. a sliced or transposed
+        memmap). Alloy properties are interpolated as in
+        binaryAlloyProperties, and band edges are aligned as in conductionBandMinimum and
+        valenceBandMaximum.
+
+        Arguments
+        ---------
+        nameA, nameB: str
+        Names of the end-point materials in the database.
+
+        x: array_like
+        Fractions of material B on a grid of any shape, e.g. a numpy.memmap.
+
+        properties: list of str, default None
+        Names of the fields to compute: material properties, 'conductionBandMinimum' or
+        'valenceBandMaximum'. Defaults to the relative permittivity, the electron mass and the
+        band edges.
+
+        eunit: str, default None
+        Unit of energy of the fields. Defaults to the eunit of this Materials instance, or meV.
+
+        chunkSize: int, default 2**20
+        Number of grid points processed at once.
+
+        outDir: str, default None
+        If given, every field is written to a memory-mapped file <outDir>/<property>.npy instead
+        of being held in memory.
+
+        Returns
+        -------
+        A dict mapping the names of the properties to arrays with the shape of x.
+        '''
+        if properties is None:
+            properties = ['relativePermittivity', 'electronMass', 'conductionBandMinimum',
+                          'valenceBandMaximum']
+        if eunit is None:
+            eunit = self.eunit if self.eunit is not None else 'meV'
+        x = np.asarray(x)
+        fields = {}
+        for prop in properties:
+            if outDir is None:
+                fields[prop] = np.empty(x.shape)
+            else:
+                fields[prop] = np.lib.format.open_memmap(os.path.join(outDir, prop + '.npy'),
+                                                         mode='w+', dtype=float, shape=x.shape)
+        messages = set()
+        # A buffered iterator hands out chunks of at most chunkSize points, copying only those
+        # chunks of x that are not contiguous, and writes the chunks back into the fields:
+        chunks = np.nditer([x] + [fields[prop] for prop in properties],
+                           flags=['external_loop', 'buffered', 'zerosize_ok'],
+                           op_flags=[['readonly']] + [['writeonly']] * len(properties),
+                           op_dtypes=[float] * (len(properties) + 1), casting='same_kind',
+                           order='C', buffersize=chunkSize)
+        for ops in chunks:
+            mat = Material(nameA + nameB, self.binaryAlloyProperties(nameA, nameB, ops[0]),
+                           eunit=eunit)
+            for prop, out in zip(properties, ops[1:]):
+                if prop == 'conductionBandMinimum':
+                    value, msg = self._conductionBandMinimum(mat)
+                elif prop == 'valenceBandMaximum':
+                    value, msg = self._valenceBandMaximum(mat)
+                else:
+                    value, msg = mat[prop], None
+                if msg is not None:
+                    messages.add(msg)
+                out[...] = value
+        for msg in sorted(messages):
+            print(msg)
+        for field in fields.values():
+            if isinstance(field, np.memmap):
+                field.flush()
+        return fields
+
     def serializeDict(self):
         db = self.matDict.copy()
         bowingParms = {}
@@ -303,6 +595,8 @@ class Materials:
     def deserializeDict(self, db):
         bowingParms = db.pop('__bowing_parameters', {})
         self.matDict = db
+        self._found = {}
+        self._alignments = {}
         self.bowingParameters = {}
         for k, v in iteritems(bowingParms):
             self.bowingParameters[literal_eval(k)] = v
@@ -316,15 +610,32 @@ class Materials:
 
     def load(self):
         '''Load the materials database from disk.
+
+        Files are parsed once per process and reused while their modification time and size are
+        unchanged. If QMT_MATERIALS_CACHE is set, a compiled form spares new processes the parse
+        (see _readDB). Each Materials instance gets its own copy of the data.
         '''
+        matPath = os.path.abspath(self.matPath)
         try:
-            with open(self.matPath, 'r') as myFile:
-                db = json.load(myFile)
-        except IOError:
+            signature = _fileSignature(matPath)
+            entry = _dbCache.get(matPath)
+            if entry is None or entry[0] != signature:
+                entry = _readDB(matPath, signature)
+                _dbCache[matPath] = entry
+            matDict, bowingParameters = _copyDB(entry[1]), _copyDB(entry[2])
+        except (IOError, OSError):
             print("Could not load materials file %s." % self.matPath)
             print("Generating a new file at that location...")
-            db = {}
-        self.deserializeDict(db)
+            matDict, bowingParameters = {}, {}
+        self.matDict = matDict
+        self.bowingParameters = bowingParameters
+        self._found = {}
+        self._alignments = {}
+
+    def _referenceLevel(self, ref):
+        '''Position of the InSb valence band maximum wrt the vacuum level, as a float in meV.
+        '''
+        return -float(ref['electronAffinity'] + ref['directBandGap'] + ref['valenceBandOffset'])
 
     def conductionBandMinimum(self, mat):
         '''
@@ -352,25 +663,10 @@ class Materials:
         - conduction_band_offset(mat1, mat2) is equivalent to
           `self.conductionBandMinimum(mat1) - self.conductionBandMinimum(mat2)`
         '''
-        ref_name = 'InSb'
-        try:
-            cbo = mat['valenceBandOffset'] + mat['directBandGap']
-            ref = self.matDict[ref_name]
-            ref_level = -(ref['electronAffinity'] + ref['directBandGap'] + ref['valenceBandOffset'])
-            ref_level *= mat.energyUnit
-            return cbo + ref_level
-        except KeyError:
-            # fall back to Anderson's rule
-            if 'cbo' not in locals():
-                msg = "Material '{}' misses valenceBandOffset or directBandGap.".format(mat.name)
-            elif 'ref' not in locals():
-                msg = "Reference material '" + ref_name + "' missing from materials library."
-            else:
-                msg = "Reference material '" + ref_name + "' misses valenceBandOffset or " \
-                                                          "directBandGap or electronAffinity."
-            msg += " Falling back on Anderson's rule."
+        level, msg = self._conductionBandMinimum(mat)
+        if msg is not None:
             print(msg)
-            return -mat['electronAffinity']
+        return level
 
     def valenceBandMaximum(self, mat):
         '''
@@ -391,13 +687,77 @@ class Materials:
         - valence_band_offset(mat1, mat2) is equivalent to
           `self.valenceBandMaximum(mat1) - self.valenceBandMaximum(mat2)`
         '''
+        level, msg = self._valenceBandMaximum(mat)
+        if msg is not None:
+            print(msg)
+        return level
+
+    def bandAlignment(self, eunit=None):
+        '''
+        Return the band alignment table of all semiconductors in the database.
+
+        Only materials of type 'semi' are in the table; looking up any other material, such as a
+        metal or dielectric, raises a KeyError. The table is computed once per energy unit and cached until the database is changed
+        through genMat, setBowingParameters or deserializeDict. Fallbacks on Anderson's rule are
+        recorded in the table instead of being printed.
+
+        Arguments
+        ---------
+        eunit: str, default None
+        Unit of energy of the table. Defaults to the eunit of this Materials instance, or meV.
+        '''
+        if eunit is None:
+            eunit = self.eunit if self.eunit is not None else 'meV'
+        if eunit not in self._alignments:
+            names = sorted(name for name, properties in iteritems(self.matDict)
+                           if properties.get('type') == 'semi')
+            cbm, vbm = np.full(len(names), np.nan), np.full(len(names), np.nan)
+            fallbacks = {}
+            for i, name in enumerate(names):
+                mat = self.find(name, eunit=eunit)
+                try:
+                    cbm[i], cbmMsg = self._conductionBandMinimum(mat)
+                    vbm[i], vbmMsg = self._valenceBandMaximum(mat)
+                except KeyError as err:
+                    cbm[i] = vbm[i] = np.nan
+                    fallbacks[name] = "Material '{}' misses {}.".format(name, err)
+                    continue
+                msgs = [msg for msg in (cbmMsg, vbmMsg) if msg is not None]
+                if msgs:
+                    fallbacks[name] = ' '.join(sorted(set(msgs)))
+            self._alignments[eunit] = BandAlignment(names, cbm, vbm, fallbacks, eunit)
+        return self._alignments[eunit]
+
+    def _conductionBandMinimum(self, mat):
+        '''Band edge of mat and the fallback message, or None if the band offsets were used.
+        '''
+        ref_name = 'InSb'
+        try:
+            cbo = mat['valenceBandOffset'] + mat['directBandGap']
+            ref = self.matDict[ref_name]
+            ref_level = self._referenceLevel(ref) * mat.energyUnit
+            return cbo + ref_level, None
+        except KeyError:
+            # fall back to Anderson's rule
+            if 'cbo' not in locals():
+                msg = "Material '{}' misses valenceBandOffset or directBandGap.".format(mat.name)
+            elif 'ref' not in locals():
+                msg = "Reference material '" + ref_name + "' missing from materials library."
+            else:
+                msg = "Reference material '" + ref_name + "' misses valenceBandOffset or " \
+                                                          "directBandGap or electronAffinity."
+            msg += " Falling back on Anderson's rule."
+            return -mat['electronAffinity'], msg
+
+    def _valenceBandMaximum(self, mat):
+        '''Band edge of mat and the fallback message, or None if the band offsets were used.
+        '''
         ref_name = 'InSb'
         try:
             vbo = mat['valenceBandOffset']
             ref = self.matDict[ref_name]
-            ref_level = -(ref['electronAffinity'] + ref['directBandGap'] + ref['valenceBandOffset'])
-            ref_level *= mat.energyUnit
-            return vbo + ref_level
+            ref_level = self._referenceLevel(ref) * mat.energyUnit
+            return vbo + ref_level, None
         except KeyError:
             # fall back to Anderson's rule
             if 'vbo' not in locals():
@@ -408,14 +768,91 @@ class Materials:
                 msg = "Reference material '" + ref_name + "' misses valenceBandOffset or " \
                                                           "directBandGap or electronAffinity."
             msg += " Falling back on Anderson's rule."
-            print(msg)
-            return -(mat['electronAffinity'] + mat['directBandGap'])
+            return -(mat['electronAffinity'] + mat['directBandGap']), msg
+
+
+class BandAlignment:
+    '''
+    Table of the absolute band edges of a set of materials, see Materials.bandAlignment.
+
+    The band edges are measured from the vacuum level as in Materials.conductionBandMinimum and
+    Materials.valenceBandMaximum. Offsets between two materials are differences of these levels.
+
+    Arguments
+    ---------
+    names: list of str
+    Names of the materials, in the order of the arrays.
+
+    conductionBandMinima, valenceBandMaxima: numpy.ndarray
+    Band edges of the materials, NaN where they could not be determined.
+
+    fallbacks: dict
+    Maps the names of materials whose band edges fell back on Anderson's rule, or could not be
+    determined at all, to an explanation.
+
+    eunit: str
+    Unit of energy of the band edges.
+    '''
+
+    def __init__(self, names, conductionBandMinima, valenceBandMaxima, fallbacks, eunit):
+        self.names = list(names)
+        self.conductionBandMinima = conductionBandMinima
+        self.valenceBandMaxima = valenceBandMaxima
+        self.fallbacks = fallbacks
+        self.eunit = eunit
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+
+    def index(self, name):
+        '''Position of the named material in the arrays of the table.
+        '''
+        try:
+            return self._index[name]
+        except KeyError:
+            raise KeyError("KeyError: no band alignment for material '{}', which is either "
+                           "missing from the database or not a semiconductor".format(name))
+
+    def conductionBandMinimum(self, name):
+        return self.conductionBandMinima[self.index(name)]
+
+    def valenceBandMaximum(self, name):
+        return self.valenceBandMaxima[self.index(name)]
+
+    def conductionBandOffsets(self):
+        '''Matrix of the conduction band offsets $E_{c,i} - E_{c,j}$ between materials i and j.
+        '''
+        return self.conductionBandMinima[:, np.newaxis] - self.conductionBandMinima[np.newaxis, :]
+
+    def valenceBandOffsets(self):
+        '''Matrix of the valence band offsets $E_{v,i} - E_{v,j}$ between materials i and j.
+        '''
+        return self.valenceBandMaxima[:, np.newaxis] - self.valenceBandMaxima[np.newaxis, :]
+
+
+def _copyDB(db):
+    '''Copy a parsed materials database down to the property dicts.
+    '''
+    copy = {}
+    for name, entry in iteritems(db):
+        if isinstance(entry, dict):
+            entry = dict((key, dict(val) if isinstance(val, dict) else val)
+                         for key, val in iteritems(entry))
+        copy[name] = entry
+    return copy
+
+
+def _printFallback(msg):
+    if msg not in _printedFallbacks:
+        _printedFallbacks.add(msg)
+        print(msg)
 
 
 def conduction_band_offset(mat, ref_mat):
     '''
     Calculate the conduction band offset $E_c - E_{c,ref}$ between two semiconductor materials.
 
+    A fallback on Anderson's rule is reported once per material, not on every call. For the offsets
+    between many materials of a database, see Materials.bandAlignment.
+
     Arguments
     ---------
     mat: Material
@@ -437,7 +874,7 @@ def conduction_band_offset(mat, ref_mat):
             msg = "Reference material '" + ref_mat.name + \
                   "' misses valenceBandOffset or directBandGap."
         msg += " Falling back on Anderson's rule."
-        print(msg)
+        _printFallback(msg)
         chi = mat['electronAffinity']
         return ref_mat['electronAffinity'] - chi
 
@@ -446,6 +883,8 @@ def valence_band_offset(mat, ref_mat):
     '''
     Calculate the valence band offset $E_v - E_{v,ref}$ between two semiconductor materials.
 
+    A fallback on Anderson's rule is reported once per material, see conduction_band_offset.
+
     Arguments
     ---------
     mat: Material
@@ -466,7 +905,7 @@ def valence_band_offset(mat, ref_mat):
         else:
             msg = "Reference material '" + ref_mat.name + "' misses valenceBandOffset."
         msg += " Falling back on Anderson's rule."
-        print(msg)
+        _printFallback(msg)
         e_ion = mat['electronAffinity'] + mat['directBandGap']
         e_ref = ref_mat['electronAffinity'] + ref_mat['directBandGap']
         return e_ref - e_ion
@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file is a numeric counterpart of the units and constants in physics_constants: every
+# entry is an SI float factor with a dimension, so that hot loops can convert quantities without
+# creating sympy expressions (and without importing sympy at all).
+#
+
+from __future__ import absolute_import, division, print_function
+import math
+from six import string_types
+
+__all__ = ['dimensionNames', 'siFactor', 'conversionFactor', 'convert']
+
+# Order of the exponents in the dimension tuples:
+dimensionNames = ('m', 'kg', 's', 'A', 'K')
+
+_eV = 1.602176634e-19  # in J, exact in the SI
+
+_energy = (2, 1, -2, 0, 0)
+
+# name -> (SI factor, dimension) for every entry of physics_constants.units:
+_units = {
+    'nm': (1e-9, (1, 0, 0, 0, 0)),
+    'um': (1e-6, (1, 0, 0, 0, 0)),
+    'angstrom': (1e-10, (1, 0, 0, 0, 0)),
+    'erg': (1e-7, _energy),
+    'kg': (1., (0, 1, 0, 0, 0)),
+    'g': (1e-3, (0, 1, 0, 0, 0)),
+    'eV': (_eV, _energy),
+    'meV': (_eV / 1e3, _energy),
+    'microeV': (_eV / 1e6, _energy),
+    'coulomb': (1., (0, 0, 1, 1, 0)),
+    'tesla': (1., (0, 1, -2, -1, 0)),
+    'm': (1., (1, 0, 0, 0, 0)),
+    's': (1., (0, 0, 1, 0, 0)),
+    'farad': (1., (-2, -1, 4, 2, 0)),
+    'cm': (1e-2, (1, 0, 0, 0, 0)),
+    'volt': (1., (2, 1, -3, -1, 0)),
+    'V': (1., (2, 1, -3, -1, 0)),
+    'K': (1., (0, 0, 0, 0, 1)),
+    'mK': (1e-3, (0, 0, 0, 0, 1)),
+}
+
+# The same for physics_constants.constants, built on first use since scipy is slow to import:
+_constants = {}
+
+# Memo of conversionFactor, keyed by (fromUnit, toUnit):
+_conversions = {}
+
+
+def _constantTable():
+    if not _constants:
+        from scipy import constants as sc
+        physical = sc.physical_constants
+        _constants.update({
+            'hbar': (sc.hbar, (2, 1, -1, 0, 0)),
+            'k_B': (physical['Boltzmann constant in eV/K'][0] * _eV, (2, 1, -2, 0, -1)),
+            'm_e': (physical['electron mass'][0], (0, 1, 0, 0, 0)),
+            'q_e': (physical['elementary charge'][0], (0, 0, 1, 1, 0)),
+            'mu_b': (physical['Bohr magneton in eV/T'][0] * _eV, (2, 0, 0, 1, 0)),
+            'epsilon0': (sc.epsilon_0, (-3, -1, 4, 2, 0)),
+            'c': (physical['speed of light in vacuum'][0], (1, 0, -1, 0, 0)),
+            'pi': (math.pi, (0, 0, 0, 0, 0)),
+        })
+    return _constants
+
+
+def siFactor(name):
+    ''' SI factor and dimension of a unit or constant.
+
+        Parameters
+        ----------
+        name : str
+            Name of an entry of physics_constants.units or physics_constants.constants.
+
+        Returns
+        -------
+        factor : float
+            Value of the entry in SI base units.
+        dimension : tuple of int
+            Exponents of the SI base units, in the order of dimensionNames.
+    '''
+    if isinstance(name, string_types):
+        if name in _units:
+            return _units[name]
+        if name in _constantTable():
+            return _constants[name]
+    raise KeyError('unknown unit or constant: {}'.format(name))
+
+
+def conversionFactor(fromUnit, toUnit):
+    ''' Float factor converting values in fromUnit to values in toUnit, computed once per pair.
+
+        Raises a ValueError if the two units have different dimensions.
+    '''
+    key = (fromUnit, toUnit)
+    try:
+        return _conversions[key]
+    except KeyError:
+        pass
+    fromFactor, fromDimension = siFactor(fromUnit)
+    toFactor, toDimension = siFactor(toUnit)
+    if fromDimension != toDimension:
+        raise ValueError('cannot convert {} to {}: incompatible dimensions'.format(fromUnit, toUnit))
+    _conversions[key] = fromFactor / toFactor
+    return _conversions[key]
+
+
+def convert(value, fromUnit, toUnit):
+    ''' Convert a float or numpy array from fromUnit to toUnit.
+    '''
+    return value * conversionFactor(fromUnit, toUnit)
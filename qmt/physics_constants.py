@@ -2,11 +2,12 @@
 # Licensed under the MIT License.
 
 from __future__ import absolute_import, division, print_function
+import sys
+import numpy as np
 import sympy.physics.units as spu
-from scipy import constants as sc
-from sympy.physics.matrices import msigma
-from sympy.matrices import eye
-from sympy.physics.quantum import TensorProduct as kron
+from six import string_types
+from qmt.numericUnits import siFactor, conversionFactor, convert
+from qmt.lazyModule import installLazyModule
 
 try:
     from types import SimpleNamespace
@@ -51,27 +52,30 @@ units = SimpleNamespace(
 
 def parseUnit(s):
     """convert name of a unit into the corresponding sympy value"""
-    for u in dir(units):
-        if u[:2] == '__':
-            continue
-        if u == s:
-            return units.__dict__[u]
+    if isinstance(s, string_types) and s[:2] != '__':
+        try:
+            return vars(units)[s]
+        except KeyError:
+            pass
     # if s is a sympy object we assume it has already been parsed and pass it through
     if hasattr(s, 'subs'):
         return s
     raise RuntimeError('unknown unit: {}'.format(s))
 
 
-constants = SimpleNamespace(
-    hbar=spu.hbar,
-    k_B=sc.physical_constants['Boltzmann constant in eV/K'][0] * units.eV / units.K,
-    m_e=sc.physical_constants["electron mass"][0] * spu.kg,
-    q_e=sc.physical_constants["elementary charge"][0] * units.coulomb,
-    mu_b=sc.physical_constants["Bohr magneton in eV/T"][0] * units.eV / units.tesla,
-    epsilon0=sc.epsilon_0 * spu.farad / spu.m,
-    c=sc.physical_constants["speed of light in vacuum"][0] * spu.m / spu.s,
-    pi=sc.pi
-)
+def _makeConstants():
+    from scipy import constants as sc
+    return SimpleNamespace(
+        hbar=spu.hbar,
+        k_B=sc.physical_constants['Boltzmann constant in eV/K'][0] * units.eV / units.K,
+        m_e=sc.physical_constants["electron mass"][0] * spu.kg,
+        q_e=sc.physical_constants["elementary charge"][0] * units.coulomb,
+        mu_b=sc.physical_constants["Bohr magneton in eV/T"][0] * units.eV / units.tesla,
+        epsilon0=sc.epsilon_0 * spu.farad / spu.m,
+        c=sc.physical_constants["speed of light in vacuum"][0] * spu.m / spu.s,
+        pi=sc.pi
+    )
+
 
 # Unify unit conversion between old and new units module
 if "convert_to" in dir(spu):
@@ -90,22 +94,111 @@ def cancel(expr):
     return canonicalize(expr, 1)
 
 
-def toFloat(expr):
-    """Convert sympy expression involving units to a float. Fails if expr is not dimensionless."""
-    return float(cancel(expr))
+# Memo of toFloat, since the same unit ratios are converted again and again:
+_floats = {}
 
 
-matrices = SimpleNamespace(
-    s_0=eye(2),
-    s_x=msigma(1),
-    s_y=msigma(2),
-    s_z=msigma(3),
-)
-matrices.tau_z0 = kron(matrices.s_z, matrices.s_0)
-matrices.tau_00 = kron(matrices.s_0, matrices.s_0)
-matrices.tau_zx = kron(matrices.s_z, matrices.s_x)
-matrices.tau_zy = kron(matrices.s_z, matrices.s_y)
-matrices.tau_zz = kron(matrices.s_z, matrices.s_z)
-matrices.tau_yy = kron(matrices.s_y, matrices.s_y)
-
-__all__ = ["units", "constants", "matrices", "parseUnit", "toFloat"]
+def toFloat(expr):
+    """Convert sympy expression involving units to a float. Fails if expr is not dimensionless."""
+    try:
+        return _floats[expr]
+    except KeyError:
+        value = float(cancel(expr))
+        if len(_floats) < 4096:
+            _floats[expr] = value
+        return value
+    except TypeError:  # unhashable
+        return float(cancel(expr))
+
+
+def _makeMatrices():
+    from sympy.physics.matrices import msigma
+    from sympy.matrices import eye
+    from sympy.physics.quantum import TensorProduct as kron
+    matrices = SimpleNamespace(
+        s_0=eye(2),
+        s_x=msigma(1),
+        s_y=msigma(2),
+        s_z=msigma(3),
+    )
+    matrices.tau_z0 = kron(matrices.s_z, matrices.s_0)
+    matrices.tau_00 = kron(matrices.s_0, matrices.s_0)
+    matrices.tau_zx = kron(matrices.s_z, matrices.s_x)
+    matrices.tau_zy = kron(matrices.s_z, matrices.s_y)
+    matrices.tau_zz = kron(matrices.s_z, matrices.s_z)
+    matrices.tau_yy = kron(matrices.s_y, matrices.s_y)
+    return matrices
+
+
+# Names of the matrices in the matrices namespaces, with the factors of the tau matrices:
+_matrixNames = ['s_0', 's_x', 's_y', 's_z']
+_tauFactors = {'tau_z0': ('s_z', 's_0'), 'tau_00': ('s_0', 's_0'), 'tau_zx': ('s_z', 's_x'),
+               'tau_zy': ('s_z', 's_y'), 'tau_zz': ('s_z', 's_z'), 'tau_yy': ('s_y', 's_y')}
+
+
+def _makeNumericMatrices():
+    numeric = SimpleNamespace(
+        s_0=np.eye(2, dtype=complex),
+        s_x=np.array([[0, 1], [1, 0]], dtype=complex),
+        s_y=np.array([[0, -1j], [1j, 0]], dtype=complex),
+        s_z=np.array([[1, 0], [0, -1]], dtype=complex),
+    )
+    for name, (a, b) in _tauFactors.items():
+        setattr(numeric, name, np.kron(getattr(numeric, a), getattr(numeric, b)))
+    for name in _matrixNames + list(_tauFactors):
+        getattr(numeric, name).setflags(write=False)  # shared by all users
+    return numeric
+
+
+def _makeSparseMatrices():
+    import scipy.sparse as sp
+    numeric = _getLazy('numericMatrices')
+    return SimpleNamespace(**dict((name, sp.csr_matrix(getattr(numeric, name)))
+                                  for name in _matrixNames + list(_tauFactors)))
+
+
+def sparseKron(*operators, **kwargs):
+    """Kronecker product of matrices as a scipy.sparse matrix, without densifying any factor.
+
+    Factors may be numpy arrays, scipy.sparse matrices or names of the numeric matrices, e.g.
+    sparseKron('tau_zx', hopping) for a BdG Hamiltonian. The keyword argument format (default
+    'csr') selects the sparse format of the result."""
+    import scipy.sparse as sp
+    format = kwargs.pop('format', 'csr')
+    if kwargs:
+        raise TypeError('unexpected keyword arguments: ' + str(list(kwargs)))
+    if not operators:
+        raise ValueError('sparseKron needs at least one operator')
+    factors = [getattr(_getLazy('sparseMatrices'), op) if isinstance(op, string_types) else op
+               for op in operators]
+    result = sp.csr_matrix(factors[0])
+    for factor in factors[1:]:
+        result = sp.kron(result, factor, format='csr')
+    return result.asformat(format)
+
+
+# scipy.constants, scipy.sparse and the sympy matrices are slow to import, so constants and
+# matrices are only built when first accessed. Where modules lack __getattr__ (python < 3.7), the
+# module is replaced by a stand-in that does the same, see installLazyModule:
+_lazy = {'constants': _makeConstants, 'matrices': _makeMatrices,
+         'numericMatrices': _makeNumericMatrices, 'sparseMatrices': _makeSparseMatrices}
+
+
+def _getLazy(name):
+    if name not in globals():
+        globals()[name] = _lazy[name]()
+    return globals()[name]
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _lazy:
+            return _getLazy(name)
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+
+__all__ = ["units", "constants", "matrices", "numericMatrices", "sparseMatrices", "sparseKron",
+           "parseUnit", "toFloat", "siFactor", "conversionFactor", "convert"]
+
+if sys.version_info < (3, 7):
+    installLazyModule(__name__, _lazy, _getLazy)
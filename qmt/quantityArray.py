@@ -0,0 +1,171 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file defines a light-weight numpy array with a physical unit, built on the numeric unit
+# table of numericUnits, for potential, density and band edge fields.
+#
+
+from __future__ import absolute_import, division, print_function
+import numbers
+import numpy as np
+from qmt.numericUnits import dimensionNames, siFactor
+
+__all__ = ['QuantityArray']
+
+_dimensionless = (0,) * len(dimensionNames)
+
+
+class QuantityArray(object):
+    # Make numpy defer to the reflected operators below instead of broadcasting over us:
+    __array_ufunc__ = None
+
+    def __init__(self, value, unit=None, scale=None, dimension=None):
+        ''' A numpy array with a physical unit.
+
+            The array is stored as a buffer together with the SI value of one unit of the buffer
+            (scale) and the dimension. Converting to another unit only changes the unit the
+            quantity is displayed in and never copies the buffer; magnitude applies the scale.
+
+            Parameters
+            ----------
+            value : array_like
+                The buffer. numpy arrays (including memmaps) are used without copying.
+
+            Keyword arguments
+            ----------
+            unit : str, default None
+                Name of a unit or constant in physics_constants (see numericUnits.siFactor)
+                the buffer is measured in. If None, scale and dimension are used instead.
+            scale : float, default None
+                SI value of one unit of the buffer, if unit is None. Defaults to 1.
+            dimension : tuple of int, default None
+                Exponents of the SI base units, in the order of numericUnits.dimensionNames, if
+                unit is None. Defaults to dimensionless.
+        '''
+        self.value = np.asarray(value)
+        if unit is not None:
+            if scale is not None or dimension is not None:
+                raise TypeError('pass either a unit or a scale and dimension')
+            scale, dimension = siFactor(unit)
+        self.scale = 1. if scale is None else float(scale)
+        self.dimension = _dimensionless if dimension is None else tuple(dimension)
+        self.unit = unit  # unit the buffer is displayed in, None for SI base units
+
+    def __repr__(self):
+        if self.unit is not None:
+            unit = self.unit
+        else:
+            unit = '*'.join(['{}'.format(self.scale)] +
+                            ['{}**{}'.format(name, exponent) for name, exponent
+                             in zip(dimensionNames, self.dimension) if exponent])
+        return 'QuantityArray({!r}, {})'.format(self.value, unit)
+
+    @property
+    def shape(self):
+        return self.value.shape
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, index):
+        return self._like(self.value[index])
+
+    def _like(self, value):
+        quantity = QuantityArray(value, scale=self.scale, dimension=self.dimension)
+        quantity.unit = self.unit
+        return quantity
+
+    def to(self, unit):
+        ''' The same quantity displayed in another unit. The buffer is shared, not copied.
+        '''
+        factor, dimension = siFactor(unit)
+        if dimension != self.dimension:
+            raise ValueError('cannot convert {!r} to {}: incompatible dimensions'.format(self, unit))
+        quantity = QuantityArray(self.value, scale=self.scale, dimension=self.dimension)
+        quantity.unit = unit
+        return quantity
+
+    @property
+    def magnitude(self):
+        ''' The values in the display unit (SI base units if the unit is None). This is the
+        buffer itself if it is already measured in that unit.
+        '''
+        factor = 1. if self.unit is None else siFactor(self.unit)[0]
+        if self.scale == factor:
+            return self.value
+        return self.value * (self.scale / factor)
+
+    @property
+    def si(self):
+        ''' The values in SI base units.
+        '''
+        return self.value if self.scale == 1. else self.value * self.scale
+
+    def _coerce(self, other):
+        if isinstance(other, QuantityArray):
+            return other
+        if isinstance(other, (numbers.Number, np.ndarray, list, tuple)):
+            return QuantityArray(other)
+        return None
+
+    def _sum(self, other, sign):
+        other = self._coerce(other)
+        if other is None:
+            return NotImplemented
+        if other.dimension != self.dimension:
+            raise ValueError('cannot add quantities of different dimensions')
+        return self._like(self.value + sign * other.value * (other.scale / self.scale))
+
+    def __add__(self, other):
+        return self._sum(other, 1)
+
+    def __radd__(self, other):
+        return self._sum(other, 1)
+
+    def __sub__(self, other):
+        return self._sum(other, -1)
+
+    def __rsub__(self, other):
+        return -self._sum(other, -1)
+
+    def __neg__(self):
+        return self._like(-self.value)
+
+    def _product(self, other, exponent):
+        other = self._coerce(other)
+        if other is None:
+            return NotImplemented
+        if other.dimension == _dimensionless and other.scale == 1.:
+            # plain numbers keep the unit
+            value = self.value * other.value if exponent == 1 else self.value / other.value
+            return self._like(value)
+        return QuantityArray(self.value * other.value if exponent == 1 else self.value / other.value,
+                             scale=self.scale * other.scale ** exponent,
+                             dimension=[a + exponent * b for a, b in
+                                        zip(self.dimension, other.dimension)])
+
+    def __mul__(self, other):
+        return self._product(other, 1)
+
+    def __rmul__(self, other):
+        return self._product(other, 1)
+
+    def __truediv__(self, other):
+        return self._product(other, -1)
+
+    def __rtruediv__(self, other):
+        other = self._coerce(other)
+        if other is None:
+            return NotImplemented
+        return other._product(self, -1)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, exponent):
+        dimension = [a * exponent for a in self.dimension]
+        if any(d != int(d) for d in dimension):
+            raise ValueError('fractional power of a quantity with dimension')
+        return QuantityArray(self.value ** exponent, scale=self.scale ** exponent,
+                             dimension=[int(d) for d in dimension])
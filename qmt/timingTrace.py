@@ -0,0 +1,113 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+#
+# This file records hierarchical timing spans of a batch run and writes them in
+# the Chrome trace-event format, which can be opened in chrome://tracing or
+# Perfetto, or loaded with json for analysis across a sweep.
+#
+
+from __future__ import absolute_import, division, print_function
+import os
+import time
+import threading
+from contextlib import contextmanager
+from qmt.jsonIO import loadJSON, saveJSON
+
+__all__ = ['Tracer', 'traceSpan']
+
+
+class Tracer:
+    def __init__(self):
+        ''' Collects timing spans as Chrome trace events.
+
+            Spans are 'complete' events (phase 'X') with microsecond timestamps.
+            Spans that are opened inside other spans of the same thread nest
+            in the trace viewers.
+        '''
+        self.events = []
+
+    @contextmanager
+    def span(self, name, cat='qmt', **args):
+        ''' Context manager timing the enclosed block as a span.
+
+            Parameters
+            ----------
+            name : str
+                Name of the span.
+
+            Keyword arguments
+            ----------
+            cat : str, default 'qmt'
+                Category of the span, e.g. the job step or the part directive.
+            args : dict
+                Further json-serializable information stored with the span.
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addSpan(name, start, time.time(), cat=cat, **args)
+
+    @contextmanager
+    def step(self, jobStep, **args):
+        ''' Context manager timing a job step as a span of category 'jobStep'.
+
+            All events recorded inside it, including the ones added with
+            extend, get the name of the step as args['jobStep']. When a trace
+            file is written, these events replace the events of an earlier run
+            of the same step.
+        '''
+        first = len(self.events)
+        try:
+            with self.span(jobStep, cat='jobStep', **args):
+                yield
+        finally:
+            for event in self.events[first:]:
+                event['args'] = dict(event.get('args', {}), jobStep=jobStep)
+
+    def addSpan(self, name, start, end, cat='qmt', **args):
+        ''' Add a span with known start and end times, in seconds since the
+        epoch.
+        '''
+        self.events += [{'name': name, 'cat': cat, 'ph': 'X',
+                         'ts': int(start * 1e6), 'dur': int((end - start) * 1e6),
+                         'pid': os.getpid(), 'tid': threading.current_thread().ident,
+                         'args': args}]
+
+    def extend(self, events):
+        ''' Add events recorded by another tracer, e.g. in a worker process.
+        '''
+        self.events += list(events)
+
+    def write(self, filePath, merge=True):
+        ''' Write the events to a trace file, atomically.
+
+            If merge is True, the events already in the file are kept, so the
+            steps of an instance can be traced by separate runs, except for the
+            events of the job steps that this tracer recorded again (see step).
+            If merge is False, the file is overwritten.
+        '''
+        events = []
+        if merge and os.path.isfile(filePath):
+            try:
+                events = loadJSON(filePath)['traceEvents']
+            except (ValueError, KeyError):
+                events = []
+            rerun = set(event.get('args', {}).get('jobStep') for event in self.events) - set([None])
+            events = [event for event in events
+                      if event.get('args', {}).get('jobStep') not in rerun]
+        saveJSON({'traceEvents': events + self.events, 'displayTimeUnit': 'ms'}, filePath)
+
+
+@contextmanager
+def _nullSpan():
+    yield
+
+
+def traceSpan(tracer, name, cat='qmt', **args):
+    ''' Time a block with tracer.span, or do nothing if tracer is None.
+    '''
+    if tracer is None:
+        return _nullSpan()
+    return tracer.span(name, cat=cat, **args)
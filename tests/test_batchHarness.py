@@ -0,0 +1,253 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import json
+import itertools
+import pytest
+import numpy as np
+import qmt
+from qmt.exportWatcher import ExportWatcher
+from qmt.batchHarness import _expectedExports
+
+
+def aux_sweep_model(rootPath, jobSequence, numParallelJobs=2):
+    '''Helper function to write a root model with a three-point geometry sweep.
+    '''
+    myModel = qmt.Model(modelPath=os.path.join(rootPath, 'root.json'))
+    myModel.addJob(os.path.join(rootPath, 'run'), jobSequence=jobSequence,
+                   numParallelJobs=numParallelJobs)
+    myModel.genGeomSweep('width', [10., 20., 30.], type='python')
+    myModel.saveModel()
+    return myModel.modelPath
+
+
+def test_runJob_parallel(tmpdir):
+    '''Test that the parallel mode runs every instance through the pool.'''
+    harness = qmt.Harness(aux_sweep_model(str(tmpdir), []))
+    harness.setupRun()
+    assert len(harness.modelFilePaths) == 3
+    assert harness.runJob(parallel=True) == {}
+
+
+def test_runJob_parallel_failures(tmpdir):
+    '''Test that failing instances are collected instead of stopping the pool.'''
+    harness = qmt.Harness(aux_sweep_model(str(tmpdir), ['unknownStep']))
+    harness.setupRun()
+    failures = harness.runJob(parallel=True)
+    assert sorted(failures.keys()) == sorted(harness.modelFilePaths)
+    for error in failures.values():
+        assert 'Job step is not defined' in error
+
+
+def test_resume(tmpdir):
+    '''Test that resumed runs keep unchanged instances and record step states.'''
+    harness = qmt.Harness(aux_sweep_model(str(tmpdir), ['unknownStep']))
+    harness.setupRun()
+    modelFilePath = harness.modelFilePaths[0]
+    failures = harness.runJob(parallel=True)
+    assert len(failures) == 3
+    record = harness.manifest.stepRecord('geo_0', 'unknownStep')
+    assert record['status'] == 'failed'
+    # mark the model file, which a resumed setup must not overwrite
+    with open(modelFilePath, 'a') as myFile:
+        myFile.write(' ')
+    harness = qmt.Harness(harness.jsonPath)
+    harness.setupRun(resume=True)
+    assert open(modelFilePath).read().endswith(' ')
+    assert harness.manifest.stepRecord('geo_0', 'unknownStep')['status'] == 'failed'
+    harness.setupRun()
+    assert not open(modelFilePath).read().endswith(' ')
+    assert harness.manifest.stepRecord('geo_0', 'unknownStep') is None
+
+
+class CountingHarness(qmt.Harness):
+    '''Harness whose job steps only count how often they are run.'''
+    def _runStep(self, jobStep, modelFilePath):
+        self.stepCalls = getattr(self, 'stepCalls', 0) + 1
+
+
+class MarkingHarness(qmt.Harness):
+    '''Harness whose job steps and close leave marker files next to the root model.'''
+    def _runStep(self, jobStep, modelFilePath):
+        open(os.path.join(os.path.dirname(modelFilePath), jobStep + '.done'), 'w').close()
+
+    def close(self):
+        qmt.Harness.close(self)
+        markerDir = os.path.dirname(self.jsonPath)
+        open(os.path.join(markerDir, 'closed.{}'.format(os.getpid())), 'w').close()
+
+
+class RecordingHarness(MarkingHarness):
+    '''Marking harness that also records the job steps it runs.'''
+    def _runStep(self, jobStep, modelFilePath):
+        self.calls = getattr(self, 'calls', []) + [jobStep]
+        MarkingHarness._runStep(self, jobStep, modelFilePath)
+
+
+def test_runJob_parallel_subclass(tmpdir):
+    '''Test that pool workers use the harness subclass and are closed on exit.'''
+    harness = MarkingHarness(aux_sweep_model(str(tmpdir), ['geoGen']))
+    harness.setupRun()
+    assert harness.runJob(parallel=True) == {}
+    for modelFilePath in harness.modelFilePaths:
+        assert os.path.isfile(os.path.join(os.path.dirname(modelFilePath), 'geoGen.done'))
+    closed = [name for name in os.listdir(str(tmpdir)) if name.startswith('closed.')]
+    assert 1 <= len(closed) <= 2
+    assert str(os.getpid()) not in [name.split('.')[1] for name in closed]
+
+
+def test_resume_skips_completed_steps(tmpdir):
+    '''Test that completed steps are skipped only while their inputs are unchanged.'''
+    jsonPath = aux_sweep_model(str(tmpdir), ['geoGen', 'postProc'])
+    harness = CountingHarness(jsonPath)
+    harness.setupRun()
+    harness.runJob()
+    assert harness.stepCalls == 6
+    harness = CountingHarness(jsonPath)
+    harness.setupRun(resume=True)
+    harness.runJob(resume=True)
+    assert getattr(harness, 'stepCalls', 0) == 0
+    # changing the output of geoGen in one instance reruns its postProc
+    with open(os.path.join(os.path.dirname(harness.modelFilePaths[0]), 'extra.txt'), 'w') as f:
+        f.write('data')
+    geoGenRecord = harness.manifest.stepRecord('geo_0', 'geoGen')
+    harness.manifest.startStep('geo_0', 'geoGen', geoGenRecord['inputHash'])
+    harness.runJob(resume=True)
+    assert harness.stepCalls == 2
+
+
+def test_resume_checks_outputs(tmpdir):
+    '''Test that resumed runs rerun completed steps whose outputs were removed.'''
+    jsonPath = aux_sweep_model(str(tmpdir), ['geoGen', 'postProc'])
+    harness = MarkingHarness(jsonPath)
+    harness.setupRun()
+    harness.runJob()
+    dirPath = os.path.dirname(harness.modelFilePaths[0])
+    harness = RecordingHarness(jsonPath)
+    harness.setupRun(resume=True)
+    harness.runJob(resume=True)
+    assert getattr(harness, 'calls', []) == []
+    # geoGen is intact while postProc ran on its outputs, but postProc is not
+    os.remove(os.path.join(dirPath, 'postProc.done'))
+    harness.runJob(resume=True)
+    assert harness.calls == ['postProc']
+    # a removed geoGen output reruns both steps
+    os.remove(os.path.join(dirPath, 'geoGen.done'))
+    harness.runJob(resume=True)
+    assert harness.calls == ['postProc', 'geoGen', 'postProc']
+
+
+def test_lazy_setup(tmpdir):
+    '''Test that lazy runs materialize the same instances as eager ones.'''
+    myModel = qmt.Model(modelPath=aux_sweep_model(str(tmpdir), ['geoGen']))
+    myModel.genGeomSweep('height', [1., 2.])
+    myModel.saveModel()
+    harness = CountingHarness(myModel.modelPath)
+    instances = harness.iterInstances()
+    assert not isinstance(instances, list)
+    # one index per geomSweep axis, in the key order of the loaded geomSweep:
+    axisLengths = {'width': 3, 'height': 2}
+    shape = [axisLengths[name] for name in harness.model.modelDict['geomSweep']]
+    assert list(instances) == list(itertools.product(*[range(n) for n in shape]))
+    harness.setupRun(lazy=True)
+    assert harness.modelFilePaths == []
+    assert not any(name.startswith('geo_') for name in os.listdir(harness.rootPath))
+    harness.runJob()
+    assert harness.stepCalls == 6
+    lazyModel = qmt.Model(modelPath=harness.instanceModelPath((1, 1)))
+    eager = qmt.Harness(myModel.modelPath)
+    eager.setupRun()
+    assert len(eager.modelFilePaths) == 6
+    eagerModel = qmt.Model(modelPath=eager.instanceModelPath((1, 1)))
+    assert lazyModel.modelDict == eagerModel.modelDict
+    assert eagerModel.modelDict['geometricParams'] != myModel.modelDict['geometricParams']
+    assert myModel.modelDict == qmt.Model(modelPath=myModel.modelPath).modelDict
+
+
+def test_delta_setup(tmpdir):
+    '''Test that delta-encoded instance model files load like full copies.'''
+    myModel = qmt.Model(modelPath=aux_sweep_model(str(tmpdir.mkdir('full')), []))
+    fullHarness = qmt.Harness(myModel.modelPath)
+    fullHarness.setupRun()
+    myModel.modelPath = str(tmpdir.join('delta.json'))
+    myModel.addJob(str(tmpdir.join('deltaRun')), jobSequence=[], deltaModelFiles=True)
+    myModel.saveModel()
+    deltaHarness = qmt.Harness(myModel.modelPath)
+    deltaHarness.setupRun()
+    for fullPath, deltaPath in zip(fullHarness.modelFilePaths, deltaHarness.modelFilePaths):
+        assert os.path.getsize(deltaPath) < os.path.getsize(fullPath)
+        fullDict = qmt.Model(modelPath=fullPath).modelDict
+        deltaDict = qmt.Model(modelPath=deltaPath).modelDict
+        for key in ['pathSettings', 'jobSettings']:
+            del fullDict[key]
+            del deltaDict[key]
+        assert fullDict == deltaDict
+
+
+def test_instance_files_without_sidecars(tmpdir):
+    '''Test that instance model files hold their arrays inline, even if the root model does not.'''
+    myModel = qmt.Model(modelPath=aux_sweep_model(str(tmpdir), []))
+    myModel.genPhysicsSweep('gate', 'V', list(np.linspace(-1., 1., 200)))
+    myModel.saveModel(arrayThreshold=100)
+    assert os.path.isdir(str(tmpdir.join('root_arrays')))
+    harness = qmt.Harness(myModel.modelPath)
+    harness.setupRun()
+    for modelFilePath in harness.modelFilePaths:
+        assert os.listdir(os.path.dirname(modelFilePath)) == ['model.json']
+        values = json.load(open(modelFilePath))['physicsSweep']['sweepParts']['V_gate']['values']
+        assert np.allclose(values, np.linspace(-1., 1., 200))
+
+
+class PackedHarness(CountingHarness):
+    '''Harness whose COMSOL runs are replaced by a local stand-in executable.'''
+    def _prepareCOMSOLRun(self, modelFilePath):
+        dirPath = os.path.dirname(modelFilePath)
+        exportPath = os.path.join(dirPath, 'exports')
+        os.mkdir(exportPath)
+        standIn = 'import sys, time; print(sys.argv[1]); time.sleep(0.2); ' \
+                  'open(sys.argv[2], "w").close()'
+        return {'command': [sys.executable, '-c', standIn, dirPath,
+                            os.path.join(exportPath, 'out_export0.txt')],
+                'cores': 2,
+                'logPath': os.path.join(dirPath, 'comsolLog.txt'),
+                'errPath': os.path.join(dirPath, 'comsolErr.txt'),
+                'watcher': ExportWatcher(exportPath, {'out_export*.txt': 1})}
+
+
+def test_packed_comsol_runs(tmpdir):
+    '''Test that COMSOL runs are packed into the core budget step-major.'''
+    myModel = qmt.Model(modelPath=aux_sweep_model(str(tmpdir), ['geoGen', 'comsolRun', 'postProc']))
+    myModel.modelDict['jobSettings']['coreBudget'] = 4
+    myModel.saveModel()
+    harness = PackedHarness(myModel.modelPath)
+    harness.setupRun()
+    harness.runJob()
+    assert harness.stepCalls == 6
+    for modelFilePath in harness.modelFilePaths:
+        dirPath = os.path.dirname(modelFilePath)
+        assert open(os.path.join(dirPath, 'comsolLog.txt')).read().strip() == dirPath
+        instance = os.path.basename(dirPath)
+        for jobStep in ['geoGen', 'comsolRun', 'postProc']:
+            assert harness.manifest.stepRecord(instance, jobStep)['status'] == 'done'
+        events = json.load(open(os.path.join(dirPath, 'trace.json')))['traceEvents']
+        assert [event['name'] for event in events] == ['geoGen', 'comsolRun', 'postProc']
+    harness = PackedHarness(myModel.modelPath)
+    harness.setupRun(resume=True)
+    harness.runJob(resume=True)
+    assert getattr(harness, 'stepCalls', 0) == 0
+
+
+def test_expected_exports():
+    '''Test that integrals cannot be requested without their output files.'''
+    myModel = qmt.Model()
+    myModel.genPhysicsSweep('wire', 'V', [0., 1.])
+    myModel.genComsolInfo(fileName='out')
+    assert _expectedExports(myModel.modelDict) == {'out_export*.txt': 2}
+    myModel.genSurfaceIntegral('wire')
+    with pytest.raises(ValueError):
+        _expectedExports(myModel.modelDict)
+    myModel.genComsolInfo(fileName='out', integralExports={'out_surfInt*.txt': 1})
+    assert _expectedExports(myModel.modelDict) == {'out_export*.txt': 2, 'out_surfInt*.txt': 1}
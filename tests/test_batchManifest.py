@@ -0,0 +1,55 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+from qmt.batchManifest import Manifest, fingerprintDict, fingerprintFile, fingerprintDir
+
+
+def test_fingerprints(tmpdir):
+    '''Test that fingerprints are canonical and track content changes.'''
+    assert fingerprintDict({'a': 1, 'b': [1, 2]}) == fingerprintDict({'b': [1, 2], 'a': 1})
+    assert fingerprintDict({'a': 1}) != fingerprintDict({'a': 2})
+    filePath = str(tmpdir.join('data.txt'))
+    assert fingerprintFile(filePath) is None
+    tmpdir.join('data.txt').write('abc')
+    hash0 = fingerprintFile(filePath)
+    dirHash0 = fingerprintDir(str(tmpdir))
+    tmpdir.join('data.txt').write('abcd')
+    assert fingerprintFile(filePath) != hash0
+    assert fingerprintDir(str(tmpdir)) != dirHash0
+    assert fingerprintDir(str(tmpdir), exclude=('data.txt',)) == fingerprintDir(str(tmpdir.mkdir('empty')))
+    # same-size rewrites with different contents change the fingerprint
+    dirHash1 = fingerprintDir(str(tmpdir))
+    tmpdir.join('data.txt').write('abce')
+    assert fingerprintDir(str(tmpdir)) != dirHash1
+    # large files are tracked by their modification time
+    dirHash2 = fingerprintDir(str(tmpdir), contentLimit=1)
+    stat = os.stat(filePath)
+    tmpdir.join('data.txt').write('abcf')
+    os.utime(filePath, (stat.st_atime, stat.st_mtime + 10))
+    assert fingerprintDir(str(tmpdir), contentLimit=1) != dirHash2
+
+
+def test_manifest(tmpdir):
+    '''Test recording of instance setups and step states.'''
+    manifest = Manifest(str(tmpdir))
+    assert os.path.isfile(manifest.path)
+    assert manifest.setupHash('geo_0') is None
+    manifest.recordSetup('geo_0', 'setup0')
+    assert manifest.setupHash('geo_0') == 'setup0'
+    assert manifest.stepRecord('geo_0', 'geoGen') is None
+    manifest.startStep('geo_0', 'geoGen', 'in0')
+    assert manifest.stepRecord('geo_0', 'geoGen')['status'] == 'running'
+    manifest.finishStep('geo_0', 'geoGen', 'out0')
+    # a second manifest object sees the same records
+    record = Manifest(str(tmpdir)).stepRecord('geo_0', 'geoGen')
+    assert record['status'] == 'done'
+    assert record['inputHash'] == 'in0' and record['outputHash'] == 'out0'
+    assert record['endTime'] >= record['startTime']
+    manifest.startStep('geo_0', 'comsolRun', 'in1')
+    manifest.failStep('geo_0', 'comsolRun', 'Traceback')
+    assert manifest.stepRecord('geo_0', 'comsolRun')['error'] == 'Traceback'
+    # a new setup invalidates all step records
+    manifest.recordSetup('geo_0', 'setup1')
+    assert manifest.stepRecord('geo_0', 'geoGen') is None
@@ -0,0 +1,184 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import json
+import numpy as np
+import pytest
+import qmt
+
+
+def test_delta_model_files(tmpdir):
+    '''Test that models saved as overrides to a base model load like full copies.'''
+    base = qmt.Model(modelPath=str(tmpdir.join('base.json')))
+    base.addPart('wire', 'Sketch', 'wire', 'semiconductor', z0=0., thickness='width')
+    base.addPart('gate', 'Sketch001', 'extrude', 'metalGate', z0=0., thickness=1.)
+    base.modelDict['geometricParams']['width'] = ('10', 'python')
+    base.saveModel()
+    tmpdir.mkdir('geo_0')
+    instance = qmt.Model(modelPath=str(tmpdir.join('geo_0', 'model.json')), load=False)
+    instance.modelDict = json.loads(json.dumps(base.modelDict))
+    instance.modelDict['geometricParams']['width'] = ('20', 'python')
+    instance.registerCadPart('wire', 'Wire001', 'wire.step')
+    del instance.modelDict['3DParts']['gate']
+    instance.modelDict['pathSettings']['dirPath'] = str(tmpdir.join('geo_0'))
+    instance.baseModelPath = base.modelPath
+    instance.saveModel()
+    with open(instance.modelPath) as myFile:
+        saved = json.load(myFile)
+    assert saved['__baseModel'] == '../base.json'
+    assert 'gate' in saved['__overrides']['3DParts']['__deleted__']
+    assert 'buildOrder' not in saved['__overrides']
+    loaded = qmt.Model(modelPath=instance.modelPath)
+    assert loaded.modelDict == json.loads(json.dumps(instance.modelDict))
+    assert loaded.baseModelPath == base.modelPath
+    # changes made after loading end up in the overrides on the next save
+    loaded.registerCadPart('wire', 'Wire002', 'wire2.step')
+    loaded.saveModel()
+    reloaded = qmt.Model(modelPath=instance.modelPath)
+    assert reloaded.modelDict['3DParts']['wire']['fileNames'] == \
+           {'Wire001': 'wire.step', 'Wire002': 'wire2.step'}
+    assert 'Wire002' not in qmt.Model(modelPath=base.modelPath).modelDict['3DParts']['wire'][
+        'fileNames']
+
+
+def test_delta_model_files_external_steps(tmpdir):
+    '''Test that delta model files are refused for steps that read plain model files.'''
+    myModel = qmt.Model()
+    myModel.addJob(str(tmpdir), jobSequence=['geoGen'], deltaModelFiles=True)
+    assert myModel.modelDict['jobSettings']['deltaModelFiles']
+    for jobSequence in [['geoGen', 'comsolRun'], ['postProc']]:
+        with pytest.raises(ValueError):
+            myModel.addJob(str(tmpdir), jobSequence=jobSequence, deltaModelFiles=True)
+    myModel.addJob(str(tmpdir), jobSequence=['geoGen', 'comsolRun', 'postProc'])
+    assert not myModel.modelDict['jobSettings']['deltaModelFiles']
+
+
+def test_part_graph():
+    '''Test the dependency graph, levels and independent groups of 3D parts.'''
+    myModel = qmt.Model()
+    myModel.addPart('substrate', 'Sketch', 'extrude', 'dielectric', z0=0., thickness=1.)
+    myModel.addPart('wire', 'Sketch001', 'wire', 'semiconductor', z0=1., thickness=0.1)
+    myModel.addPart('shell', 'Sketch001', 'wireShell', 'metalGate', thickness=0.01,
+                    targetWire='wire', shellVerts=[1, 2])
+    myModel.addPart('dielectric', 'Sketch002', 'lithography', 'dielectric', z0=1., thickness=0.1,
+                    layerNum=1, lithoBase=['substrate'])
+    myModel.addPart('gate', 'Sketch003', 'lithography', 'metalGate', z0=1.1, thickness=0.1,
+                    layerNum=2, lithoBase=['substrate'])
+    myModel.addPart('plunger', 'Sketch004', 'extrude', 'metalGate', z0=2., thickness=1.)
+    assert myModel.partDependencies() == {
+        'substrate': [], 'wire': [], 'shell': ['wire'], 'dielectric': ['substrate'],
+        'gate': ['dielectric', 'substrate'], 'plunger': []}
+    myModel.validatePartGraph()
+    assert myModel.partLevels() == [['substrate', 'wire', 'plunger'],
+                                    ['shell', 'dielectric'], ['gate']]
+    assert myModel.partComponents() == [['substrate', 'dielectric', 'gate'],
+                                        ['wire', 'shell'], ['plunger']]
+    myModel.modelDict['3DParts']['plunger']['subtractList'] = ['missing']
+    with pytest.raises(ValueError) as err:
+        myModel.validatePartGraph()
+    assert 'missing' in str(err.value)
+    myModel.modelDict['3DParts']['plunger']['subtractList'] = []
+    myModel.modelDict['3DParts']['wire']['subtractList'] = ['shell']
+    with pytest.raises(ValueError) as err:
+        myModel.validatePartGraph()
+    assert 'cyclic' in str(err.value)
+
+
+def test_model_reload(tmpdir):
+    '''Test that loaded models are isolated copies that track file changes.'''
+    myModel = qmt.Model(modelPath=str(tmpdir.join('model.json')))
+    myModel.genGeomSweep('width', [10., 20.])
+    myModel.saveModel()
+    first = qmt.Model(modelPath=myModel.modelPath)
+    first.modelDict['geomSweep']['width']['vals'] = 'corrupted'
+    second = qmt.Model(modelPath=myModel.modelPath)
+    assert second.modelDict['geomSweep']['width']['vals'] == '10.0, 20.0'
+    myModel.genGeomSweep('width', [30.])
+    myModel.saveModel()
+    assert qmt.Model(modelPath=myModel.modelPath).modelDict['geomSweep']['width']['vals'] == '30.0'
+    # files changed behind our back with the same size are picked up as well
+    with open(myModel.modelPath) as myFile:
+        text = myFile.read()
+    os.remove(myModel.modelPath)
+    with open(myModel.modelPath, 'w') as myFile:
+        myFile.write(text.replace('30.0', '40.0'))
+    assert qmt.Model(modelPath=myModel.modelPath).modelDict['geomSweep']['width']['vals'] == '40.0'
+
+
+def test_dense_physics_sweep(tmpdir):
+    '''Test that dense sweeps store one axis per part and index the full grid.'''
+    myModel = qmt.Model(modelPath=str(tmpdir.join('model.json')))
+    voltages = list(np.linspace(-1., 1., 50))
+    for gate in ['g1', 'g2', 'g3', 'g4', 'g5']:
+        myModel.genPhysicsSweep(gate, 'V', voltages, unit='V', dense=True)
+    myModel.saveModel()
+    physicsSweep = qmt.Model(modelPath=myModel.modelPath).modelDict['physicsSweep']
+    assert physicsSweep['length'] == 50 ** 5
+    assert physicsSweep['axisOrder'] == ['V_g1', 'V_g2', 'V_g3', 'V_g4', 'V_g5']
+    assert os.path.getsize(myModel.modelPath) < 10000
+    index = ((3 * 50 + 4) * 50 + 7) * 50 + 49
+    assert myModel.physicsSweepPoint(index) == {
+        'V_g1': voltages[0], 'V_g2': voltages[3], 'V_g3': voltages[4],
+        'V_g4': voltages[7], 'V_g5': voltages[49]}
+    with pytest.raises(IndexError):
+        myModel.physicsSweepPoint(50 ** 5)
+    small = qmt.Model()
+    small.genPhysicsSweep('g1', 'V', [0., 1.], dense=True)
+    small.genPhysicsSweep('g2', 'V', [2., 3., 4.], dense=True)
+    points = list(small.iterPhysicsSweep())
+    assert points == [small.physicsSweepPoint(i) for i in range(6)]
+    assert points[1] == {'V_g1': 0., 'V_g2': 3.}
+    with pytest.raises(ValueError):
+        small.genPhysicsSweep('g3', 'V', [0., 1.])
+
+
+def test_sparse_physics_sweep():
+    '''Test that sparse sweeps step through equal-length value lists together.'''
+    myModel = qmt.Model()
+    myModel.genPhysicsSweep('g1', 'V', [0., 1.])
+    myModel.genPhysicsSweep('g2', 'V', [2., 3.])
+    assert myModel.modelDict['physicsSweep']['length'] == 2
+    assert list(myModel.iterPhysicsSweep()) == [{'V_g1': 0., 'V_g2': 2.}, {'V_g1': 1., 'V_g2': 3.}]
+    with pytest.raises(AssertionError):
+        myModel.genPhysicsSweep('g3', 'V', [0., 1., 2.])
+
+
+def test_array_sidecars(tmpdir):
+    '''Test that large numeric lists and arrays are stored in memory-mapped sidecars.'''
+    myModel = qmt.Model(modelPath=str(tmpdir.join('model.json')))
+    voltages = list(np.linspace(-1., 1., 500))
+    myModel.genPhysicsSweep('gate', 'V', voltages)
+    polygon = [(float(np.cos(t)), float(np.sin(t))) for t in np.linspace(0., 6., 300)]
+    myModel.genPart2D('wire', {'wire_0': polygon, 'small': [(0., 0.), (1., 0.), (0., 1.)]})
+    myModel.modelDict['meshInfo']['grid'] = np.arange(12.).reshape(3, 4)
+    myModel.saveModel(arrayThreshold=100)
+    assert sorted(os.listdir(str(tmpdir))) == ['model.json', 'model_arrays']
+    assert len(os.listdir(str(tmpdir.join('model_arrays')))) == 3
+    loaded = qmt.Model(modelPath=myModel.modelPath)
+    values = loaded.modelDict['physicsSweep']['sweepParts']['V_gate']['values']
+    assert isinstance(values, np.memmap)
+    assert np.array_equal(values, voltages)
+    geometry = loaded.modelDict['slices']['0']['parts']['wire']['geometry']
+    assert np.array_equal(geometry['wire_0'], polygon)
+    assert geometry['small'] == [[0., 0.], [1., 0.], [0., 1.]]
+    assert np.array_equal(loaded.modelDict['meshInfo']['grid'], np.arange(12.).reshape(3, 4))
+    with pytest.raises(ValueError):
+        values[0] = 5.  # read-only, so the sidecar cannot be corrupted
+    # loaded arrays are written back to sidecars without a threshold
+    loaded.saveModel()
+    assert len(os.listdir(str(tmpdir.join('model_arrays')))) == 3
+    reloaded = qmt.Model(modelPath=myModel.modelPath)
+    assert isinstance(reloaded.modelDict['physicsSweep']['sweepParts']['V_gate']['values'],
+                      np.memmap)
+    # sidecars the model no longer references are removed on save
+    for i in range(5):
+        reloaded.modelDict['meshInfo']['grid'] = np.full((3, 4), float(i))
+        reloaded.saveModel()
+    assert len(os.listdir(str(tmpdir.join('model_arrays')))) == 3
+    del reloaded.modelDict['meshInfo']['grid']
+    reloaded.saveModel()
+    assert len(os.listdir(str(tmpdir.join('model_arrays')))) == 2
+    assert np.array_equal(qmt.Model(modelPath=myModel.modelPath).modelDict['physicsSweep']
+                          ['sweepParts']['V_gate']['values'], voltages)
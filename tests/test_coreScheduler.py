@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import sys
+import signal
+from qmt.coreScheduler import CoreScheduler
+
+# Stand-in for a solver run: logs its name, records how long it ran, and
+# optionally hangs after its work is done (ignoring terminate if hang is '2').
+standInSource = '''
+import sys, time, signal
+name, timesPath, hang = sys.argv[1], sys.argv[2], sys.argv[3] != '0'
+duration = float(sys.argv[4]) if len(sys.argv) > 4 else 0.3
+if sys.argv[3] == '2':
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+start = time.time()
+print('log of ' + name)
+sys.stderr.write('err of ' + name)
+time.sleep(duration)
+with open(timesPath, 'a') as myFile:
+    myFile.write('{} {} {}\\n'.format(name, start, time.time()))
+while hang:
+    time.sleep(1.)
+'''
+
+
+def aux_standIn(tmpdir):
+    '''Helper function to write the stand-in script.'''
+    scriptPath = tmpdir.join('standIn.py')
+    scriptPath.write(standInSource)
+    return str(scriptPath)
+
+
+def test_packing(tmpdir):
+    '''Test that jobs are packed into the core budget with isolated logs.'''
+    scriptPath = aux_standIn(tmpdir)
+    timesPath = str(tmpdir.join('times.txt'))
+    finished = []
+    scheduler = CoreScheduler(4, pollInterval=0.05)
+    for i, cores in enumerate([2, 2, 2, 3, 1]):
+        name = 'job{}'.format(i)
+        scheduler.submit(name, [sys.executable, scriptPath, name, timesPath, '0'], cores=cores,
+                         logPath=str(tmpdir.join(name + '.log')),
+                         errPath=str(tmpdir.join(name + '.err')),
+                         onFinish=lambda name, returnCode: finished.append(name))
+    returnCodes = scheduler.run()
+    assert returnCodes == dict(('job{}'.format(i), 0) for i in range(5))
+    assert sorted(finished) == sorted(returnCodes.keys())
+    for i in range(5):
+        name = 'job{}'.format(i)
+        assert tmpdir.join(name + '.log').read().strip() == 'log of ' + name
+        assert tmpdir.join(name + '.err').read().strip() == 'err of ' + name
+    cores = {'job0': 2, 'job1': 2, 'job2': 2, 'job3': 3, 'job4': 1}
+    spans = []
+    for line in open(timesPath):
+        name, start, end = line.split()
+        spans += [(float(start), float(end), cores[name])]
+    # cores in use whenever a job started:
+    inUse = [sum(c for s, e, c in spans if s <= start < e) for start, end, numCores in spans]
+    assert max(inUse) <= 4
+    assert max(inUse) > 2  # some jobs shared the node
+
+
+def test_terminate_when_done(tmpdir):
+    '''Test that a job that does not exit after finishing its work is terminated.'''
+    scriptPath = aux_standIn(tmpdir)
+    timesPath = tmpdir.join('times.txt')
+    scheduler = CoreScheduler(1, pollInterval=0.05, grace=0.2)
+    scheduler.submit('hang', [sys.executable, scriptPath, 'hang', str(timesPath), '1'],
+                     isDone=lambda: timesPath.check())
+    returnCodes = scheduler.run()
+    assert returnCodes['hang'] != 0
+
+
+def test_kill_when_terminate_ignored(tmpdir):
+    '''Test that a finished job that ignores terminate is killed.'''
+    scriptPath = aux_standIn(tmpdir)
+    timesPath = tmpdir.join('times.txt')
+    scheduler = CoreScheduler(1, pollInterval=0.05, grace=0.2)
+    scheduler.submit('hang', [sys.executable, scriptPath, 'hang', str(timesPath), '2'],
+                     isDone=lambda: timesPath.check())
+    returnCodes = scheduler.run()
+    assert returnCodes['hang'] == -signal.SIGKILL
+
+
+def test_no_starvation(tmpdir):
+    '''Test that a stream of small jobs cannot keep a large job waiting.'''
+    scriptPath = aux_standIn(tmpdir)
+    timesPath = str(tmpdir.join('times.txt'))
+    scheduler = CoreScheduler(4, pollInterval=0.05, maxSkips=1)
+    # Staggered small jobs keep at least two cores busy until all of them are done:
+    jobs = [('first', 2, 0.3), ('large', 4, 0.3)] + \
+           [('small{}'.format(i), 2, 0.6) for i in range(4)]
+    for name, cores, duration in jobs:
+        scheduler.submit(name, [sys.executable, scriptPath, name, timesPath, '0', str(duration)],
+                         cores=cores)
+    assert set(scheduler.run().values()) == set([0])
+    starts = dict((name, float(start)) for name, start, end in
+                  (line.split() for line in open(timesPath)))
+    # small0 was started ahead of the large job, after which its cores were reserved:
+    assert starts['small0'] < starts['large']
+    assert all(starts['large'] < starts['small{}'.format(i)] for i in range(1, 4))
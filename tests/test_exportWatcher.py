@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import threading
+import pytest
+from qmt.exportWatcher import ExportWatcher
+
+
+def aux_write(dirPath, fileName, delay=0.):
+    '''Helper function to write an output file, optionally from a background thread.'''
+    def write():
+        with open(os.path.join(dirPath, fileName), 'w') as myFile:
+            myFile.write('data')
+    if delay > 0.:
+        timer = threading.Timer(delay, write)
+        timer.start()
+        return timer
+    write()
+
+
+@pytest.mark.parametrize('usePolling', [True, None])
+def test_watcher(tmpdir, usePolling):
+    '''Test incremental tracking of solution and integral files.'''
+    dirPath = str(tmpdir)
+    aux_write(dirPath, 'model_export0.txt')
+    aux_write(dirPath, 'unrelated.log')
+    expected = {'model_export*.txt': 2, 'model_integrals*.txt': 1}
+    with ExportWatcher(dirPath, expected, pollInterval=0.05, usePolling=usePolling) as watcher:
+        watcher.wait(0.2)
+        assert watcher.count('model_export*.txt') == 1
+        assert watcher.fracComplete() == pytest.approx(1 / 3.)
+        aux_write(dirPath, 'model_export1.txt', delay=0.1).join()
+        newFiles = []
+        while not newFiles:
+            newFiles = watcher.wait(2.)
+        assert newFiles == ['model_export1.txt']
+        # solutions alone do not complete the run
+        assert not watcher.isComplete()
+        aux_write(dirPath, 'model_integrals.txt')
+        while not watcher.isComplete():
+            assert watcher.wait(2.)
+        assert watcher.fracComplete() == 1.
+
+
+def test_watcher_timeout(tmpdir):
+    '''Test that waiting without new files returns after the timeout.'''
+    with ExportWatcher(str(tmpdir), {'*.txt': 1}, pollInterval=0.05, usePolling=True) as watcher:
+        assert watcher.wait(0.1) == []
+        assert not watcher.isComplete()
+
+
+def test_watcher_without_events(tmpdir):
+    '''Test that inotify mode still finds files whose writes raise no events.'''
+    dirPath = str(tmpdir)
+    try:
+        watcher = ExportWatcher(dirPath, {'*.txt': 1}, pollInterval=0.05, usePolling=False)
+    except RuntimeError:
+        pytest.skip('inotify is not available')
+    with watcher:
+        # as for a write from another node of a network filesystem:
+        watcher._readEvents = lambda: []
+        aux_write(dirPath, 'model_export0.txt')
+        while not watcher.isComplete():
+            assert watcher.wait(2.) == ['model_export0.txt']
+
+
+def test_watcher_unchanged_dir_mtime(tmpdir):
+    '''Test that polling finds files even if the directory mtime does not change.'''
+    dirPath = str(tmpdir)
+    with ExportWatcher(dirPath, {'*.txt': 1}, pollInterval=0.05, usePolling=True) as watcher:
+        assert watcher.wait(0.1) == []
+        # as on a filesystem whose mtimes are coarser than the time between two writes:
+        stat = os.stat(dirPath)
+        aux_write(dirPath, 'model_export0.txt')
+        os.utime(dirPath, (stat.st_atime, stat.st_mtime))
+        while not watcher.isComplete():
+            assert watcher.wait(2.) == ['model_export0.txt']
+
+
+def test_watcher_drain(tmpdir):
+    '''Test that draining registers files whose events were not read yet.'''
+    dirPath = str(tmpdir)
+    with ExportWatcher(dirPath, {'*.txt': 1}, pollInterval=60.) as watcher:
+        aux_write(dirPath, 'model_export0.txt')
+        assert not watcher.isComplete()
+        assert watcher.drain() == ['model_export0.txt']
+        assert watcher.isComplete()
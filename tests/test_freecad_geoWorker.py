@@ -0,0 +1,84 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import glob
+import FreeCAD
+import Part
+import numpy as np
+import qmt
+from qmt.geoWorker import buildGeometry, GeoWorker
+
+
+def aux_block_model(dirPath, docName, numBlocks=3):
+    '''Helper function to save a FreeCAD document with one square sketch per
+       block, and a model that extrudes each of them into an independent part.
+    '''
+    doc = FreeCAD.newDocument(docName)
+    myModel = qmt.Model(modelPath=os.path.join(dirPath, 'model.json'), load=False)
+    for i in range(numBlocks):
+        sketch = doc.addObject('Sketcher::SketchObject', 'Sketch' + str(i))
+        corners = [(2*i,0,0), (2*i+1,0,0), (2*i+1,1,0), (2*i,1,0)]
+        sketch.addGeometry([Part.Line(FreeCAD.Vector(*corners[j]),
+                                      FreeCAD.Vector(*corners[(j+1) % 4]))
+                            for j in range(4)], False)
+        myModel.addPart('block' + str(i), sketch.Name, 'extrude', 'dielectric',
+                        material='SiO2', z0=0., thickness=1. + i)
+    doc.recompute()
+    fcPath = os.path.join(dirPath, 'blocks.FCStd')
+    doc.saveAs(fcPath)
+    myModel.setPaths(freeCADPath=fcPath)
+    myModel.modelDict['pathSettings']['dirPath'] = dirPath
+    myModel.saveModel()
+    return myModel
+
+
+def aux_step_volumes(dirPath):
+    '''Helper function to read the volumes of the exported STEP files.'''
+    volumes = {}
+    for filePath in glob.glob(os.path.join(dirPath, 'cadParts', '*.step')):
+        volumes[os.path.basename(filePath)] = Part.read(filePath).Volume
+    return volumes
+
+
+def test_parallel_build(tmpdir):
+    '''Test that building independent parts in separate processes exports the
+       same parts as a serial build, with at most one process per core.'''
+    serialModel = aux_block_model(str(tmpdir.mkdir('serial')), 'serialDoc')
+    try:
+        buildGeometry(serialModel)
+    finally:
+        FreeCAD.closeDocument('serialDoc')
+    parallelDir = str(tmpdir.mkdir('parallel'))
+    parallelModel = aux_block_model(parallelDir, 'parallelDoc')
+    try:
+        buildGeometry(parallelModel, numProcesses=2)
+    finally:
+        FreeCAD.closeDocument('parallelDoc')
+    # three independent parts are built in two processes:
+    assert len(glob.glob(os.path.join(parallelDir, 'partBuilds', '*.log'))) == 2
+    serialVolumes = aux_step_volumes(str(tmpdir.join('serial')))
+    parallelVolumes = aux_step_volumes(parallelDir)
+    assert sorted(parallelVolumes) == ['block0.step', 'block1.step', 'block2.step']
+    for fileName, volume in serialVolumes.items():
+        assert np.isclose(parallelVolumes[fileName], volume)
+    for partName, partDict in serialModel.modelDict['3DParts'].items():
+        assert len(parallelModel.modelDict['3DParts'][partName]['fileNames']) == \
+            len(partDict['fileNames'])
+
+
+def test_warm_worker_rollback(tmpdir):
+    '''Test that a warm worker rolls the document back instead of reloading it.'''
+    dirPath = str(tmpdir)
+    myModel = aux_block_model(dirPath, 'warmDoc')
+    FreeCAD.closeDocument('warmDoc')
+    worker = GeoWorker(myModel.modelDict['pathSettings']['freeCADPath'])
+    try:
+        for i in range(2):
+            worker.build(myModel.modelPath)
+            assert worker.reloads == 0
+    finally:
+        worker.close()
+    assert sorted(aux_step_volumes(dirPath)) == ['block0.step', 'block1.step', 'block2.step']
+    assert os.path.isfile(os.path.join(dirPath, 'freeCADModel.FCStd'))
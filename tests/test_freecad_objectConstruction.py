@@ -57,6 +57,22 @@ def aux_unit_square_sketch():
     return sketch
 
 
+def aux_two_square_sketch():
+    '''Helper function to drop a sketch of two separate unit squares, which
+       extrude into two objects.
+    '''
+    sketch = FreeCAD.activeDocument().addObject('Sketcher::SketchObject','Sketch')
+    geoList = []
+    for x0 in [0., 2.]:
+        corners = [(x0,0,0), (x0+1,0,0), (x0+1,1,0), (x0,1,0)]
+        for i in range(4):
+            geoList.append(Part.Line(FreeCAD.Vector(*corners[i]),
+                                     FreeCAD.Vector(*corners[(i+1) % 4])))
+    sketch.addGeometry(geoList,False)
+    FreeCAD.ActiveDocument.recompute()
+    return sketch
+
+
 def test_buildWire():
     '''Test wire via bounding box for default offsets/zBottom.
        TODO: all cases
@@ -89,3 +105,34 @@ def test_modelBuilder_saveFreeCADState():
     mb.saveFreeCADState(fcFilePath)
     assert 'testModel.FCStd' in os.listdir(testDir)
     os.remove(fcFilePath)
+
+
+def test_modelBuilder_importPart(tmpdir):
+    '''Test that a part exported for another process imports with the same objects.'''
+    aux_two_square_sketch()
+    mb = modelBuilder()
+    mb.model.addPart('blocks', 'Sketch', 'extrude', 'dielectric', material='SiO2',
+                     z0=0., thickness=1.)
+    mb.buildPart('blocks')
+    built = mb._buildPartsDict['blocks']
+    assert len(built) == 2
+    brepPath = str(tmpdir.join('blocks.brep'))
+    mb.exportPartShape('blocks', brepPath)
+    FreeCAD.newDocument('importDoc')
+    try:
+        importModel = qmt.Model(modelPath=modelFilePath)
+        importModel.addPart('blocks', 'Sketch', 'extrude', 'dielectric', material='SiO2',
+                            z0=0., thickness=1.)
+        importer = modelBuilder(passModel=importModel)
+        importer.importPart('blocks', brepPath)
+        imported = importer._buildPartsDict['blocks']
+        assert len(imported) == len(built)
+        assert [obj.Label for obj in imported] == ['blocks', 'blocks']
+        assert sorted(importModel.modelDict['3DParts']['blocks']['fileNames']) == \
+            sorted(obj.Name for obj in imported)
+        for builtObj, importedObj in zip(built, imported):
+            assert np.isclose(importedObj.Shape.Volume, builtObj.Shape.Volume)
+            assert np.allclose(getBB(importedObj), getBB(builtObj))
+    finally:
+        FreeCAD.closeDocument('importDoc')
+        FreeCAD.setActiveDocument('testDoc')
@@ -186,3 +186,38 @@ def test_draftOffset():
     draft = Draft.makeRectangle(length=2,height=2,placement=pl,face=False,support=None)
     draft2 = draftOffset(draft, 20)
     assert draft.Height.Value + 40 == draft2.Height.Value
+
+
+def test_EndpointIndex():
+    '''Test that the endpoint index finds the same segments and orientation fixes.'''
+    import numpy as np
+    rng = np.random.RandomState(0)
+    segments = []
+    for center in rng.uniform(-100., 100., (20, 2)):
+        angles = np.sort(rng.uniform(0., 2. * np.pi, 5))
+        points = [(center[0] + np.cos(t), center[1] + np.sin(t), 0.) for t in angles]
+        for i in range(5):
+            a, b = points[i], points[(i + 1) % 5]
+            b = tuple(np.array(b) + rng.uniform(-3e-9, 3e-9, 3))  # within tolerance
+            segments += [[a, b] if rng.rand() < 0.5 else [b, a]]
+    segments = np.array(segments)[rng.permutation(100)]
+
+    for segIndex in range(len(segments)):
+        brute, hashed = segments.copy(), segments.copy()
+        index = EndpointIndex(hashed)
+        assert nextSegment(hashed, segIndex, index=index) == nextSegment(brute, segIndex)
+        assert (hashed == brute).all()  # same orientation fixes
+
+    brute, hashed = segments.copy(), segments.copy()
+    cycle = [nextSegment(brute, 0)]
+    while cycle[-1] != 0:
+        cycle += [nextSegment(brute, cycle[-1])]
+    assert findCycle(hashed, 0, range(100)) == cycle
+    assert len(findCycle(hashed, 0, range(100))) == 5
+    assert (hashed == brute).all()
+
+    ambiguous = np.array([[(0., 0., 0.), (1., 0., 0.)], [(1., 0., 0.), (1., 1., 0.)],
+                          [(1., 0., 0.), (2., 0., 0.)]])
+    with pytest.raises(ValueError) as err:
+        nextSegment(ambiguous, 0, index=EndpointIndex(ambiguous))
+    assert 'possible paths found' in str(err.value)
@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import qmt
+from qmt.geoCache import GeometryCache, geometryKey, unlinkSharedOutputs
+
+
+def aux_built_model(dirPath, width='10'):
+    '''Helper function to set up a model as if geoGen had built it in dirPath.'''
+    myModel = qmt.Model()
+    myModel.modelDict['pathSettings']['dirPath'] = dirPath
+    myModel.modelDict['pathSettings']['freeCADPath'] = None
+    myModel.modelDict['geometricParams']['width'] = (width, 'python')
+    myModel.modelDict['geometricParams']['unused'] = ('1', 'python')
+    myModel.addPart('wire', 'Sketch', 'wire', 'semiconductor', z0=0., thickness='width')
+    myModel.addCrossSection('xs', (1., 0., 0.), 0.)
+    for subDir in ['cadParts', 'stlParts']:
+        os.makedirs(os.path.join(dirPath, subDir))
+    with open(os.path.join(dirPath, 'cadParts', 'wire.step'), 'w') as myFile:
+        myFile.write('step data ' + width)
+    with open(os.path.join(dirPath, 'stlParts', 'wire.stl'), 'w') as myFile:
+        myFile.write('stl data')
+    myModel.registerCadPart('wire', 'Wire001', dirPath + '/cadParts/wire.step')
+    myModel.modelDict['slices']['xs']['parts'] = {'wire': {'geometry': {'Wire001_0': [[0, 0]]}}}
+    return myModel
+
+
+def test_geometryKey(tmpdir):
+    '''Test that the key only depends on geometry inputs.'''
+    model0 = aux_built_model(str(tmpdir.join('geo_0')))
+    key0 = geometryKey(model0.modelDict)
+    model1 = aux_built_model(str(tmpdir.join('geo_1')))
+    model1.modelDict['geometricParams']['unused'] = ('2', 'python')
+    model1.genPhysicsSweep('wire', 'V', [0., 1.])
+    model1.registerCadPart('wire', 'Wire002', None)
+    assert geometryKey(model1.modelDict) == key0
+    model2 = aux_built_model(str(tmpdir.join('geo_2')), width='20')
+    assert geometryKey(model2.modelDict) != key0
+
+
+def test_geometryKey_references(tmpdir):
+    '''Test that parameters used in slices, larger expressions or other parameters enter the key.'''
+    def key(offset='1', base='3'):
+        myModel = aux_built_model(str(tmpdir.mkdtemp()))
+        myModel.modelDict['geometricParams']['offset'] = (offset, 'python')
+        myModel.modelDict['geometricParams']['depth'] = ('base*2', 'python')
+        myModel.modelDict['geometricParams']['base'] = (base, 'python')
+        myModel.modelDict['3DParts']['wire']['z0'] = '-depth/2'
+        myModel.addCrossSection('offsetXs', (0., 1., 0.), 'offset')
+        return geometryKey(myModel.modelDict)
+    key0 = key()
+    assert key(offset='5') != key0
+    assert key(base='5') != key0
+    assert key() == key0
+
+
+def test_fetch_and_store(tmpdir):
+    '''Test that cached outputs are restored into a new instance directory.'''
+    cache = GeometryCache(str(tmpdir.join('cache')))
+    builtModel = aux_built_model(str(tmpdir.join('geo_0')))
+    key = geometryKey(builtModel.modelDict)
+    newDir = str(tmpdir.mkdir('geo_1'))
+    newModel = qmt.Model()
+    newModel.modelDict['pathSettings']['dirPath'] = newDir
+    newModel.addPart('wire', 'Sketch', 'wire', 'semiconductor', z0=0., thickness='width')
+    newModel.addCrossSection('xs', (1., 0., 0.), 0.)
+    assert not cache.fetch(key, newModel)
+    cache.store(key, builtModel)
+    assert cache.fetch(key, newModel)
+    assert open(os.path.join(newDir, 'cadParts', 'wire.step')).read() == 'step data 10'
+    assert os.path.isfile(os.path.join(newDir, 'stlParts', 'wire.stl'))
+    assert newModel.modelDict['3DParts']['wire']['fileNames'] == \
+           {'Wire001': newDir + '/cadParts/wire.step'}
+    assert newModel.modelDict['slices']['xs']['parts'] == \
+           builtModel.modelDict['slices']['xs']['parts']
+
+
+def test_rebuild_after_hit(tmpdir):
+    '''Test that rebuilding an instance after a cache hit leaves the entry unchanged.'''
+    cache = GeometryCache(str(tmpdir.join('cache')))
+    builtModel = aux_built_model(str(tmpdir.join('geo_0')))
+    key = geometryKey(builtModel.modelDict)
+    cache.store(key, builtModel)
+    newDir = str(tmpdir.mkdir('geo_1'))
+    newModel = qmt.Model()
+    newModel.modelDict['pathSettings']['dirPath'] = newDir
+    newModel.addPart('wire', 'Sketch', 'wire', 'semiconductor', z0=0., thickness='width')
+    newModel.addCrossSection('xs', (1., 0., 0.), 0.)
+    assert cache.fetch(key, newModel)
+    unlinkSharedOutputs(newDir)
+    with open(os.path.join(newDir, 'cadParts', 'wire.step'), 'w') as myFile:
+        myFile.write('step data 20')
+    cachedPath = os.path.join(cache.cacheDir, key, 'cadParts', 'wire.step')
+    assert open(cachedPath).read() == 'step data 10'
+    otherDir = str(tmpdir.mkdir('geo_2'))
+    otherModel = qmt.Model()
+    otherModel.modelDict['pathSettings']['dirPath'] = otherDir
+    otherModel.addPart('wire', 'Sketch', 'wire', 'semiconductor', z0=0., thickness='width')
+    otherModel.addCrossSection('xs', (1., 0., 0.), 0.)
+    assert cache.fetch(key, otherModel)
+    assert open(os.path.join(otherDir, 'cadParts', 'wire.step')).read() == 'step data 10'
+
+
+def test_eviction(tmpdir):
+    '''Test that least recently used entries are evicted beyond the size bound.'''
+    cache = GeometryCache(str(tmpdir.join('cache')), maxBytes=1)
+    model0 = aux_built_model(str(tmpdir.join('geo_0')))
+    model1 = aux_built_model(str(tmpdir.join('geo_1')), width='20')
+    key0, key1 = geometryKey(model0.modelDict), geometryKey(model1.modelDict)
+    cache.store(key0, model0)
+    assert os.listdir(cache.cacheDir) == [key0]
+    cache.store(key1, model1)
+    assert os.listdir(cache.cacheDir) == [key1]
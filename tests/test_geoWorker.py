@@ -0,0 +1,25 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import pytest
+from qmt.geoWorker import GeoWorker, _batchComponents
+
+
+def test_dead_worker(tmpdir):
+    '''Test that a worker that cannot start reports an error instead of hanging.'''
+    worker = GeoWorker(str(tmpdir.join('missing.FCStd')))
+    try:
+        with pytest.raises(RuntimeError):
+            worker.build(str(tmpdir.join('model.json')))
+    finally:
+        worker.close()
+
+
+def test_batch_components():
+    '''Test that independent groups of parts are binned into at most one batch per process.'''
+    components = [['a'], ['b', 'c', 'd'], ['e'], ['f', 'g']]
+    batches = _batchComponents(components, 2)
+    assert batches == [['b', 'c', 'd', 'e'], ['f', 'g', 'a']]
+    assert _batchComponents(components, 8) == [['b', 'c', 'd'], ['f', 'g'], ['a'], ['e']]
+    assert _batchComponents([['a', 'b']], 4) == [['a', 'b']]
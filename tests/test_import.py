@@ -0,0 +1,63 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+_timedImport = '''
+import sys, time, json
+start = time.time()
+{}
+print(json.dumps([time.time() - start, sorted(sys.modules)]))
+'''
+
+
+def _importInChild(statement):
+    ''' Time an import statement in a fresh interpreter, and return the time and the names of the
+    loaded modules.
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))] + [path for path in [env.get('PYTHONPATH')] if path])
+    output = subprocess.check_output([sys.executable, '-c', _timedImport.format(statement)],
+                                     env=env)
+    elapsed, modules = json.loads(output.decode('utf-8').splitlines()[-1])
+    return elapsed, set(modules)
+
+
+def test_import_time():
+    elapsed, modules = _importInChild('import qmt')
+    assert 'sympy' not in modules
+    assert 'scipy' not in modules
+    assert 'qmt.physics_constants' not in modules
+    # Regression benchmark: importing qmt must stay well below the cost of sympy alone.
+    sympyElapsed = min(_importInChild('import sympy.physics.units')[0] for _ in range(2))
+    qmtElapsed = min([elapsed] + [_importInChild('import qmt')[0]])
+    print('import qmt: {:.3f} s, import sympy.physics.units: {:.3f} s'.format(qmtElapsed,
+                                                                             sympyElapsed))
+    assert qmtElapsed < sympyElapsed
+
+
+def test_lazy_attributes():
+    import qmt
+    assert qmt.units.meV == qmt.physics_constants.units.meV
+    assert qmt.toFloat(qmt.units.eV / qmt.units.meV) == 1000.
+    assert qmt.constants.pi == qmt.physics_constants.constants.pi
+    assert qmt.matrices.s_x.shape == (2, 2)
+    assert 'units' in dir(qmt) and 'units' in qmt.__all__
+    with pytest.raises(AttributeError):
+        qmt.notAnAttribute
+    elapsed, modules = _importInChild('from qmt import *; units')
+    assert 'qmt.physics_constants' in modules
+
+
+def test_lazy_physics_constants():
+    elapsed, modules = _importInChild('import qmt.physics_constants')
+    assert 'scipy.sparse' not in modules
+    assert 'scipy.constants' not in modules
+    elapsed, modules = _importInChild('import qmt.physics_constants as pc; pc.sparseMatrices')
+    assert 'scipy.sparse' in modules
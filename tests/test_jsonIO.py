@@ -0,0 +1,63 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import os
+import json
+import numpy as np
+import pytest
+from qmt.jsonIO import loadJSON, saveJSON, setJSONBackend, getJSONBackend, orjson
+
+backends = ['json'] + (['orjson'] if orjson is not None else [])
+
+
+@pytest.fixture(params=backends)
+def backend(request):
+    previous = getJSONBackend()
+    setJSONBackend(request.param)
+    yield request.param
+    setJSONBackend(previous)
+
+
+def test_round_trip(tmpdir, backend):
+    '''Test that all backends write the same json as the standard library.'''
+    data = {'buildOrder': {0: 'wire', 1: 'gate'}, 'params': ('10', 'python'),
+            'values': [1.5, np.float64(0.1), 3, None, True], 'big': 2 ** 70,
+            'name': u'Ångström'}
+    filePath = str(tmpdir.join('model.json'))
+    saveJSON(data, filePath)
+    assert json.load(open(filePath)) == json.loads(json.dumps(data))
+    assert loadJSON(filePath) == json.loads(json.dumps(data))
+    # files written by the standard library, including NaN, are read back
+    with open(filePath, 'w') as myFile:
+        json.dump({'x': float('nan')}, myFile)
+    assert np.isnan(loadJSON(filePath)['x'])
+
+
+def test_atomic_write(tmpdir, backend):
+    '''Test that a failed write leaves the previous file and no scratch files.'''
+    filePath = str(tmpdir.join('model.json'))
+    saveJSON({'a': 1}, filePath)
+    with pytest.raises(TypeError):
+        saveJSON({'a': object()}, filePath)
+    assert loadJSON(filePath) == {'a': 1}
+    assert os.listdir(str(tmpdir)) == ['model.json']
+
+
+def test_non_finite_round_trip(tmpdir, backend):
+    '''Test that NaN and Infinity survive a round trip instead of turning into null.'''
+    filePath = str(tmpdir.join('model.json'))
+    saveJSON({'a': float('nan'), 'b': float('inf'), 'c': [1., -float('inf')], 'd': None}, filePath)
+    data = loadJSON(filePath)
+    assert np.isnan(data['a'])
+    assert data['b'] == float('inf') and data['c'] == [1., -float('inf')]
+    assert data['d'] is None
+    saveJSON({'field': np.array([0.5, np.nan]), 'x': np.float32('inf')}, filePath)
+    data = loadJSON(filePath)
+    assert data['field'][0] == 0.5 and np.isnan(data['field'][1])
+    assert data['x'] == float('inf')
+    # values nested below nulls and in object arrays are found as well
+    saveJSON({'a': None, 'b': [{'c': (1, float('nan'))}], 'd': np.array([None, -np.inf])}, filePath)
+    data = loadJSON(filePath)
+    assert data['a'] is None and np.isnan(data['b'][0]['c'][1])
+    assert data['d'][0] is None and data['d'][1] == -float('inf')
@@ -2,8 +2,11 @@
 # Licensed under the MIT License.
 
 from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
 from pytest import approx
 import qmt.materials as materials
+import qmt.physics_constants as pc
 
 
 def test_band_offsets():
@@ -80,6 +83,20 @@ def test_band_offsets_fallback():
            approx(materials.valence_band_offset(mat1, mat3))
 
 
+def test_band_offsets_fallback_printed_once(capsys, monkeypatch):
+    """Test that the fallback on Anderson's rule is only reported on the first call."""
+    monkeypatch.setattr(materials, '_printedFallbacks', set())
+    matlib = materials.Materials()
+    matlib.genMat('GaAs', 'semi', electronAffinity=4070., directBandGap=1519.)
+    mat1 = matlib.find('InSb', eunit='eV')
+    mat2 = matlib.find('GaAs', eunit='eV')
+    materials.conduction_band_offset(mat2, mat1)
+    assert "Anderson's rule" in capsys.readouterr().out
+    for i in range(3):
+        materials.conduction_band_offset(mat2, mat1)
+    assert capsys.readouterr().out == ''
+
+
 def test_effective_mass():
     """Test calculation of valence band masses from Luttinger parameters."""
     matlib = materials.Materials()
@@ -106,3 +123,197 @@ def test_effective_mass():
     assert inas.holeMass('heavy', 'dos') == approx(0.41, rel=0.2)
     assert inas.holeMass('light', 'dos') == approx(0.026, rel=0.2)
     assert inas.holeMass('dos', 'dos') == approx(0.41, rel=0.2)
+
+
+def test_shared_materials(tmpdir):
+    """Test that the shared database is memoized and reloaded when its file changes."""
+    matPath = str(tmpdir.join('materials.json'))
+    matlib = materials.Materials(matPath)
+    matlib.genMat('Al', 'metal', relativePermittivity=1000, workFunction=4280.)
+    matlib.save()
+    shared = materials.sharedMaterials(matPath)
+    assert materials.sharedMaterials(matPath) is shared
+    assert dict(shared.find('Al', eunit='meV')) == dict(shared.find('Al', eunit='meV'))
+    # modifying a returned material does not affect later lookups
+    shared.find('Al', eunit='meV').properties['workFunction'] = 99.
+    assert shared.find('Al', eunit='meV')['workFunction'] == approx(4280.)
+    # private instances do not share the parsed data
+    private = materials.Materials(matPath)
+    private.matDict['Al']['workFunction'] = 0.
+    assert materials.Materials(matPath).find('Al', eunit='meV')['workFunction'] == approx(4280.)
+    # changes to the database invalidate the memo
+    private.genMat('Al', 'metal', relativePermittivity=1000, workFunction=4000.)
+    assert private.find('Al', eunit='meV')['workFunction'] == approx(4000.)
+    private.save()
+    assert materials.sharedMaterials(matPath) is not shared
+    assert materials.sharedMaterials(matPath).find('Al', eunit='meV')['workFunction'] == \
+           approx(4000.)
+    # memoized alloys are protected the same way
+    default = materials.sharedMaterials()
+    alloy = default.find('InAs80Sb20', eunit='meV')
+    alloy.properties['electronMass'] = 99.
+    assert default.find('InAs80Sb20', eunit='meV')['electronMass'] < 1.
+
+
+def test_binary_alloy_properties():
+    """Test that vectorized alloy properties match alloys constructed one by one."""
+    matlib = materials.Materials()
+    x = np.linspace(0., 1., 11)
+    alloys = matlib.binaryAlloyProperties('InSb', 'InAs', x)
+    assert alloys['type'] == 'semi'
+    for i, xi in enumerate(x):
+        alloy = matlib._makeBinaryAlloy('InSb', 'InAs', xi)
+        assert set(alloy) == set(alloys)
+        for key, val in alloy.items():
+            if key != 'type':
+                assert alloys[key][i] == approx(val)
+    named = matlib.find('InAs80Sb20', eunit='meV')
+    assert matlib.binaryAlloyProperties('InAs', 'InSb', [0.2])['directBandGap'][0] == \
+           approx(named['directBandGap'])
+    grid = matlib.binaryAlloyProperties('GaAs', 'InAs', np.full((2, 3), 0.5))
+    assert grid['electronMass'].shape == (2, 3)
+    with pytest.raises(ValueError):
+        matlib.binaryAlloyProperties('GaAs', 'InAs', [1.5])
+
+
+def test_numeric_mode():
+    symbolic = materials.Materials()
+    numeric = materials.Materials(eunit='eV')
+    for name in ('InAs', 'GaSb', 'InAs80Sb20', 'Al'):
+        mat = numeric.find(name)
+        assert mat.energyUnit == symbolic.find(name, eunit='eV').energyUnit
+        assert isinstance(mat.energyUnit, float)
+        assert dict(mat) == dict(symbolic.find(name, eunit='eV'))
+    for name in ('InAs', 'GaSb', 'InAs80Sb20'):
+        mat, ref = numeric.find(name), numeric.find('InSb')
+        assert numeric.conductionBandMinimum(mat) == \
+            symbolic.conductionBandMinimum(symbolic.find(name, eunit='eV'))
+        assert numeric.valenceBandMaximum(mat) == \
+            symbolic.valenceBandMaximum(symbolic.find(name, eunit='eV'))
+        assert materials.conduction_band_offset(mat, ref) == approx(
+            pc.toFloat(materials.conduction_band_offset(symbolic.find(name),
+                                                        symbolic.find('InSb')) / pc.units.eV))
+    assert isinstance(numeric.conductionBandMinimum(numeric.find('InAs')), float)
+
+    # Array-valued materials do not modify their properties when queried:
+    x = np.linspace(0, 1, 5)
+    alloy = numeric.binaryAlloyProperties('InAs', 'InSb', x)
+    mat = materials.Material('InAsSb', alloy, eunit='eV')
+    gaps = mat['directBandGap']
+    assert gaps == approx(mat['directBandGap'])
+    assert alloy['directBandGap'] == approx(gaps * 1e3)
+    assert numeric.conductionBandMinimum(mat)[2] == \
+        approx(numeric.conductionBandMinimum(numeric.find('InAs50Sb50')))
+
+
+def test_band_alignment(capsys):
+    matlib = materials.Materials()
+    table = matlib.bandAlignment('eV')
+    assert matlib.bandAlignment('eV') is table
+    assert 'InAs' in table.names and 'Al' not in table.names
+    for name in table.names:
+        mat = matlib.find(name, eunit='eV')
+        assert table.conductionBandMinimum(name) == matlib.conductionBandMinimum(mat)
+        assert table.valenceBandMaximum(name) == matlib.valenceBandMaximum(mat)
+    capsys.readouterr()
+
+    # Si has no valenceBandOffset, so its band edges follow Anderson's rule:
+    assert list(table.fallbacks) == ['Si']
+    inas, gaas = table.index('InAs'), table.index('GaAs')
+    assert table.conductionBandOffsets()[inas, gaas] == approx(materials.conduction_band_offset(
+        matlib.find('InAs', eunit='eV'), matlib.find('GaAs', eunit='eV')))
+    assert table.valenceBandOffsets()[gaas, inas] == approx(materials.valence_band_offset(
+        matlib.find('GaAs', eunit='eV'), matlib.find('InAs', eunit='eV')))
+    assert table.conductionBandOffsets().shape == (len(table.names),) * 2
+
+    # Building the table does not print, and changing the database invalidates it:
+    matlib.genMat('InSb', 'semi', electronAffinity=4590., directBandGap=235.)
+    other = matlib.bandAlignment('eV')
+    assert capsys.readouterr().out == ''
+    assert other is not table
+    # Without a valenceBandOffset for the reference, every material falls back:
+    assert sorted(other.fallbacks) == other.names
+    assert other.conductionBandMinimum('GaAs') == approx(-4.07)
+    with pytest.raises(KeyError):
+        table.index('Al')
+
+
+def test_graded_property_fields(tmpdir):
+    matlib = materials.Materials(eunit='eV')
+    x = np.linspace(0, 1, 4 * 5 * 6).reshape(4, 5, 6)
+    fields = matlib.gradedPropertyFields('InAs', 'InSb', x, chunkSize=7)
+    assert sorted(fields) == ['conductionBandMinimum', 'electronMass', 'relativePermittivity',
+                              'valenceBandMaximum']
+    index = (1, 2, 3)
+    name = 'InAs{0}Sb{1}'.format(100 * (1 - x[index]), 100 * x[index])
+    mat = matlib.find(name)
+    assert fields['electronMass'].shape == x.shape
+    assert fields['electronMass'][index] == approx(mat['electronMass'])
+    assert fields['relativePermittivity'][index] == approx(mat['relativePermittivity'])
+    assert fields['conductionBandMinimum'][index] == approx(matlib.conductionBandMinimum(mat))
+    assert fields['valenceBandMaximum'][index] == approx(matlib.valenceBandMaximum(mat))
+
+    written = matlib.gradedPropertyFields('InAs', 'InSb', x, properties=['directBandGap'],
+                                          eunit='meV', chunkSize=50, outDir=str(tmpdir))
+    loaded = np.load(str(tmpdir.join('directBandGap.npy')), mmap_mode='r')
+    assert loaded.shape == x.shape
+    assert np.array_equal(loaded, written['directBandGap'])
+    assert loaded[index] == approx(matlib.find(name, eunit='meV')['directBandGap'])
+
+
+def test_graded_property_fields_strided(tmpdir, monkeypatch):
+    matlib = materials.Materials(eunit='eV')
+    grid = np.lib.format.open_memmap(str(tmpdir.join('x.npy')), mode='w+', dtype=float,
+                                     shape=(8, 6, 5))
+    grid[...] = np.linspace(0, 1, grid.size).reshape(grid.shape)
+    x = grid[::2, :, 1:].transpose(2, 0, 1)
+    assert not x.flags.contiguous
+    reference = matlib.gradedPropertyFields('InAs', 'InSb', np.ascontiguousarray(x))
+    chunkSizes = []
+    alloyProperties = matlib.binaryAlloyProperties
+
+    def recordChunk(nameA, nameB, chunk):
+        chunkSizes.append(np.size(chunk))
+        return alloyProperties(nameA, nameB, chunk)
+    monkeypatch.setattr(matlib, 'binaryAlloyProperties', recordChunk)
+    fields = matlib.gradedPropertyFields('InAs', 'InSb', x, chunkSize=7)
+    assert max(chunkSizes) <= 7
+    assert sum(chunkSizes) == x.size
+    for prop in reference:
+        assert fields[prop].shape == x.shape
+        assert np.allclose(fields[prop], reference[prop])
+
+
+def test_compiled_materials(tmpdir, monkeypatch):
+    """Test that new processes load the compiled form and that it follows the json."""
+    matPath = str(tmpdir.join('materials.json'))
+    reference = materials.Materials()
+    reference.matPath = matPath
+    reference.save()
+    # compiled forms are only kept on request
+    monkeypatch.delenv('QMT_MATERIALS_CACHE', raising=False)
+    monkeypatch.setattr(materials, '_dbCache', {})
+    materials.Materials(matPath)
+    assert not tmpdir.join('cache').exists()
+    monkeypatch.setenv('QMT_MATERIALS_CACHE', str(tmpdir.join('cache')))
+    monkeypatch.setattr(materials, '_dbCache', {})
+    materials.Materials(matPath)
+    assert len(tmpdir.join('cache').listdir()) == 1
+    # a new process reads the compiled form instead of the json
+    monkeypatch.setattr(materials, '_dbCache', {})
+    monkeypatch.setattr(materials.json, 'loads', None)
+    compiled = materials.Materials(matPath)
+    monkeypatch.undo()
+    monkeypatch.setenv('QMT_MATERIALS_CACHE', str(tmpdir.join('cache')))
+    assert compiled.matDict == reference.matDict
+    assert compiled.bowingParameters == reference.bowingParameters
+    assert compiled.find('InAs80Sb20', eunit='meV')['directBandGap'] == \
+           approx(reference.find('InAs80Sb20', eunit='meV')['directBandGap'])
+    # changing the json recompiles it
+    compiled.genMat('Al', 'metal', relativePermittivity=1000, workFunction=4000.)
+    compiled.save()
+    monkeypatch.setattr(materials, '_dbCache', {})
+    assert materials.Materials(matPath).find('Al', eunit='meV')['workFunction'] == approx(4000.)
+    monkeypatch.setattr(materials, '_dbCache', {})
+    monkeypatch.setattr(materials.json, 'loads', None)
+    assert materials.Materials(matPath).find('Al', eunit='meV')['workFunction'] == approx(4000.)
@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from pytest import approx
+from qmt.quantityArray import QuantityArray
+import qmt.materials as materials
+
+
+def test_conversion():
+    buffer = np.linspace(0., 100., 11)
+    potential = QuantityArray(buffer, 'meV')
+    assert potential.magnitude is buffer
+    inEV = potential.to('eV')
+    assert inEV.value is buffer  # converting never copies
+    assert inEV.magnitude == approx(buffer / 1000.)
+    assert potential.si == approx(buffer * 1.602176634e-22)
+    assert potential.to('microeV').to('meV').magnitude is buffer
+    with pytest.raises(ValueError):
+        potential.to('nm')
+
+
+def test_arithmetic():
+    gap = QuantityArray(np.array([[235.], [417.]]), 'meV')
+    shift = QuantityArray(np.array([0.1, 0.2, 0.3]), 'eV')
+    total = gap + shift  # broadcasts, in the unit of the left operand
+    assert total.shape == (2, 3)
+    assert total.unit == 'meV'
+    assert total.magnitude == approx(gap.value + 1000. * shift.value)
+    assert (shift - gap).to('meV').magnitude == approx(1000. * shift.value - gap.value)
+    assert (2 * gap).magnitude == approx(2 * gap.value)
+    assert (np.float64(2.) * gap).unit == 'meV'
+    assert (gap / 2).to('eV').magnitude == approx(gap.value / 2000.)
+    with pytest.raises(ValueError):
+        gap + QuantityArray(1., 'nm')
+    with pytest.raises(ValueError):
+        gap + 1.
+
+    # Products carry their dimension, and cancel to plain numbers:
+    field = QuantityArray(np.ones(4), 'volt') / QuantityArray(10., 'nm')
+    assert field.dimension == (1, 1, -3, -1, 0)
+    assert field.si == approx(1e8)
+    ratio = gap / QuantityArray(1., 'eV')
+    assert ratio.dimension == (0, 0, 0, 0, 0)
+    assert ratio.si == approx(gap.value / 1000.)
+    area = QuantityArray(3., 'nm') ** 2
+    assert area.dimension == (2, 0, 0, 0, 0) and area.si == approx(9e-18)
+    assert (1 / QuantityArray(2., 's')).dimension == (0, 0, -1, 0, 0)
+    assert gap[1].magnitude == approx([417.])
+
+
+def test_material_quantities():
+    matlib = materials.Materials(eunit='eV')
+    inas = matlib.find('InAs')
+    gap = inas.quantity('directBandGap')
+    assert gap.to('eV').magnitude == approx(inas['directBandGap'])
+    mass = inas.quantity('electronMass').to('kg')
+    assert mass.magnitude == approx(0.026 * 9.1093837e-31)
+    assert inas.quantity('relativePermittivity').magnitude == approx(15.15)
+    assert inas.quantity('surfaceChargeDensity').si == approx(3e12 * 1e4 / 1.602176634e-19)
+
+    # Array-valued alloy properties work the same way:
+    x = np.linspace(0., 1., 5)
+    alloy = materials.Material('InAsSb', matlib.binaryAlloyProperties('InAs', 'InSb', x))
+    offsets = alloy.quantity('valenceBandOffset') + QuantityArray(np.zeros(5), 'eV')
+    assert offsets.magnitude == approx(alloy.properties['valenceBandOffset'])
@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from __future__ import absolute_import, division, print_function
+import json
+from qmt.timingTrace import Tracer, traceSpan
+
+
+def test_spans(tmpdir):
+    '''Test that nested spans are recorded as Chrome trace events.'''
+    tracer = Tracer()
+    with tracer.span('outer', cat='jobStep'):
+        with traceSpan(tracer, 'inner', cat='buildPart', directive='wire'):
+            pass
+    with traceSpan(None, 'ignored'):
+        pass
+    inner, outer = tracer.events
+    assert (inner['name'], outer['name']) == ('inner', 'outer')
+    assert inner['args'] == {'directive': 'wire'}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert all(event['ph'] == 'X' for event in tracer.events)
+
+
+def test_write_appends(tmpdir):
+    '''Test that writing a trace keeps the events already in the file.'''
+    tracePath = str(tmpdir.join('trace.json'))
+    for name in ['geoGen', 'postProc']:
+        tracer = Tracer()
+        with tracer.span(name):
+            pass
+        tracer.write(tracePath)
+    events = json.load(open(tracePath))['traceEvents']
+    assert [event['name'] for event in events] == ['geoGen', 'postProc']
+
+
+def test_write_replaces_rerun_steps(tmpdir):
+    '''Test that rerunning a job step replaces its events instead of adding to them.'''
+    tracePath = str(tmpdir.join('trace.json'))
+    for name in ['geoGen', 'postProc', 'geoGen', 'geoGen']:
+        tracer = Tracer()
+        with tracer.step(name, instance='geo_0'):
+            with tracer.span('part'):
+                pass
+        tracer.write(tracePath)
+    events = json.load(open(tracePath))['traceEvents']
+    assert [(event['name'], event['args']['jobStep']) for event in events] == \
+        [('part', 'postProc'), ('postProc', 'postProc'), ('part', 'geoGen'), ('geoGen', 'geoGen')]
+    tracer.write(tracePath, merge=False)
+    assert len(json.load(open(tracePath))['traceEvents']) == 2
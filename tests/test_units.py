@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 
 from __future__ import absolute_import, division, print_function
+import pytest
 from pytest import approx
 import qmt.physics_constants as pc
 
@@ -30,3 +31,46 @@ def test_matrices():
     assert m.s_x * m.s_y + m.s_y * m.s_x == m.s_0 * 0
     assert m.s_x * m.s_x + m.s_x * m.s_x == 2 * m.s_0
     assert m.tau_zx * m.tau_zx == m.tau_00
+
+
+def test_numeric_units():
+    base = (u.m, u.kg, u.s, pc.spu.A, u.K)
+    for table in (vars(u), vars(c)):
+        for name, value in table.items():
+            factor, dimension = pc.siFactor(name)
+            expr = 1
+            for unit, exponent in zip(base, dimension):
+                expr *= unit ** exponent
+            assert pc.toFloat(value / expr) == approx(factor, rel=1e-8)
+    assert pc.conversionFactor('meV', 'eV') == pc.toFloat(u.meV / u.eV)
+    assert pc.conversionFactor('mK', 'K') == 1e-3
+    assert pc.convert(2., 'nm', 'angstrom') == approx(20.)
+    with pytest.raises(ValueError):
+        pc.conversionFactor('nm', 'eV')
+    with pytest.raises(KeyError):
+        pc.siFactor('furlong')
+
+    assert pc.parseUnit('meV') is u.meV
+    assert pc.parseUnit(u.meV) is u.meV
+    with pytest.raises(RuntimeError):
+        pc.parseUnit('__dict__')
+    assert pc.toFloat(u.eV / u.meV) == pc.toFloat(u.eV / u.meV) == 1000.
+
+
+def test_numeric_matrices():
+    import numpy as np
+    import scipy.sparse as sp
+    numeric, sparse = pc.numericMatrices, pc.sparseMatrices
+    for name in vars(m):
+        dense = np.array(getattr(m, name).tolist(), dtype=complex)
+        assert np.array_equal(getattr(numeric, name), dense)
+        assert sp.issparse(getattr(sparse, name))
+        assert np.array_equal(getattr(sparse, name).toarray(), dense)
+    assert sorted(vars(numeric)) == sorted(vars(m)) == sorted(vars(sparse))
+
+    hopping = sp.random(50, 50, density=0.05, format='csr', random_state=0)
+    kron = pc.sparseKron('tau_zx', hopping)
+    assert sp.isspmatrix_csr(kron) and kron.shape == (200, 200)
+    assert np.allclose(kron.toarray(), np.kron(numeric.tau_zx, hopping.toarray()))
+    assert np.allclose(pc.sparseKron(numeric.s_y, 's_z', hopping, format='coo').toarray(),
+                       np.kron(np.kron(numeric.s_y, numeric.s_z), hopping.toarray()))